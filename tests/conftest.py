@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from themis.modules.common.calls import NodeCounter
+from themis.modules.common.config import Config
+from themis.modules.transforming.grapher import Grapher
+from themis.modules.transforming.parser import CallParser
+
+
+DATA = os.path.join(os.path.dirname(__file__), os.pardir, "themis", "data")
+# small traces of themis/data with enter/exit pairs, unfinished calls and streams
+TRACES = [
+    "libcalls_PolisMassa_Client_3_filtered.txt",
+    "libcalls_Abafar_Client_filtered.txt",
+    "libcalls_dbclient_filtered.txt",
+    "libcalls_ssh-6.0_filtered.txt",
+]
+
+
+@pytest.fixture(params=TRACES, ids=lambda name: name[len("libcalls_"):-len("_filtered.txt")])
+def trace(request):
+    # the path of each of the sample traces
+    return os.path.join(DATA, request.param)
+
+
+@pytest.fixture
+def build_graph():
+    # the graph of a trace, with node ids counted from 1 as in a fresh run
+
+    def build(path, coalesce=False):
+        NodeCounter.oid = 1
+        with open(path) as infile:
+            return Grapher(CallParser(infile), coalesce).into_graph()
+
+    return build
+
+
+@pytest.fixture
+def config(tmp_path):
+    # of the executable "sample", with every directory under tmp_path
+    directories = dict(
+        (name, str(tmp_path / name.rsplit("_", 1)[0]))
+        for name in ("lib_dir", "bin_dir", "trace_dir", "trusted_graph_dir", "dirty_graph_dir", "result_dir", "img_dir", "sample_dir")
+    )
+    for directory in directories.values():
+        os.makedirs(directory)
+    return Config(
+        **directories,
+        traced_libcalls_file=str(tmp_path / "libcalls.txt"),
+        executable="sample",
+        args=[]
+    )
@@ -0,0 +1,65 @@
+import os
+import shutil
+
+from themis.modules.common.records import format_record
+from themis.modules.transforming.bintrace import BinaryTraceReader, convert_text_trace
+from themis.modules.transforming.parser import record_from_line
+from themis.modules.transforming.transform import transform
+
+
+def read_lines(trace):
+    with open(trace) as infile:
+        return [line.rstrip("\n") for line in infile if record_from_line(line) is not None]
+
+
+def timed_and_repeated(lines):
+    # the data traces have neither, every other record gets a time and every fifth a repeat count
+    records = [record_from_line(line) for line in lines]
+    return [
+        format_record(record._replace(
+            time=round(i * 1.237, 3) if i % 2 == 0 else None,
+            repeat=i % 7 + 2 if i % 5 == 0 else 1
+        ))
+        for i, record in enumerate(records)
+    ]
+
+
+def round_trip(lines, tmp_path):
+    text = tmp_path / "trace_filtered.txt"
+    binary = tmp_path / "trace.bin"
+    text.write_text("".join(f"{line}\n" for line in lines))
+    convert_text_trace(str(text), str(binary))
+    with BinaryTraceReader(str(binary)) as reader:
+        return [format_record(record) for record in reader.records()]
+
+
+def test_round_trip(trace, tmp_path):
+    # to the lines as the records format them, call ids like <09306> lose their leading zeros
+    lines = read_lines(trace)
+    assert round_trip(lines, tmp_path) == [format_record(record_from_line(line)) for line in lines]
+
+
+def test_round_trip_timed_and_repeated(trace, tmp_path):
+    lines = timed_and_repeated(read_lines(trace))
+    assert any(" ms  " in line for line in lines) and any(line.endswith("]") for line in lines)
+    assert round_trip(lines, tmp_path) == lines
+
+
+def test_newer_text_trace_is_not_shadowed(config, build_graph, trace):
+    config.transform_cache = False
+    text = f"{config.trace_dir}/libcalls_sample_filtered.txt"
+    binary = f"{config.trace_dir}/libcalls_sample.bin"
+    shutil.copy(os.path.join(os.path.dirname(trace), "libcalls_ssh-6.1_filtered.txt"), text)
+    convert_text_trace(text, binary)
+    os.utime(binary, (1, 1))
+    shutil.copy(trace, text)
+
+    expected = build_graph(text)
+    graph = transform(config, False)
+    assert [call.func.funcname for call in graph.calls] == [call.func.funcname for call in expected.calls]
+    assert graph.indices.tolist() == expected.indices.tolist()
+
+    convert_text_trace(text, binary)
+    os.utime(text, (1, 1))
+    graph = transform(config, False)
+    assert [call.func.funcname for call in graph.calls] == [call.func.funcname for call in expected.calls]
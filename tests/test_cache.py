@@ -0,0 +1,100 @@
+import pytest
+
+from themis.modules.common.calls import NodeCounter
+from themis.modules.transforming import transform as transform_module
+from themis.modules.transforming.cache import TransformCache
+from themis.modules.transforming.diagnostics import Diagnostics
+from themis.modules.transforming.transform import transform
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    # the number of parsers transform created, a cache hit or a resume creates none
+    count = [0]
+    parser = transform_module.CallParser
+
+    def counting(*args, **kwargs):
+        count[0] += 1
+        return parser(*args, **kwargs)
+
+    monkeypatch.setattr(transform_module, "CallParser", counting)
+    return count
+
+
+@pytest.fixture
+def resumes(monkeypatch):
+    count = [0]
+    resume = TransformCache.resume
+
+    def counting(self, *args, **kwargs):
+        count[0] += 1
+        return resume(self, *args, **kwargs)
+
+    monkeypatch.setattr(TransformCache, "resume", counting)
+    return count
+
+
+def lines_of(trace):
+    # the lines of a trace, the last one terminated so that an append starts on a new line
+    with open(trace) as infile:
+        lines = infile.readlines()
+    lines[-1] = lines[-1].rstrip("\n") + "\n"
+    return lines
+
+
+def run(config):
+    NodeCounter.oid = 1
+    diagnostics = Diagnostics()
+    graph = transform(config, False, diagnostics)
+    return graph, diagnostics.counts
+
+
+def same(graph, expected):
+    return list(graph.calls) == list(expected.calls) and graph.indices.tolist() == expected.indices.tolist() \
+        and graph.edge_types.tolist() == expected.edge_types.tolist()
+
+
+def test_warm_hit(config, trace, parses):
+    text = f"{config.trace_dir}/libcalls_sample_filtered.txt"
+    with open(text, "w") as file:
+        file.writelines(lines_of(trace))
+
+    cold, cold_counts = run(config)
+    warm, warm_counts = run(config)
+    assert parses[0] == 1
+    assert same(warm, cold) and warm_counts == cold_counts
+
+
+@pytest.mark.parametrize("share", [0.25, 0.5, 0.9])
+def test_append_resumes(config, trace, parses, resumes, share):
+    lines = lines_of(trace)
+    cut = int(len(lines) * share)
+    text = f"{config.trace_dir}/libcalls_sample_filtered.txt"
+    with open(text, "w") as file:
+        file.writelines(lines[:cut])
+    run(config)
+    with open(text, "a") as file:
+        file.writelines(lines[cut:])
+
+    graph, counts = run(config)
+    assert parses[0] == 1 and resumes[0] == 1
+
+    config.transform_cache = False
+    expected, expected_counts = run(config)
+    assert same(graph, expected) and counts == expected_counts
+
+
+@pytest.mark.parametrize("setting, value", [("coalesce_calls", True), ("parse_max_pending", 4)])
+def test_changed_setting_misses(config, trace, parses, setting, value):
+    text = f"{config.trace_dir}/libcalls_sample_filtered.txt"
+    with open(text, "w") as file:
+        file.writelines(lines_of(trace))
+
+    run(config)
+    setattr(config, setting, value)
+    graph, _ = run(config)
+    assert parses[0] == 2
+
+    config.transform_cache = False
+    expected, _ = run(config)
+    assert same(graph, expected)
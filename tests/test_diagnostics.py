@@ -0,0 +1,54 @@
+import json
+
+from themis.modules.transforming.diagnostics import SAMPLES, Anomaly, Diagnostics
+from themis.modules.transforming.grapher import Grapher
+from themis.modules.transforming.parser import CallParser
+
+
+def reported(count, func="read", anomaly=Anomaly.CLOSED_FD):
+    diagnostics = Diagnostics()
+    for fd in range(count):
+        diagnostics.report(anomaly, func, hex(fd))
+    return diagnostics
+
+
+def test_report_keeps_samples():
+    diagnostics = reported(SAMPLES + 5)
+    assert diagnostics.counts == {(Anomaly.CLOSED_FD, "read"): SAMPLES + 5}
+    assert diagnostics.samples[Anomaly.CLOSED_FD] == [f"read using closed fd {hex(fd)}" for fd in range(SAMPLES)]
+
+
+def test_merge_respects_samples():
+    first = reported(SAMPLES - 3)
+    second = reported(7)
+    second.report(Anomaly.UNKNOWN_FD, "write", "0x9")
+    first.merge(second)
+
+    assert first.counts == {(Anomaly.CLOSED_FD, "read"): SAMPLES + 4, (Anomaly.UNKNOWN_FD, "write"): 1}
+    assert first.total == SAMPLES + 5
+    # the first ones in the order of the trace
+    assert first.samples[Anomaly.CLOSED_FD] == \
+        [f"read using closed fd {hex(fd)}" for fd in range(SAMPLES - 3)] + \
+        [f"read using closed fd {hex(fd)}" for fd in range(3)]
+    assert first.samples[Anomaly.UNKNOWN_FD] == ["input fd 0x9 was never created"]
+
+
+def test_merge_into_full():
+    first = reported(SAMPLES)
+    first.merge(reported(4))
+    assert len(first.samples[Anomaly.CLOSED_FD]) == SAMPLES
+    assert first.counts[(Anomaly.CLOSED_FD, "read")] == SAMPLES + 4
+
+
+def test_dict_round_trip(trace):
+    diagnostics = Diagnostics()
+    with open(trace) as infile:
+        Grapher(CallParser(infile, diagnostics=diagnostics)).into_graph()
+    diagnostics.report(Anomaly.UNMATCHED_LINE, detail="garbage\n")
+
+    data = json.loads(json.dumps(diagnostics.to_dict()))
+    restored = Diagnostics.from_dict(data)
+    assert restored.counts == diagnostics.counts
+    assert restored.samples == diagnostics.samples
+    assert restored.to_dict() == data
+    assert restored.summary() == diagnostics.summary()
@@ -0,0 +1,46 @@
+import networkx as nx
+import pytest
+
+from themis.modules.transforming.gexf import GEXFStreamWriter, GEXFWriter, write_gexf
+
+
+def read(path):
+    graph = nx.read_gexf(path)
+    return dict(graph.nodes(data=True)), sorted(graph.edges(data=True)), graph.graph
+
+
+def written(graph, tmp_path):
+    # by the stream writer and by the former writer, as networkx reads them back
+    assert GEXFStreamWriter.supports(graph)
+    stream = str(tmp_path / "stream.gexf")
+    write_gexf(graph.copy(), stream)
+    former = str(tmp_path / "former.gexf")
+    writer = GEXFWriter(prettyprint=False)
+    writer.add_graph(graph.copy())
+    writer.write(former)
+    return read(stream), read(former)
+
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_stream_writer_matches(trace, build_graph, tmp_path, coalesce):
+    stream, former = written(build_graph(trace, coalesce).to_networkx(), tmp_path)
+    assert stream == former
+
+
+def test_stream_writer_matches_other_data(tmp_path):
+    graph = nx.path_graph(5, create_using=nx.DiGraph)
+    for node in graph:
+        graph.nodes[node].update(weight=node * 0.5, name=f"n{node}", odd=bool(node % 2))
+    for start, end in graph.edges:
+        graph.edges[start, end].update(weight=2.0, count=start)
+    stream, former = written(graph, tmp_path)
+    assert stream == former
+
+
+def test_multigraphs_use_the_former_writer(tmp_path):
+    graph = nx.MultiDiGraph()
+    graph.add_edges_from([(0, 1), (0, 1), (1, 2)])
+    assert not GEXFStreamWriter.supports(graph)
+    path = str(tmp_path / "graph.gexf")
+    write_gexf(graph, path)
+    assert nx.read_gexf(path).number_of_edges() == 3
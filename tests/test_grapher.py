@@ -0,0 +1,52 @@
+from themis.modules.common.calls import NodeCounter
+from themis.modules.transforming.grapher import Grapher
+from themis.modules.transforming.parser import CallParser
+
+
+TRACE = """\
+  open::enter<1>(pathname="/tmp/a", flags=0x2)
+  open::exit<1>(retval=0x4)
+  write(fd=0x4, buf=0x1000, count=0x10) [x3]
+  write(fd=0x4, buf=0x1000, count=0x20)
+  write(fd=0x4, buf=0x1000, count=0x30)
+  read(fd=0x4, buf=0x2000, count=0x8)
+  read(fd=0x4, buf=0x2000, count=0x8)
+  close(fd=0x4)
+  close(fd=0x4)
+  open::enter<2>(pathname="/tmp/a", flags=0x2)
+  open::exit<2>(retval=0x4)
+  write(fd=0x4, buf=0x1000, count=0x10)
+  close(fd=0x4)
+"""
+
+
+def nodes(coalesce):
+    NodeCounter.oid = 1
+    graph = Grapher(CallParser(TRACE.splitlines(True)), coalesce).into_graph()
+    return [(call.func.funcname, call.repeat, call.bytes_total) for call in graph.calls[1:]]
+
+
+def test_runs_accumulate():
+    assert nodes(True)[:3] == [("open", 1, None), ("write", 5, 3 * 0x10 + 0x20 + 0x30), ("read", 2, 0x10)]
+
+
+def test_closers_are_never_merged():
+    assert nodes(True)[3:] == [
+        ("close", 1, None),
+        ("close", 1, None),
+        ("open", 1, None),
+        ("write", 1, None),  # of a new run, the fd was closed since
+        ("close", 1, None),
+    ]
+
+
+def test_without_coalesce():
+    assert [func for func, _, _ in nodes(False)].count("write") == 4
+    assert all(total is None for _, _, total in nodes(False))
+
+
+def test_coalesce_keeps_the_repeats(trace, build_graph):
+    graph = build_graph(trace)
+    coalesced = build_graph(trace, coalesce=True)
+    assert len(coalesced) <= len(graph)
+    assert sum(call.repeat for call in coalesced.calls) == sum(call.repeat for call in graph.calls)
@@ -0,0 +1,93 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from themis.modules.common.errors import InvalidGraphFormatException
+from themis.modules.transforming.callgraph import COLUMNS
+from themis.modules.transforming import graphstore
+from themis.modules.transforming.graphstore import migrate_pickle, read_graph, write_graph
+
+
+def edges(graph):
+    return list(graph.to_networkx().edges(data="type"))
+
+
+def test_write_read(trace, build_graph, tmp_path):
+    graph = build_graph(trace)
+    path = str(tmp_path / "graph.thmg")
+    write_graph(graph, path)
+    stored = read_graph(path)
+
+    assert len(stored) == len(graph)
+    for name in COLUMNS + ("ids", "indptr", "indices", "edge_types"):
+        assert np.array_equal(getattr(stored, name), getattr(graph, name), equal_nan=True), name
+    assert stored.functions == graph.functions
+    assert list(stored.calls) == list(graph.calls)
+    assert edges(stored) == edges(graph)
+
+
+def test_descriptors_stay_shared(trace, build_graph, tmp_path):
+    graph = build_graph(trace)
+    path = str(tmp_path / "graph.thmg")
+    write_graph(graph, path)
+    stored = read_graph(path)
+
+    def sharing(calls):
+        first = dict()
+        return [first.setdefault(id(call.input_fd), node) for node, call in enumerate(calls)
+                if call is not None and call.input_fd is not None]
+
+    assert sharing(stored.calls) == sharing(graph.calls)
+
+
+def test_migrate_pickle(trace, build_graph, tmp_path):
+    graph = build_graph(trace)
+    path = str(tmp_path / "exe_graph.pickle")
+    with open(path, "wb") as file:
+        pickle.dump(graph.to_networkx(), file)
+
+    target = migrate_pickle(path)
+    assert target == str(tmp_path / "exe_graph.thmg")
+    migrated = read_graph(target)
+    # the entry node gets id 0 from a networkx graph
+    assert list(migrated.calls)[1:] == list(graph.calls)[1:]
+    assert edges(migrated) == edges(graph)
+
+
+def test_read_rejects_other_files(tmp_path):
+    path = tmp_path / "graph.thmg"
+    path.write_bytes(b"not a stored graph")
+    with pytest.raises(InvalidGraphFormatException):
+        read_graph(str(path))
+
+
+@pytest.mark.parametrize("size", [0, 5, 12, 100, None])
+def test_read_rejects_truncated_files(trace, build_graph, tmp_path, size):
+    path = str(tmp_path / "graph.thmg")
+    write_graph(build_graph(trace), path)
+    with open(path, "rb") as file:
+        data = file.read()
+    with open(path, "wb") as file:
+        file.write(data[:len(data) // 2 if size is None else size])
+    with pytest.raises(InvalidGraphFormatException):
+        read_graph(path)
+
+
+def test_migrate_checks_the_columns(trace, build_graph, tmp_path, monkeypatch):
+    graph = build_graph(trace)
+    path = str(tmp_path / "exe_graph.pickle")
+    with open(path, "wb") as file:
+        pickle.dump(graph.to_networkx(), file)
+
+    # a store that loses the indices of the calls, but keeps their number and the edges
+    encode = graphstore._encode
+
+    def lossy(graph):
+        arrays = encode(graph)
+        arrays["index"] = arrays["index"] + 1
+        return arrays
+
+    monkeypatch.setattr(graphstore, "_encode", lossy)
+    with pytest.raises(InvalidGraphFormatException):
+        migrate_pickle(path)
@@ -0,0 +1,21 @@
+import pytest
+
+from themis.modules.common.calls import NodeCounter
+from themis.modules.transforming.grapher import Grapher
+from themis.modules.transforming.parallel import ParallelCallParser
+from themis.modules.transforming.parser import CallParser
+
+
+def snapshot(parser):
+    NodeCounter.oid = 1
+    graph = Grapher(parser).into_graph().to_networkx()
+    nodes = sorted((node, data["call"].func.funcname, data["call"].index) for node, data in graph.nodes(data=True))
+    edges = sorted((start, end, data["type"].name) for start, end, data in graph.edges(data=True))
+    return nodes, edges
+
+
+@pytest.mark.parametrize("chunk_size", [60, 200, 1000])
+def test_parallel_matches_sequential(trace, chunk_size):
+    with open(trace) as infile:
+        expected = snapshot(CallParser(infile))
+    assert snapshot(ParallelCallParser(trace, processes=2, chunk_size=chunk_size)) == expected
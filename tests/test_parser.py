@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from themis.benchmark import regex_record_from_line
+from themis.modules.transforming.parser import parse_args, tokenize_line
+
+
+@pytest.mark.parametrize("args, expected", [
+    ('fd=0x3, buf=0x1000, count=0x10', {"fd": "0x3", "buf": "0x1000", "count": "0x10"}),
+    ('pathname="/tmp/a, b", flags=0x2', {"pathname": '"/tmp/a, b"', "flags": "0x2"}),
+    ('format="%s=%d (%s)", n=0x1', {"format": '"%s=%d (%s)"', "n": "0x1"}),
+    (r's="say \"hi, there\"", n=0x10', {"s": r'"say \"hi, there\""', "n": "0x10"}),
+    (r's="a\\", n=0x10', {"s": r'"a\\"', "n": "0x10"}),
+    ('s="\\u043e,\x01", n=0x3e0', {"s": '"\\u043e,\x01"', "n": "0x3e0"}),
+    ('', dict()),
+])
+def test_parse_args(args, expected):
+    assert parse_args(args) == expected
+
+
+def test_malformed_args_keep_the_first():
+    assert parse_args('fd=0x3, oops, count=0x10') == {"fd": "0x3"}
+    assert parse_args('s="unterminated, n=0x1') == {"s": '"unterminated, n=0x1'}
+
+
+def test_tokenize_line():
+    record = tokenize_line('12.5 ms     |    | open::enter<0042>(pathname="/x (1)", flags=0x2) [x3]\n')
+    assert (record.offset, record.func, record.callpoint, record.call_id, record.repeat, record.time) == \
+        (2, "open", "enter", 42, 3, 12.5)
+    assert record.args == {"pathname": '"/x (1)"', "flags": "0x2"}
+
+
+@pytest.mark.parametrize("line", [
+    "",
+    "Started tracing 3 functions.\n",
+    "  open::leave<1>(flags=0x2)\n",
+    "  open::enter<x>(flags=0x2)\n",
+    "open(flags=0x2)\n",
+])
+def test_tokenize_rejects(line):
+    assert tokenize_line(line) is None
+
+
+def test_matches_the_regex(trace):
+    # the former parser, on every line of the sample traces it could read
+    with open(trace) as infile:
+        for line in infile:
+            expected = regex_record_from_line(line)
+            if expected is not None:
+                assert tokenize_line(line) == expected
+
+
+def test_line_the_regex_skipped():
+    # fgets_unlocked read a non-ASCII string with a control character, which CALL_REGEX did not allow
+    data = os.path.join(os.path.dirname(__file__), os.pardir, "themis", "data")
+    with open(os.path.join(data, "libcalls_PolisMassa_Client_3_filtered.txt")) as infile:
+        line = infile.readlines()[65]
+    assert regex_record_from_line(line) is None
+    record = tokenize_line(line)
+    assert record.func == "fgets_unlocked"
+    assert record.args == {"s": '"\\u043e,\x01"', "n": "0x3e0", "stream": "0x12ccbb0"}
@@ -0,0 +1,63 @@
+import io
+import os
+
+import pytest
+
+from themis.modules.common.errors import InvalidUseException
+from themis.modules.common.tracefile import copy_to_trace, create_trace, detect_compression, find_trace, open_trace, \
+    remove_trace, trace_path
+
+
+COMPRESSIONS = [None, "gzip", "lzma", "bz2"]
+
+
+def sample(trace):
+    with open(trace) as infile:
+        return infile.read()
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_round_trip(trace, tmp_path, compression):
+    path = str(tmp_path / "libcalls.txt")
+    with create_trace(path, compression) as file:
+        file.write(sample(trace))
+
+    assert find_trace(path) == trace_path(path, compression)
+    assert detect_compression(find_trace(path)) == compression
+    with open_trace(path) as file:
+        assert file.read() == sample(trace)
+    with open_trace(path, "rb") as file:
+        assert file.read() == sample(trace).encode()
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_copy_to_trace(trace, tmp_path, compression):
+    path = str(tmp_path / "libcalls.txt")
+    copy_to_trace(io.BytesIO(sample(trace).encode()), path, compression).join()
+    with open_trace(path) as file:
+        assert file.read() == sample(trace)
+
+
+def test_find_newest(tmp_path):
+    path = str(tmp_path / "libcalls.txt")
+    assert find_trace(path) is None
+    for age, compression in enumerate(COMPRESSIONS):
+        with create_trace(path, compression) as file:
+            file.write(f"{compression}\n")
+        os.utime(trace_path(path, compression), (1000 - age, 1000 - age))
+
+    assert find_trace(path) == path
+    os.utime(trace_path(path, "lzma"), (2000, 2000))
+    assert find_trace(path) == trace_path(path, "lzma")
+    with open_trace(path) as file:
+        assert file.read() == "lzma\n"
+
+    remove_trace(path)
+    assert find_trace(path) is None
+    with pytest.raises(FileNotFoundError):
+        open_trace(path)
+
+
+def test_unknown_compression(tmp_path):
+    with pytest.raises(InvalidUseException):
+        create_trace(str(tmp_path / "libcalls.txt"), "zstd")
@@ -0,0 +1,293 @@
+import argparse
+import os
+import re
+import tempfile
+import time
+
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional
+
+from themis.modules.common.calls import NodeCounter
+from themis.modules.common.records import CallRecord
+from themis.modules.common.tracefile import create_trace
+from themis.modules.tracing.filter import filter_lines, filter_file
+from themis.modules.transforming.parallel import ParallelCallParser
+from themis.modules.transforming.parser import CallParser, record_from_line
+
+DATA_DIR = Path(__file__).with_name("data")
+
+# the parser before the tokenizer of record_from_line, as reference
+CALL_REGEX = re.compile(r"(?:\s*(?P<time>\d+(?:\.\d+)?)\sms)?(?P<offset>[\|\s]+)(?P<func>\w+)(?P<callpoint>::exit<\d+>|::enter<\d+>)?\((?P<args>[\w\s,+\d=/\"\.\%\:\_]*)\)(?:\s\[x(?P<repeat>\d+)\])?")
+CALLPOINT_REGEX = re.compile(r"::(?P<type>\w+)<(?P<id>\d+)>")
+
+
+def raw_trace_lines(
+
+) -> List[str]:
+    # the filtered traces in themis/data, with frida-trace timestamps and banner added back
+
+    lines = ["Instrumenting...\n", "Started tracing 9 functions. Press Ctrl+C to stop.\n"]
+    for path in sorted(DATA_DIR.glob("libcalls_*_filtered.txt")):
+        with open(path, "r") as file:
+            for ms, line in enumerate(file):
+                lines.append(f"{ms: >7} ms  {line}")
+    lines.append("Process terminated\n")
+    return lines
+
+
+
+def line_filter(
+    filename: str,
+    outfile: str
+) -> None:
+    # filter_file before the block filter, as reference
+
+    with open(filename, "r") as file:
+        with open(outfile, "w") as ofile:
+            for line in filter_lines(file):
+                ofile.write(line)
+                ofile.write("\n")
+
+
+
+def filtered_traces(
+
+) -> List[List[str]]:
+
+    traces = list()
+    for path in sorted(DATA_DIR.glob("libcalls_*_filtered.txt")):
+        with open(path, "r") as file:
+            traces.append(file.readlines())
+    return traces
+
+
+
+def regex_record_from_line(
+    line: str
+) -> Optional[CallRecord]:
+
+    mat = CALL_REGEX.match(line)
+    if mat is None:
+        return None
+
+    c_type = None
+    c_id = None
+    callpoint = mat.group("callpoint")
+    if callpoint is not None:
+        cmat = CALLPOINT_REGEX.match(callpoint)
+        c_type = cmat.group("type")
+        c_id = int(cmat.group("id"))
+
+    arg_dict = dict()
+    try:
+        for name, value in map(lambda x: tuple(x.split("=")), mat.group("args").split(", ")):
+            arg_dict[name] = value
+    except ValueError:
+        pass
+
+    return CallRecord(
+        offset=mat.group("offset").count('|'),
+        func=mat.group("func"),
+        callpoint=c_type,
+        call_id=c_id,
+        args=arg_dict,
+        repeat=int(mat.group("repeat") or 1),
+        time=None if mat.group("time") is None else float(mat.group("time"))
+    )
+
+
+
+def consume_parsers(
+    parsers: Iterable[CallParser]
+) -> None:
+
+    for parser in parsers:
+        for _ in parser.parse():
+            pass
+
+
+
+def _parses(
+    trace: List[str]
+) -> bool:
+
+    try:
+        consume_parsers([CallParser(trace)])
+    except AttributeError:
+        return False
+    return True
+
+
+
+def measure(
+    name: str,
+    run: Callable[[], None],
+    size: int
+) -> float:
+
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    print(f"{name: <32} {elapsed: >8.3f}s {size / elapsed / 2 ** 20: >10.1f} MiB/s")
+    return elapsed
+
+
+
+def benchmark_filter(
+    size_mib: int
+) -> None:
+
+    lines = raw_trace_lines()
+    data = "".join(lines).encode()
+    copies = max(1, size_mib * 2 ** 20 // len(data))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = f"{tmp}/libcalls_bench.txt"
+        with open(raw, "wb") as file:
+            for _ in range(copies):
+                file.write(data)
+        size = os.path.getsize(raw)
+        print(f"{copies} copies of themis/data, {size / 2 ** 20:.1f} MiB")
+
+        measure("line by line", lambda: line_filter(raw, f"{tmp}/lines.txt"), size)
+        measure("blocks, one process", lambda: filter_file(raw, f"{tmp}/blocks.txt", processes=1), size)
+        measure("blocks, process pool", lambda: filter_file(raw, f"{tmp}/chunks.txt"), size)
+
+        compressed = f"{tmp}/libcalls_bench_gzip.txt"
+        with create_trace(compressed, "gzip", "wb") as file:
+            for _ in range(copies):
+                file.write(data)
+        measure("blocks, gzip input", lambda: filter_file(compressed, f"{tmp}/decompressed.txt"), size)
+
+        with open(f"{tmp}/lines.txt", "rb") as reference:
+            expected = reference.read()
+        for name in ["blocks.txt", "chunks.txt", "decompressed.txt"]:
+            with open(f"{tmp}/{name}", "rb") as result:
+                if result.read() != expected:
+                    print(f"{name} differs from the line by line output")
+
+
+
+def benchmark_parse(
+    copies: int
+) -> None:
+
+    # every trace is parsed on its own, the fds of one are unknown to the others
+    traces = filtered_traces() * copies
+    lines = [line for trace in traces for line in trace]
+    size = sum(map(len, lines))
+    print(f"{len(lines)} lines, {copies} copies of themis/data, {size / 2 ** 20:.1f} MiB")
+
+    tokenized = list(map(record_from_line, lines))
+    regex = list(map(regex_record_from_line, lines))
+    differing = sum(1 for a, b in zip(tokenized, regex) if a != b)
+    if differing:
+        print(f"{differing} lines differ, the tokenizer also reads arguments the regex rejected")
+
+    measure("lines, regex", lambda: list(map(regex_record_from_line, lines)), size)
+    measure("lines, tokenizer", lambda: list(map(record_from_line, lines)), size)
+
+    # the Kessel traces lose fds the parser expects, they are only tokenized
+    graphable = [trace for trace in filtered_traces() if _parses(trace)]
+    traces = graphable * copies
+    size = sum(len(line) for trace in traces for line in trace)
+    print(f"{len(graphable)} traces build a graph")
+    measure(
+        "CallParser, regex",
+        lambda: consume_parsers(
+            CallParser(filter(None, map(regex_record_from_line, trace)), structured=True) for trace in traces
+        ),
+        size
+    )
+    measure("CallParser, tokenizer", lambda: consume_parsers(CallParser(trace) for trace in traces), size)
+
+
+
+def benchmark_parallel_parse(
+    copies: int,
+    processes: Optional[int]
+) -> None:
+
+    traces = [trace for trace in filtered_traces() if _parses(trace)]
+    results = dict()
+
+    def collect(name: str, parser: CallParser) -> None:
+        NodeCounter.oid = 1
+        calls = [(call.id, call.index, call.func.funcname, call.args, func) for call, func in parser.parse()]
+        results[name] = (calls, parser.nesting_edges())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # one long trace, the traces of themis/data one after another
+        path = f"{tmp}/libcalls_bench_filtered.txt"
+        with open(path, "w") as file:
+            for _ in range(copies):
+                for trace in traces:
+                    file.writelines(trace)
+                    if not trace[-1].endswith("\n"):
+                        file.write("\n")
+        size = os.path.getsize(path)
+        print(f"{copies} copies of {len(traces)} traces in one file, {size / 2 ** 20:.1f} MiB")
+
+        with open(path, "r") as file:
+            measure("CallParser", lambda: collect("sequential", CallParser(file)), size)
+        measure("ParallelCallParser", lambda: collect("parallel", ParallelCallParser(path, processes)), size)
+
+    if results["sequential"] != results["parallel"]:
+        print("the parallel parser differs from the sequential one")
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser("themis.benchmark")
+    subparsers = parser.add_subparsers(title="benchmarks", required=True)
+
+    filter_parser = subparsers.add_parser(
+        "filter",
+        help="Throughput of the timestamp filter on the traces in themis/data, replicated to a given size."
+    )
+    filter_parser.add_argument(
+        "--size",
+        type=int,
+        default=256,
+        help="Size of the raw trace in MiB. Default is 256."
+    )
+    filter_parser.set_defaults(func=lambda args: benchmark_filter(args.size))
+
+    parse_parser = subparsers.add_parser(
+        "parse",
+        help="Throughput of record_from_line and CallParser on the traces in themis/data, against the former regex parser."
+    )
+    parse_parser.add_argument(
+        "--copies",
+        type=int,
+        default=50,
+        help="Number of times themis/data is parsed. Default is 50."
+    )
+    parse_parser.set_defaults(func=lambda args: benchmark_parse(args.copies))
+
+    parallel_parser = subparsers.add_parser(
+        "parallel-parse",
+        help="Throughput of ParallelCallParser on the traces in themis/data concatenated into one, against CallParser."
+    )
+    parallel_parser.add_argument(
+        "--copies",
+        type=int,
+        default=50,
+        help="Number of times themis/data is concatenated. Default is 50."
+    )
+    parallel_parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Number of workers. Default is the number of cores."
+    )
+    parallel_parser.set_defaults(func=lambda args: benchmark_parallel_parse(args.copies, args.processes))
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import argparse
+import os
 
 from serde.toml import from_toml
 
@@ -28,9 +29,84 @@ def get_argparser(
         default=False,
         help="You might need to set this for frida to work."
     )
+    trace_parser.add_argument(
+        "--backend",
+        default="frida",
+        choices=["frida", "frida-trace", "audit"],
+        help="Trace in-process through the frida bindings (default), by running the frida-trace CLI,\
+            or from process start through LD_AUDIT, which needs a C compiler."
+    )
+    trace_parser.add_argument(
+        "--stream",
+        default=False,
+        action="store_true",
+        help="Build the graph while the target runs, without intermediate trace files.\
+            The graph is saved in the stored graph (.thmg) and gexf formats, as with transform --save."
+    )
+    trace_parser.add_argument(
+        "--trusted",
+        default=False,
+        action="store_true",
+        help="With --stream, indicate whether this binary is trusted."
+    )
+    trace_parser.add_argument(
+        "--img",
+        default=False,
+        action="store_true",
+        help="With --stream, save the graph as png."
+    )
+    trace_parser.add_argument(
+        "--verbose",
+        default=False,
+        action="store_true",
+        help="Print every anomaly of the trace as it is found, not only the summary, with --stream."
+    )
+    trace_parser.add_argument(
+        "--binary",
+        default=False,
+        action="store_true",
+        help="With the frida or audit backend, write the trace in the compact binary format."
+    )
     trace_parser.set_defaults(func=trace_entry)
 
 
+    batch_parser = subparsers.add_parser(
+        "batch",
+        help="Trace many binaries from bin_dir concurrently."
+    )
+    batch_parser.add_argument(
+        "executables",
+        nargs="+",
+        help="Names or globs (quote them) of executables in the bin_dir set in the config file."
+    )
+    batch_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of targets traced at once. Default is the number of CPUs."
+    )
+    batch_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Seconds after which a target still running is killed and counted as failed."
+    )
+    batch_parser.add_argument(
+        "--backend",
+        default="frida",
+        choices=["frida", "frida-trace", "audit"],
+        help="Trace in-process through the frida bindings (default), by running the frida-trace CLI,\
+            or from process start through LD_AUDIT, which needs a C compiler."
+    )
+    batch_parser.add_argument(
+        "--binary",
+        default=False,
+        action="store_true",
+        help="With the frida or audit backend, write the traces in the compact binary format."
+    )
+    batch_parser.set_defaults(func=batch_entry)
+
+
     transform_parser = subparsers.add_parser(
         "transform",
         help="Transform frida-traces into graphs."
@@ -56,12 +132,89 @@ def get_argparser(
         default=False,
         action="store_true",
         help="Indicate whether this graph should be saved\
-            in pickle and gexf formats. If the flag trusted is also used,\
+            in the stored graph (.thmg) and gexf formats. If the flag trusted is also used,\
             it will populate the valid graphs used for comparison."
         )
+    transform_parser.add_argument(
+        "--verbose",
+        default=False,
+        action="store_true",
+        help="Print every anomaly of the trace as it is found, not only the summary."
+    )
+    transform_parser.add_argument(
+        "--json",
+        default=False,
+        action="store_true",
+        help="Also save the anomalies of the trace as json in the result folder."
+    )
+    transform_parser.add_argument(
+        "--coalesce",
+        default=False,
+        action="store_true",
+        help="Merge runs of equivalent calls on the same fd into one node, as with coalesce_calls in the config file."
+    )
     transform_parser.set_defaults(func=transform_entry)
 
 
+    convert_parser = subparsers.add_parser(
+        "convert",
+        help="Convert a filtered text trace into the compact binary format."
+    )
+    convert_parser.add_argument(
+        "executable",
+        help="Name of the executable, for which a filtered trace file has already been created."
+    )
+    convert_parser.add_argument(
+        "--verbose",
+        default=False,
+        action="store_true",
+        help="Print every anomaly of the trace as it is found, not only the summary."
+    )
+    convert_parser.set_defaults(func=convert_entry)
+
+
+    migrate_parser = subparsers.add_parser(
+        "migrate",
+        help="Convert the _graph.pickle files of former versions into stored graphs (.thmg)."
+    )
+    migrate_parser.add_argument(
+        "paths",
+        nargs="*",
+        help="Pickles to convert. Default is all of them in trusted_graph_dir and dirty_graph_dir.\
+            Loading a pickle runs any code it holds, only convert the ones you trust."
+    )
+    migrate_parser.add_argument(
+        "--remove",
+        default=False,
+        action="store_true",
+        help="Remove each pickle once its stored graph was written and read back."
+    )
+    migrate_parser.set_defaults(func=migrate_entry)
+
+
+    profile_parser = subparsers.add_parser(
+        "profile",
+        help="Report the time spent between and inside the traced calls."
+    )
+    profile_parser.add_argument(
+        "executable",
+        help="Name of the executable, for which a trace file has already been created."
+    )
+    profile_parser.add_argument(
+        "--json",
+        default=False,
+        action="store_true",
+        help="Also save the profile as json in the result folder."
+    )
+    profile_parser.add_argument(
+        "--verbose",
+        default=False,
+        action="store_true",
+        help="Print every anomaly of the trace as it is found, not only the summary."
+    )
+    profile_parser.set_defaults(func=profile_entry)
+
+
     search_parser = subparsers.add_parser(
         "search",
         help="Search for most similar trusted binaries."
@@ -152,22 +305,83 @@ def intermediate():
 
 
 
+def report_diagnostics(
+    config: Config,
+    diagnostics,
+    save_json: bool
+) -> None:
+    # one summary of the anomalies of a trace instead of a line for each
+
+    import json
+
+    if diagnostics.total:
+        print(diagnostics.summary(f"in the trace of {config.executable}"))
+    if save_json:
+        with open(f"{config.result_dir}/{config.executable}_diagnostics.json", "w") as file:
+            json.dump(diagnostics.to_dict(), file, indent=4)
+
+
+
 def trace_entry(
     config: Config,
     args
 ) -> None:
     
     import os
-    from themis.modules.tracing.tracer import trace
+    from themis.modules.tracing.tracer import trace, stream_trace
 
     config.executable = args.executable
+    config.trust = args.trusted
 
     if args.set_ptrace_scope_to_zero:
         print("Setting up kernel for tracing...")
         print("sudo sysctl kernel.yama.ptrace_scope=0")
         os.system("sudo sysctl kernel.yama.ptrace_scope=0")
 
-    trace(config)
+    if not args.stream:
+        trace(config, args.backend, args.binary)
+        return
+
+    from themis.modules.transforming.diagnostics import Diagnostics
+    from themis.modules.transforming.transform import save_graph, to_img
+
+    diagnostics = Diagnostics(args.verbose)
+    graph = stream_trace(config, args.backend, diagnostics)
+    report_diagnostics(config, diagnostics, False)
+    save_graph(config, graph)
+    if args.img:
+        to_img(config, graph)
+
+
+
+def batch_entry(
+    config: Config,
+    args
+) -> None:
+
+    import colorama
+    from colorama import Fore, Style
+    from themis.modules.tracing.tracer import find_executables, trace_batch
+
+    if args.timeout is not None:
+        config.trace_timeout = args.timeout
+
+    executables = find_executables(config, args.executables)
+    results = trace_batch(config, executables, max(1, args.jobs), args.backend, args.binary)
+
+    colorama.init()
+    prefix()
+    failed = 0
+    for executable in executables:
+        error = results[executable]
+        if error is None:
+            print(Fore.GREEN, f"{executable: <32}", "traced", Style.RESET_ALL)
+        else:
+            failed += 1
+            print(Fore.RED, f"{executable: <32}", f"{type(error).__name__}: {error}", Style.RESET_ALL)
+    intermediate()
+    print(Fore.BLUE, f"{len(executables) - failed} traced, {failed} failed", Style.RESET_ALL)
+    suffix()
 
 
 
@@ -176,18 +390,86 @@ def transform_entry(
     args
 ) -> None:
 
+    from themis.modules.transforming.diagnostics import Diagnostics
     from themis.modules.transforming.transform import transform, to_img
 
     config.executable = args.executable
     config.trust = args.trusted
+    config.coalesce_calls = config.coalesce_calls or args.coalesce
 
-    graph = transform(config, args.save)
+    diagnostics = Diagnostics(args.verbose)
+    graph = transform(config, args.save, diagnostics)
+    report_diagnostics(config, diagnostics, args.json)
 
     if args.img:
         to_img(config, graph)
 
 
 
+def convert_entry(
+    config: Config,
+    args
+) -> None:
+
+    from themis.modules.transforming.bintrace import convert_text_trace
+    from themis.modules.transforming.diagnostics import Diagnostics
+
+    config.executable = args.executable
+
+    diagnostics = Diagnostics(args.verbose)
+    convert_text_trace(
+        f"{config.trace_dir}/libcalls_{config.executable}_filtered.txt",
+        f"{config.trace_dir}/libcalls_{config.executable}.bin",
+        diagnostics
+    )
+    report_diagnostics(config, diagnostics, False)
+
+
+
+def migrate_entry(
+    config: Config,
+    args
+) -> None:
+
+    import glob
+    from themis.modules.transforming.graphstore import migrate_pickle
+
+    paths = args.paths or sorted(
+        path for graph_dir in (config.trusted_graph_dir, config.dirty_graph_dir)
+        for path in glob.glob(f"{glob.escape(graph_dir)}/*_graph.pickle")
+    )
+    for path in paths:
+        print(f"{path} -> {migrate_pickle(path)}")
+        if args.remove:
+            os.remove(path)
+
+
+
+def profile_entry(
+    config: Config,
+    args
+) -> None:
+
+    import json
+
+    from dataclasses import asdict
+    from themis.modules.profiling.latency import build_profile, format_profile
+    from themis.modules.transforming.diagnostics import Diagnostics
+    from themis.modules.transforming.transform import transform
+
+    config.executable = args.executable
+
+    diagnostics = Diagnostics(args.verbose)
+    profile = build_profile(transform(config, False, diagnostics))
+    report_diagnostics(config, diagnostics, False)
+    print(format_profile(profile))
+
+    if args.json:
+        with open(f"{config.result_dir}/{config.executable}_profile.json", "w") as file:
+            json.dump(asdict(profile), file, indent=4)
+
+
+
 def search_entry(
     config: Config,
     args
@@ -1,6 +1,10 @@
+import math
+import sys
+
 from typing import NamedTuple, Optional, List, Any, Dict, Tuple
 from enum import Enum, auto, IntFlag
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields, MISSING
+from operator import attrgetter
 
 from themis.modules.common.errors import InvalidUseException
 
@@ -168,6 +172,8 @@ FIFIO_MANIPULATORS = [
     "mkfifoat"
 ]
 
+_FUNCTIONS: Dict[Tuple[str, 'IODescFunc'], 'Function'] = dict()  # see Function.named
+
 
 
 class IOConstructType(IntFlag):
@@ -187,6 +193,56 @@ class IOConstructType(IntFlag):
 
 
 
+class Slotted:
+    # pickled as a tuple of the slots, graphs pickled before __slots__ have a dict of them
+    __slots__ = ()
+
+
+
+    def __getstate__(
+        self
+    ) -> Tuple:
+
+        return self._state(self)
+
+
+
+    def __setstate__(
+        self,
+        state: Any
+    ) -> None:
+
+        if isinstance(state, dict):
+            for fld in fields(self):
+                # fields added after the graph was pickled get their default
+                value = state.get(fld.name, fld.default)
+                if value is not MISSING:
+                    object.__setattr__(self, fld.name, value)
+            return
+        for name, value in zip(self.__slots__, state):
+            object.__setattr__(self, name, value)
+        for fld in fields(self)[len(state):]:
+            # fields added since, at the end of the class
+            if fld.default is not MISSING:
+                object.__setattr__(self, fld.name, fld.default)
+
+
+
+
+def slotted(
+    cls: type
+) -> type:
+    # dataclass(slots=True) of python 3.10, the dataclass is created again with __slots__ instead of a __dict__
+
+    names = tuple(fld.name for fld in fields(cls))
+    namespace = {key: value for key, value in cls.__dict__.items() if key not in (*names, "__dict__", "__weakref__")}
+    namespace["__slots__"] = names
+    namespace["_state"] = attrgetter(*names)  # all of them have more than one field, so it returns a tuple
+    return type(cls.__name__, cls.__bases__, namespace)
+
+
+
+
 class NodeCounter:
     oid = 1
 
@@ -202,8 +258,9 @@ class NodeCounter:
 
 
 
+@slotted
 @dataclass
-class IODesc:
+class IODesc(Slotted):
     typ: IOConstructType = field(default=IOConstructType.INVALID)
     fd: Optional[int] = field(default=None)
     desc: Optional[str] = field(default=None)
@@ -222,13 +279,37 @@ class IODescFunc(Enum):
 
 
 
-@dataclass
-class Function:
+@slotted
+@dataclass(frozen=True)
+class Function(Slotted):
     funcname: str
     effect: IODescFunc
 
 
 
+    @classmethod
+    def named(
+        cls,
+        funcname: str,
+        effect: IODescFunc = IODescFunc.NONE
+    ) -> 'Function':
+        # one instance per name, shared by all calls of the function
+
+        function = _FUNCTIONS.get((funcname, effect))
+        if function is None:
+            function = _FUNCTIONS[(funcname, effect)] = cls(sys.intern(funcname), effect)
+        return function
+
+
+
+    def __reduce__(
+        self
+    ) -> Tuple:
+
+        return Function.named, (self.funcname, self.effect)
+
+
+
 
 class FunctionComparisonResult(Enum):
     EQUAL = auto()
@@ -276,7 +357,26 @@ class FunctionComparator:
         fname1: str,
         fname2: str
     ) -> FunctionComparisonResult:
+        # from the table of the catalog, functions outside of it are only equal to themselves
     
+        if fname1 == fname2:
+            return FunctionComparisonResult.EQUAL
+        libcall1 = CATALOG.get(fname1)
+        libcall2 = CATALOG.get(fname2)
+        if libcall1 is None or libcall2 is None:
+            return FunctionComparisonResult.DIFFERENT
+        return COMPARISONS[libcall1.id][libcall2.id]
+
+
+
+    @classmethod
+    def _scan(
+        cls,
+        fname1: str,
+        fname2: str
+    ) -> FunctionComparisonResult:
+        # compare without the catalog, which it is compiled with
+
         if fname1 == fname2:
             return FunctionComparisonResult.EQUAL
         for ec in cls.equivalence_classes:
@@ -284,7 +384,58 @@ class FunctionComparator:
                 if fname2 in ec:
                     return FunctionComparisonResult.EQUIV_CLASS
         return FunctionComparisonResult.DIFFERENT
-    
+
+
+
+
+class Libcall(NamedTuple):
+    id: int  # position in the catalog, indexes COMPARISONS
+    category: IOConstructType  # of the fds the function is given, as guess_io_type sets it
+    closer: bool  # in CLOSERS
+    equivalence: int  # index in FunctionComparator.equivalence_classes, -1 outside of them
+
+
+
+
+# the lists above, most specific first, a function in several of them belongs to the first
+CATEGORIES = [
+    (SOCKET_MANIPULATORS, IOConstructType.SOCKET),
+    (MEMORY_MANIPULATORS, IOConstructType.MEMORY),
+    (DIRECTORY_MANIPULATORS, IOConstructType.DIRECTORY),
+    (LINK_MANIPULATORS, IOConstructType.LINK),
+    (TMP_MANIPULATORS, IOConstructType.TMP),
+    (PIPE_MANIPULATORS, IOConstructType.PIPE),
+    (FIFIO_MANIPULATORS, IOConstructType.FIFO),
+    (STREAM_MANIPULATORS, IOConstructType.STREAM),
+    (STDSTREAM_MANIPULATORS, IOConstructType.STDSTREAM),
+    (BINFILE_MANIPULATORS, IOConstructType.BINFILE)
+]
+
+
+
+
+def _compile_catalog(
+) -> Tuple[Dict[str, Libcall], Tuple[Tuple[FunctionComparisonResult, ...], ...]]:
+    # every function of the lists and of the equivalence classes, and the comparison of each pair
+
+    names: List[str] = list()
+    for functions in (CLOSERS, *(functions for functions, _ in CATEGORIES), *FunctionComparator.equivalence_classes):
+        names.extend(name for name in functions if name not in names)
+
+    catalog = dict()
+    for libcall_id, name in enumerate(names):
+        category = next((typ for functions, typ in CATEGORIES if name in functions), IOConstructType.UNKNOWN)
+        equivalence = next((i for i, ec in enumerate(FunctionComparator.equivalence_classes) if name in ec), -1)
+        catalog[sys.intern(name)] = Libcall(libcall_id, category, name in CLOSERS, equivalence)
+
+    comparisons = tuple(tuple(FunctionComparator._scan(name1, name2) for name2 in names) for name1 in names)
+    return catalog, comparisons
+
+
+
+
+CATALOG, COMPARISONS = _compile_catalog()
+
 
 
 
@@ -312,6 +463,12 @@ class ArgsComparator:
         "fd",
         "addr" 
     ]
+    byte_args = [  # sizes of the data moved, summed up in coalesced calls
+        "count",
+        "len",
+        "size",
+        "nmemb"
+    ]
 
 
 
@@ -347,6 +504,21 @@ class ArgsComparator:
 
 
 
+    @classmethod
+    def equivalent(
+        cls,
+        args1: Dict[str, Any],
+        args2: Dict[str, Any]
+    ) -> bool:
+        # the same apart from the excluded arguments and the sizes
+
+        ignored = (*cls.args_to_exclude, *cls.byte_args)
+        return len(args1) == len(args2) and all(
+            key in args2 and (key in ignored or args2[key] == val) for key, val in args1.items()
+        )
+
+
+
 
 @dataclass
 class DiffInfo:
@@ -357,13 +529,37 @@ class DiffInfo:
 
 
 
+@slotted
 @dataclass
-class IOCall:
+class IOCall(Slotted):
     index: int = field(default=-1)  # order in input file
-    func: Function = field(default=Function("nop", IODescFunc.NONE))
+    func: Function = field(default=Function.named("nop"))
     in_fd: Optional[IODesc] = field(default=None)
     out_fd: Optional[List[IODesc]] = field(default=None)
     args: Dict[str, Any] = field(default_factory=dict)
+    repeat: int = field(default=1)  # consecutive identical calls collapsed into this one
+    time: Optional[float] = field(default=None)  # ms since the start of the trace, of the enter part for paired calls
+    duration: Optional[float] = field(default=None)  # ms from enter to exit, for paired calls
+    unfinished: bool = field(default=False)  # entered but never exited, e.g. the process was killed
+    bytes_total: Optional[int] = field(default=None)  # of the calls coalesced into this one, if their sizes are known
+
+
+
+    def byte_count(
+        self
+    ) -> Optional[int]:
+        # the bytes given to the call, times its repeat count
+
+        try:
+            if "count" in self.args:
+                return int(self.args["count"], 16) * self.repeat
+            if "len" in self.args:
+                return int(self.args["len"], 16) * self.repeat
+            if "size" in self.args and "nmemb" in self.args:
+                return int(self.args["size"], 16) * int(self.args["nmemb"], 16) * self.repeat
+        except (TypeError, ValueError):
+            pass
+        return None
 
 
 
@@ -406,6 +602,9 @@ class IOCall:
         res -= (1 if call1.index != call2.index else 0)
         res -= (abs(call1.index - call2.index) // 3) * 3
 
+        # repeat, of coalesced calls, a loop running twice as often costs 2
+        res -= min(20, round(2 * abs(math.log2(call1.repeat) - math.log2(call2.repeat))))
+
         # args
         penalty, arg_diffs = ArgsComparator.compare(call1.args, call2.args)
         res -= penalty
@@ -419,8 +618,9 @@ class IOCall:
 
 
 
+@slotted
 @dataclass
-class CallsNode:
+class CallsNode(Slotted):
     id: int = field(init=False, default_factory=NodeCounter.next)
     call: IOCall = field(default=IOCall())
 
@@ -481,6 +681,51 @@ class CallsNode:
 
 
 
+    @property
+    def repeat(
+        self
+    ) -> int:
+
+        return self.call.repeat
+
+
+
+    @property
+    def time(
+        self
+    ) -> Optional[float]:
+
+        return self.call.time
+
+
+
+    @property
+    def duration(
+        self
+    ) -> Optional[float]:
+
+        return self.call.duration
+
+
+
+    @property
+    def unfinished(
+        self
+    ) -> bool:
+
+        return self.call.unfinished
+
+
+
+    @property
+    def bytes_total(
+        self
+    ) -> Optional[int]:
+
+        return self.call.bytes_total
+
+
+
 
 class IODescState(Enum):
     OPEN = auto()
@@ -491,8 +736,9 @@ class IODescState(Enum):
 
 
 
+@slotted
 @dataclass
-class IODescAndState:
+class IODescAndState(Slotted):
     iodesc: IODesc
     state: IODescState
 
@@ -1,6 +1,20 @@
 from dataclasses import dataclass, field
 from serde import serialize, deserialize
-from typing import List, Optional
+from typing import Dict, List, Optional
+
+
+@serialize
+@deserialize
+@dataclass
+class FilterRule:
+    # calls matching all given conditions are dropped by the agent, before they are sent
+    name: str
+    functions: List[str] = field(default_factory=list)  # empty matches every traced function
+    paths: List[str] = field(default_factory=list)  # prefixes of a string argument
+    fds: List[int] = field(default_factory=list)  # values of an fd argument
+    rate: Optional[int] = field(default=None)  # only calls of a function beyond this many per second are dropped
+
+
 
 
 @serialize
@@ -19,3 +33,18 @@ class Config:
     executable: Optional[str]
     args: List[str]
     trust: bool = field(default=False)
+    capture_policies: Dict[str, str] = field(default_factory=dict)  # of the traced_libcalls_file functions, see capture.py
+    trace_compression: Optional[str] = field(default=None)  # gzip, lzma or bz2 for text traces in trace_dir
+    trace_timeout: Optional[float] = field(default=None)  # seconds, a target still running is killed
+    parse_processes: Optional[int] = field(default=None)  # for filtered traces above parallel.CHUNK_SIZE, 1 parses them in one go
+    parse_max_pending: int = field(default=1 << 16)  # calls entered but not exited, the oldest is left unfinished beyond it
+    coalesce_calls: bool = field(default=False)  # runs of equivalent calls on one fd become one node with a repeat count
+    transform_cache: bool = field(default=True)  # graphs of the traces in result_dir/cache, unchanged traces are not parsed again
+    agent_batch_size: int = field(default=1024)  # records per message from the frida agent
+    agent_flush_interval: int = field(default=50)  # ms after which a partial batch is sent anyway
+    agent_buffer_capacity: int = field(default=1 << 18)  # records buffered in the target, further ones are dropped
+    agent_max_in_flight: int = field(default=4)  # batches sent but not yet acknowledged by the host
+    agent_collapse: bool = field(default=False)  # merge runs of identical calls into one record with a repeat count
+    agent_native_functions: List[str] = field(default_factory=list)  # hooked by compiled callbacks instead of js
+    agent_native_capacity: int = field(default=1 << 16)  # records in the buffer of the native hooks
+    agent_filters: List[FilterRule] = field(default_factory=list)  # [[agent_filters]] tables, at the end of the file
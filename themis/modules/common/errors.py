@@ -2,4 +2,20 @@
 
 class InvalidUseException(Exception):
     def __init__(self, msg: str):
-        super().__init__(msg)
\ No newline at end of file
+        super().__init__(msg)
+
+
+class InvalidTraceFormatException(Exception):
+    def __init__(self, msg: str):
+        super().__init__(msg)
+
+
+class InvalidGraphFormatException(Exception):
+    def __init__(self, msg: str):
+        super().__init__(msg)
+
+
+
+class TraceTimeoutException(Exception):
+    def __init__(self, msg: str):
+        super().__init__(msg)
@@ -0,0 +1,34 @@
+from typing import NamedTuple, Optional, Dict
+
+
+class CallRecord(NamedTuple):
+    offset: int  # nesting depth, number of '|' in the frida-trace output
+    func: str
+    callpoint: Optional[str]  # "enter" or "exit" for calls traced in two parts, None otherwise
+    call_id: Optional[int]  # pairs the enter and exit part of a call
+    args: Dict[str, str]
+    repeat: int = 1  # number of identical consecutive calls this record stands for
+    time: Optional[float] = None  # ms since the start of the trace
+
+
+
+
+def format_record(
+    record: CallRecord
+) -> str:
+
+    callpoint = "" if record.callpoint is None else f"::{record.callpoint}<{record.call_id}>"
+    args = ", ".join(f"{name}={value}" for name, value in record.args.items())
+    repeat = "" if record.repeat == 1 else f" [x{record.repeat}]"
+    # the timestamp prefix of frida-trace, which the filter keeps
+    time = "" if record.time is None else f"{format_time(record.time)} ms"
+    return f"{time}  {'   | ' * record.offset}{record.func}{callpoint}({args}){repeat}"
+
+
+
+def format_time(
+    time: float
+) -> str:
+    # ms, up to µs precision, without trailing zeros
+
+    return f"{time:.3f}".rstrip("0").rstrip(".")
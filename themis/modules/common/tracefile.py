@@ -0,0 +1,126 @@
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import threading
+
+from typing import IO, Optional
+
+from themis.modules.common.errors import InvalidUseException
+
+# Config.trace_compression -> file suffix, compressed traces keep their name and get this suffix
+SUFFIXES = {
+    "gzip": ".gz",
+    "lzma": ".xz",
+    "bz2": ".bz2"
+}
+OPENERS = {
+    "gzip": lambda path, mode: gzip.open(path, mode, compresslevel=6),
+    "lzma": lzma.open,
+    "bz2": bz2.open
+}
+MAGIC = (
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "lzma"),
+    (b"BZh", "bz2")
+)
+
+
+def trace_path(
+    path: str,
+    compression: Optional[str]
+) -> str:
+
+    if compression is None:
+        return path
+    if compression not in SUFFIXES:
+        raise InvalidUseException(f"unknown trace compression {compression}, use one of {', '.join(SUFFIXES)}")
+    return path + SUFFIXES[compression]
+
+
+
+def find_trace(
+    path: str
+) -> Optional[str]:
+    # the plain or any compressed variant of a trace, the newest one if there are several
+
+    candidates = [path, *(path + suffix for suffix in SUFFIXES.values())]
+    existing = [candidate for candidate in candidates if os.path.exists(candidate)]
+    if not existing:
+        return None
+    return max(existing, key=os.path.getmtime)
+
+
+
+def create_trace(
+    path: str,
+    compression: Optional[str],
+    mode: str = "w"
+) -> IO:
+
+    path = trace_path(path, compression)
+    if compression is None:
+        return open(path, mode)
+    return OPENERS[compression](path, mode if "b" in mode else f"{mode}t")
+
+
+
+def detect_compression(
+    path: str
+) -> Optional[str]:
+    # from the magic bytes, None for plain files
+
+    with open(path, "rb") as file:
+        head = file.read(6)
+    for magic, compression in MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+
+def open_trace(
+    path: str,
+    mode: str = "r"
+) -> IO:
+    # the file is decompressed while it is read
+
+    found = find_trace(path)
+    if found is None:
+        raise FileNotFoundError(f"no trace at {path}")
+
+    compression = detect_compression(found)
+    if compression is None:
+        return open(found, mode)
+    return OPENERS[compression](found, mode if "b" in mode else f"{mode}t")
+
+
+
+def remove_trace(
+    path: str
+) -> None:
+
+    found = find_trace(path)
+    while found is not None:
+        os.remove(found)
+        found = find_trace(path)
+
+
+
+def copy_to_trace(
+    source: IO,
+    path: str,
+    compression: Optional[str]
+) -> threading.Thread:
+    # compresses a stream, e.g. the stdout of frida-trace, in the background
+
+    destination = create_trace(path, compression, "wb")
+
+    def pump() -> None:
+        with source, destination:
+            shutil.copyfileobj(source, destination)
+
+    thread = threading.Thread(target=pump, daemon=True)
+    thread.start()
+    return thread
@@ -7,9 +7,10 @@ from typing import Union, List, Dict, Iterable, Tuple
 
 from themis.modules.comparing.branch_comparator import BranchComparator
 from themis.modules.comparing.primitives import BranchID, NodeID, NodeMatch
-from themis.modules.transforming.transform import reconstruct_one_pickle 
+from themis.modules.transforming.callgraph import CallGraph, ENTRY
+from themis.modules.transforming.transform import reconstruct_one_graph
 from themis.modules.common.config import Config
-from themis.modules.common.calls import CallsNode, IOConstructType
+from themis.modules.common.calls import IOConstructType
 from themis.modules.comparing.error import AssignmentSolverException
 from themis.modules.comparing.difference_graph import DiffGraph
 
@@ -24,8 +25,10 @@ class DeepGraphComparator:
         trusted_exec: str
     ) -> None:
         
-        self._dirty_graph: nx.Graph = reconstruct_one_pickle(f"{config.dirty_graph_dir}/{dirty_exec}_graph.pickle")
-        self._trusted_graph: nx.Graph = reconstruct_one_pickle(f"{config.trusted_graph_dir}/{trusted_exec}_graph.pickle")
+        self._dirty_call_graph = reconstruct_one_graph(f"{config.dirty_graph_dir}/{dirty_exec}_graph.thmg")
+        self._trusted_call_graph = reconstruct_one_graph(f"{config.trusted_graph_dir}/{trusted_exec}_graph.thmg")
+        self._dirty_graph: nx.Graph = self._dirty_call_graph.to_networkx()
+        self._trusted_graph: nx.Graph = self._trusted_call_graph.to_networkx()
         self._dirty_nodes = self._dirty_graph.nodes(data=True)
         self._trusted_nodes = self._trusted_graph.nodes(data=True)
         self._outpath = f"{config.result_dir}/{dirty_exec}_vs_{trusted_exec}.json"
@@ -34,67 +37,20 @@ class DeepGraphComparator:
 
 
 
-    @staticmethod
-    def _guess_io_type(
-        call: CallsNode
-    ) -> IOConstructType:
-        
-        type_hints = list()
-        if call.input_fd is not None:
-            type_hints.append(call.input_fd.typ)
-        if call.output_fd is not None:
-            for fd in call.output_fd:
-                type_hints.append(fd.typ)
-
-        io_type = sorted(type_hints, reverse=True)[0] if len(type_hints) > 0 else IOConstructType.UNKNOWN
-        return io_type
-
-
-
-    @staticmethod
-    def _guess_branch_io_type(
-        indexes: List[NodeID],
-        graph: nx.Graph
-    ) -> IOConstructType:
-       
-        guesses = set()
-        for idx in indexes:
-            guesses.add(DeepGraphComparator._guess_io_type(graph.nodes[idx]["call"]))
-
-        io_type = sorted(guesses, reverse=True)[0] if len(guesses) > 0 else IOConstructType.UNKNOWN
-
-        return io_type
-
-
-
     @staticmethod
     def _get_subgraphs(
-        children: Iterable[NodeID],
-        graph:nx.Graph
+        call_graph: CallGraph,
+        graph: nx.Graph
     ) -> Dict[IOConstructType, Dict[BranchID, nx.Graph]]:
-        
-        counter = 0
+        # a branch is everything below a child of the entry, found on the arrays of the call graph
+
         res = dict()
-        for child in children:
-            indexes = DeepGraphComparator._traverse(child, graph)
-            io_type = DeepGraphComparator._guess_branch_io_type(indexes, graph)
+        for counter, child in enumerate(call_graph.successors(ENTRY).tolist()):
+            nodes = call_graph.reachable(child)
+            io_type = IOConstructType(int(call_graph.io_type[nodes].max()))
             if res.get(io_type, None) is None:
                 res[io_type] = dict()
-            res[io_type][counter] = graph.subgraph(indexes)
-            counter += 1
-        return res
-
-
-
-    @staticmethod
-    def _traverse(
-        node: NodeID,
-        graph: nx.Graph
-    ) -> List[Union[int, str]]:
-        
-        res = [node]
-        for successor in graph.neighbors(node):
-            res.extend(DeepGraphComparator._traverse(successor, graph))
+            res[io_type][counter] = graph.subgraph(call_graph.key(node) for node in nodes.tolist())
         return res
 
 
@@ -102,14 +58,9 @@ class DeepGraphComparator:
     def _get_branches(
         self
     ) -> Tuple[Dict[IOConstructType, Dict[BranchID, nx.Graph]]]:
-       
-        dirty_idx = "entry"
-        trusted_idx = "entry"
-        dirty_children = self._dirty_graph.neighbors(dirty_idx)
-        trusted_children = self._trusted_graph.neighbors(trusted_idx)
-
-        return self._get_subgraphs(dirty_children, self._dirty_graph), \
-            self._get_subgraphs(trusted_children, self._trusted_graph)
+
+        return self._get_subgraphs(self._dirty_call_graph, self._dirty_graph), \
+            self._get_subgraphs(self._trusted_call_graph, self._trusted_graph)
 
 
 
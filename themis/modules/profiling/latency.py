@@ -0,0 +1,207 @@
+import numpy as np
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from themis.modules.common.calls import CallsNode
+from themis.modules.common.records import format_time
+from themis.modules.transforming.callgraph import CallGraph, EdgeType, ENTRY
+
+BUCKETS = (0.01, 0.1, 1, 10, 100, 1000)  # ms, upper bounds of the histogram buckets, the last bucket is open
+LONGEST_GAPS = 10  # reported with the calls that follow them
+
+
+@dataclass
+class Timing:
+    count: int = field(default=0)
+    total: float = field(default=0.0)  # ms
+    maximum: float = field(default=0.0)  # ms
+    histogram: List[int] = field(default_factory=lambda: [0] * (len(BUCKETS) + 1))
+
+
+
+    def add(
+        self,
+        value: float
+    ) -> None:
+
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+        bucket = 0
+        while bucket < len(BUCKETS) and value >= BUCKETS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+
+
+
+    @property
+    def mean(
+        self
+    ) -> float:
+
+        return self.total / self.count if self.count else 0.0
+
+
+
+
+@dataclass
+class Profile:
+    calls: int = field(default=0)
+    untimed: int = field(default=0)  # calls without a timestamp, e.g. from traces of older versions
+    span: float = field(default=0.0)  # ms from the first to the last call
+    gaps: Dict[str, Timing] = field(default_factory=dict)  # per function, time since the previous call
+    durations: Dict[str, Timing] = field(default_factory=dict)  # per paired function, from enter to exit
+    branches: Dict[str, Timing] = field(default_factory=dict)  # per branch, gaps between its calls
+    longest_gaps: List[Tuple[float, float, str]] = field(default_factory=list)  # gap, time and function of the call after it
+
+
+
+
+def _branch_name(
+    call: CallsNode
+) -> str:
+
+    fd: Optional[int] = None
+    if call.output_fd:
+        fd = call.output_fd[0].fd
+    elif call.input_fd is not None:
+        fd = call.input_fd.fd
+    name = f"#{call.index} {call.func.funcname}"
+    return name if fd is None else f"{name} fd {hex(fd)}"
+
+
+
+def _group_timings(
+    groups: np.ndarray,
+    values: np.ndarray,
+    count: int
+) -> List[Timing]:
+    # the timings of all groups at once, as adding their values one by one would give them
+
+    totals = [0.0] * count
+    for group, value in zip(groups.tolist(), values.tolist()):
+        totals[group] += value  # in order, for the same rounding
+    maxima = np.zeros(count)
+    np.maximum.at(maxima, groups, values)
+    buckets = len(BUCKETS) + 1
+    histograms = np.bincount(
+        groups * buckets + np.searchsorted(BUCKETS, values, side="right"),
+        minlength=count * buckets
+    ).reshape(count, buckets)
+    return [
+        Timing(count=int(number), total=total, maximum=float(maximum), histogram=histogram)
+        for number, total, maximum, histogram in zip(
+            np.bincount(groups, minlength=count).tolist(), totals, maxima.tolist(), histograms.tolist()
+        )
+    ]
+
+
+
+def _per_function(
+    graph: CallGraph,
+    funcs: np.ndarray,
+    values: np.ndarray
+) -> Dict[str, Timing]:
+    # in the order the functions first appear
+
+    codes, first, groups = np.unique(funcs, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    timings = _group_timings(rank[groups], values, len(codes))
+    return dict((graph.functions[code], timing) for code, timing in zip(codes[order].tolist(), timings))
+
+
+
+def build_profile(
+    graph: CallGraph
+) -> Profile:
+
+    profile = Profile()
+    calls = np.flatnonzero(graph.func >= 0)
+    calls = calls[calls != ENTRY]
+    timed = calls[~np.isnan(graph.time[calls])]
+    profile.calls = len(calls)
+    profile.untimed = len(calls) - len(timed)
+    if not len(timed):
+        return profile
+
+    timed = timed[np.lexsort((graph.index[timed], graph.time[timed]))]
+    times = graph.time[timed]
+    funcs = graph.func[timed]
+    profile.span = float(times[-1] - times[0])
+    gaps = np.diff(times, prepend=times[0])
+    profile.gaps = _per_function(graph, funcs, gaps)
+    paired = ~np.isnan(graph.duration[timed])
+    profile.durations = _per_function(graph, funcs[paired], graph.duration[timed][paired])
+
+    # only the gaps as long as the shortest of the longest are sorted
+    cut = max(len(gaps) - LONGEST_GAPS, 0)
+    longest = np.partition(gaps, cut)[cut]
+    profile.longest_gaps = sorted(
+        (
+            (gap, time, graph.functions[func])
+            for gap, time, func in zip(gaps.tolist(), times.tolist(), funcs.tolist()) if gap >= longest
+        ),
+        reverse=True
+    )[:LONGEST_GAPS]
+
+    # the timed calls of every branch in a row, ordered by time
+    children = graph.successors(ENTRY, EdgeType.FOLLOW)
+    rank = np.full(len(graph), -1, dtype=np.int64)
+    rank[children] = np.arange(len(children))
+    roots = graph.branches()[timed]
+    in_branch = roots >= 0
+    branches, times = rank[roots[in_branch]], times[in_branch]
+    order = np.lexsort((times, branches))
+    branches, times = branches[order], times[order]
+    same = branches[1:] == branches[:-1]
+    timings = _group_timings(branches[1:][same], np.diff(times)[same], len(children))
+    for branch in np.unique(branches).tolist():
+        profile.branches[_branch_name(graph.calls[children[branch]])] = timings[branch]
+
+    return profile
+
+
+
+def _format_timings(
+    title: str,
+    timings: Dict[str, Timing]
+) -> List[str]:
+
+    labels = [f"<{format_time(bound)}" for bound in BUCKETS] + [f">={format_time(BUCKETS[-1])}"]
+    lines = [
+        title,
+        f"{'':<32} {'count':>8} {'mean ms':>10} {'max ms':>10}  " + " ".join(f"{label:>7}" for label in labels)
+    ]
+    for name, timing in sorted(timings.items(), key=lambda item: item[1].total, reverse=True):
+        lines.append(
+            f"{name:<32} {timing.count:>8} {timing.mean:>10.3f} {timing.maximum:>10.3f}  " +
+            " ".join(f"{count:>7}" for count in timing.histogram)
+        )
+    return lines
+
+
+
+def format_profile(
+    profile: Profile
+) -> str:
+
+    lines = [f"{profile.calls} calls over {format_time(profile.span)} ms"]
+    if profile.untimed:
+        lines.append(f"{profile.untimed} calls have no timestamp and are left out")
+    lines.append("")
+    lines.extend(_format_timings("time since the previous call, per function", profile.gaps))
+    if profile.durations:
+        lines.append("")
+        lines.extend(_format_timings("enter to exit, per paired function", profile.durations))
+    if profile.branches:
+        lines.append("")
+        lines.extend(_format_timings("time between the calls of a branch", profile.branches))
+    if profile.longest_gaps:
+        lines.append("")
+        lines.append("longest gaps")
+        for gap, time, func in profile.longest_gaps:
+            lines.append(f"{gap:>10.3f} ms before {func} at {format_time(time)} ms")
+    return "\n".join(lines)
@@ -0,0 +1,257 @@
+'use strict';
+
+// Tracing agent loaded by AgentAnalyzer (frida_agent_wrap.py).
+// The host prepends `const OPTIONS = {...};` with the batching settings and
+// appends the handlers generated from the signature catalog (handlers.py),
+// one `attach(func, callbacks)` per traced function.
+//
+// Records are buffered and sent in batches, when a batch is full or every
+// flushInterval ms. At most maxInFlight batches wait for the host to ack them,
+// records arriving while the buffer holds `capacity` records are dropped and
+// counted per function id, the call counts are sent along with every batch. The exit
+// of a paired call whose enter record was dropped is dropped as well, as in native.c.
+// With collapsing, the last record of an unpaired call of each thread is held back as
+// pending, identical calls of the same thread following it only increase its repeat count.
+//
+// Functions in agent_native_functions are hooked by the CModule in native.c, which
+// writes fixed size records into a ring the agent drains with every flush. All records
+// carry a sequence number from one counter, the host merges both kinds by it, up to
+// the frontier sent along, below which no record is missing anymore.
+//
+// Calls matching an agent_filters rule are not recorded at all, the generated handlers
+// check the rules first and count the dropped calls per rule.
+
+const start = Date.now();
+let seq = 0;
+let nextSeq = () => seq++;
+let now = () => Date.now() - start;  // ms, with µs resolution once native.c is loaded
+
+let buffer = [];
+let inFlight = 0;
+const dropped = {};
+const pending = new Map();  // thread id -> its pending record
+let lastSeen = new Map();  // thread id -> pending record and its repeat count at the last timer tick
+
+const RECORD_SIZE = 88;  // sizeof(Record) in native.c
+const STATE_FIELDS = 7;  // gsize fields of State before the dropped counts
+let native = null;
+
+const filtered = new Array(OPTIONS.filters).fill(0);  // by rule index
+const rates = {};  // rule and function id -> [start of the current second, calls in it]
+
+
+function findExport(name) {
+    if (typeof Module.findGlobalExportByName === 'function') {
+        return Module.findGlobalExportByName(name);
+    }
+    return Module.findExportByName(null, name);
+}
+
+
+function readString(value, limit) {
+    // limit is the capture policy string:N, undefined reads the whole string
+    if (!value.isNull()) {
+        try {
+            return '"' + value.readUtf8String(limit) + '"';
+        } catch (e) {
+            // not a readable string after all, keep the pointer
+        }
+    }
+    return value.toString();
+}
+
+
+function hasPrefix(value, prefixes) {
+    if (value.isNull()) {
+        return false;
+    }
+    try {
+        const path = value.readUtf8String();
+        return prefixes.some(prefix => path.startsWith(prefix));
+    } catch (e) {
+        return false;
+    }
+}
+
+
+function overRate(rule, fid, rate) {
+    const now = Date.now();
+    const key = rule + ':' + fid;
+    let window = rates[key];
+    if (window === undefined || now - window[0] >= 1000) {
+        window = rates[key] = [now, 0];
+    }
+    return ++window[1] > rate;
+}
+
+
+function emit(fid, record, thread) {
+    // false if the record was dropped
+    release(thread);
+    return store(fid, record);
+}
+
+
+function release(thread) {
+    const record = pending.get(thread);
+    if (record !== undefined) {
+        pending.delete(thread);
+        store(record[3], record);
+    }
+}
+
+
+function store(fid, record) {
+    if (buffer.length >= OPTIONS.capacity) {
+        drop(fid, record[6]);
+        return false;
+    }
+    buffer.push(record);
+    if (buffer.length >= OPTIONS.batchSize) {
+        flush(false);
+    }
+    return true;
+}
+
+
+function drop(fid, count) {
+    dropped[fid] = (dropped[fid] || 0) + count;
+}
+
+
+function flush(force) {
+    if (!force && inFlight >= OPTIONS.maxInFlight) {
+        return;
+    }
+    const [data, frontier] = native === null ? [null, null] : drainNative(force);
+    if (buffer.length === 0 && data === null && !force) {
+        return;
+    }
+    inFlight++;
+    send({ type: 'batch', records: buffer, dropped: countDropped(), filtered: filtered, frontier: frontier }, data);
+    buffer = [];
+}
+
+
+function countDropped() {
+    if (native === null) {
+        return dropped;
+    }
+    const counts = Object.assign({}, dropped);
+    native.functions.forEach(fid => {
+        const count = readState(STATE_FIELDS + fid);
+        if (count > 0) {
+            counts[fid] = (counts[fid] || 0) + count;
+        }
+    });
+    return counts;
+}
+
+
+function readState(field) {
+    return native.state.add(field * Process.pointerSize).readULong().toNumber();
+}
+
+
+function drainNative(force) {
+    const next = readState(0);
+    const busy = readState(3) !== 0;
+    const written = readState(4);
+    const read = readState(5);
+
+    let data = null;
+    if (written > read) {
+        // the ring may wrap around, its two parts are copied into one buffer
+        const first = Math.min(written - read, OPTIONS.nativeCapacity - read % OPTIONS.nativeCapacity);
+        const bytes = new Uint8Array((written - read) * RECORD_SIZE);
+        bytes.set(new Uint8Array(native.records.add(read % OPTIONS.nativeCapacity * RECORD_SIZE).readByteArray(first * RECORD_SIZE)));
+        if (written - read > first) {
+            bytes.set(new Uint8Array(native.records.readByteArray((written - read - first) * RECORD_SIZE)), first * RECORD_SIZE);
+        }
+        data = bytes.buffer;
+        native.state.add(5 * Process.pointerSize).writeULong(written);
+    }
+
+    if (force) {
+        return [data, null];
+    }
+    // a record below next is still missing while a hook writes it
+    let frontier = busy ? 0 : next;
+    pending.forEach(record => {
+        frontier = Math.min(frontier, record[0]);
+    });
+    return [data, frontier];
+}
+
+
+function onAck() {
+    inFlight--;
+    flush(false);
+    recv('ack', onAck);
+}
+
+
+function attach(func, callbacks) {
+    const address = findExport(func);
+    if (address === null) {
+        send({ type: 'missing', func: func });
+        return;
+    }
+    Interceptor.attach(address, callbacks);
+}
+
+
+function setupNative(source, functions, catalogSize) {
+    const state = Memory.alloc(Process.pointerSize * (STATE_FIELDS + catalogSize));
+    for (let field = 0; field < STATE_FIELDS + catalogSize; field++) {
+        state.add(field * Process.pointerSize).writeULong(0);
+    }
+    state.add(6 * Process.pointerSize).writeULong(start * 1000);
+    const records = Memory.alloc(RECORD_SIZE * OPTIONS.nativeCapacity);
+    const module = new CModule(source, { state: state, records: records });
+    native = { module: module, state: state, records: records, functions: functions };
+    nextSeq = new NativeFunction(module.next_seq, 'double', []);
+    now = new NativeFunction(module.now, 'double', []);
+}
+
+
+function attachNative(func, fid, paired) {
+    const address = findExport(func);
+    if (address === null) {
+        send({ type: 'missing', func: func });
+        return;
+    }
+    if (paired) {
+        Interceptor.attach(address, {
+            onEnter: native.module.on_enter_paired,
+            onLeave: native.module.on_leave_paired
+        }, ptr(fid));
+    } else {
+        Interceptor.attach(address, { onEnter: native.module.on_enter }, ptr(fid));
+    }
+}
+
+
+recv('ack', onAck);
+setInterval(() => {
+    // a run that still grows stays pending, otherwise it is sent with the next batch
+    pending.forEach((record, thread) => {
+        const seen = lastSeen.get(thread);
+        if (seen !== undefined && seen[0] === record && seen[1] === record[6]) {
+            release(thread);
+        }
+    });
+    lastSeen = new Map(Array.from(pending, ([thread, record]) => [thread, [record, record[6]]]));
+    flush(false);
+}, OPTIONS.flushInterval);
+
+rpc.exports = {
+    // called by frida before the script is unloaded, also when the target exits
+    dispose() {
+        Array.from(pending.keys()).forEach(release);
+        flush(true);
+    }
+};
+
+
+// generated handlers follow
@@ -0,0 +1,300 @@
+// rtld-audit library loaded through LD_AUDIT by AuditAnalyzer (audit_wrap.py).
+// The host appends a wrapper per traced function, generated from the signature
+// catalog, and themis_bind, mapping symbol names to them.
+//
+// la_symbind64 returns the wrapper instead of the libc function, the wrapper
+// logs the call in the filtered text format of the frida backends and forwards
+// it. Only the first process writes the trace (THEMIS_AUDIT_OUTPUT is created
+// exclusively), forked children share the library state but do not log.
+//
+// Records are buffered, the buffer is written when it is full, at exit and before
+// _exit, abort and the exec functions, which the library always hooks. A process
+// killed by a signal loses the buffered records, unless THEMIS_AUDIT_UNBUFFERED
+// is set, which writes every record at once. The errno of the target is kept
+// across the logging.
+
+#define _GNU_SOURCE
+#include <errno.h>
+#include <fcntl.h>
+#include <link.h>
+#include <pthread.h>
+#include <stdatomic.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+
+#define LINE_SIZE 4096
+#define LINE_ROOM (LINE_SIZE - 2)  // for the values, put_end always has room for ")\n"
+#define STRING_SIZE 1024  // longer strings are cut
+#define BUFFER_SIZE (1 << 16)
+#define OUT_FD_MIN 1000  // the trace fd is moved up to here, so the target gets the fd numbers it would without the library
+
+typedef long (*themis_fn)(long, long, long, long, long, long);
+
+// the wrapper for a traced function, which forwards to address, otherwise address itself
+static uintptr_t themis_bind(const char *symname, uintptr_t address);
+
+static int out_fd = -1;
+static pid_t out_pid;
+static pthread_mutex_t out_lock = PTHREAD_MUTEX_INITIALIZER;
+static char out_buffer[BUFFER_SIZE];
+static size_t out_len;
+static int out_sync;  // THEMIS_AUDIT_UNBUFFERED is set
+static int out_unbuffered;  // every record is written at once, also while the process image goes away
+static atomic_long next_call_id;
+static struct timespec start_time;
+static __thread int depth;
+
+
+static void out_write(const char *data, size_t len) {
+    while (len > 0) {
+        ssize_t written = write(out_fd, data, len);
+        if (written <= 0) {
+            return;
+        }
+        data += written;
+        len -= (size_t) written;
+    }
+}
+
+
+// out_flush and out_record may write, they keep errno as the target left it
+
+static void out_flush(void) {
+    int saved_errno = errno;
+    pthread_mutex_lock(&out_lock);
+    if (out_fd >= 0 && getpid() == out_pid) {
+        out_write(out_buffer, out_len);
+    }
+    out_len = 0;
+    pthread_mutex_unlock(&out_lock);
+    errno = saved_errno;
+}
+
+
+static void out_record(const char *line, size_t len) {
+    int saved_errno = errno;
+    pthread_mutex_lock(&out_lock);
+    if (out_len + len > BUFFER_SIZE) {
+        out_write(out_buffer, out_len);
+        out_len = 0;
+    }
+    memcpy(out_buffer + out_len, line, len);
+    out_len += len;
+    if (out_unbuffered) {
+        out_write(out_buffer, out_len);
+        out_len = 0;
+    }
+    pthread_mutex_unlock(&out_lock);
+    errno = saved_errno;
+}
+
+
+static int tracing(void) {
+    return out_fd >= 0 && getpid() == out_pid;
+}
+
+
+// the put functions append to line from len and return the new length, cutting what does not fit in LINE_ROOM
+
+static size_t put_char(char *line, size_t len, char c) {
+    if (len < LINE_ROOM) {
+        line[len++] = c;
+    }
+    return len;
+}
+
+
+static size_t put_text(char *line, size_t len, const char *text) {
+    size_t size = strnlen(text, LINE_ROOM - len);
+    memcpy(line + len, text, size);
+    return len + size;
+}
+
+
+static size_t put_hex(char *line, size_t len, unsigned long value) {
+    static const char digits[] = "0123456789abcdef";
+    char reversed[16];
+    int count = 0;
+    do {
+        reversed[count++] = digits[value & 0xf];
+        value >>= 4;
+    } while (value != 0);
+    len = put_char(line, len, '0');
+    len = put_char(line, len, 'x');
+    while (count > 0) {
+        len = put_char(line, len, reversed[--count]);
+    }
+    return len;
+}
+
+
+static size_t put_decimal(char *line, size_t len, unsigned long value, int width) {
+    // at least width digits, zero padded
+    char reversed[24];
+    int count = 0;
+    do {
+        reversed[count++] = (char) ('0' + value % 10);
+        value /= 10;
+    } while (value != 0 || count < width);
+    while (count > 0) {
+        len = put_char(line, len, reversed[--count]);
+    }
+    return len;
+}
+
+
+static size_t put_time(char *line, size_t len) {
+    // ms since la_version, with µs as decimals, like the timestamps of the frida backends
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    long us = (now.tv_sec - start_time.tv_sec) * 1000000L + (now.tv_nsec - start_time.tv_nsec) / 1000;
+    len = put_decimal(line, len, (unsigned long) us / 1000, 1);
+    len = put_char(line, len, '.');
+    len = put_decimal(line, len, (unsigned long) us % 1000, 3);
+    return put_text(line, len, " ms");
+}
+
+
+static size_t put_string(char *line, size_t len, const char *value, size_t limit) {
+    if (value == NULL) {
+        return put_hex(line, len, 0);
+    }
+    if (len + 2 > LINE_ROOM) {
+        return len;  // not even room for the quotes
+    }
+    // cut to the room left for the closing quote
+    size_t room = LINE_ROOM - len - 2;
+    line[len++] = '"';
+    for (size_t i = 0; i < limit && i < STRING_SIZE && i < room && value[i] != '\0'; i++) {
+        // records are one line each
+        line[len++] = (unsigned char) value[i] < ' ' ? '.' : value[i];
+    }
+    line[len++] = '"';
+    return len;
+}
+
+
+static size_t put_begin(char *line, const char *func, const char *callpoint, long call_id) {
+    size_t len = put_time(line, 0);
+    len = put_text(line, len, "  ");
+    for (int i = 0; i < depth && len < LINE_SIZE / 2; i++) {
+        len = put_text(line, len, "   | ");
+    }
+    len = put_text(line, len, func);
+    if (callpoint != NULL) {
+        len = put_text(line, len, "::");
+        len = put_text(line, len, callpoint);
+        len = put_char(line, len, '<');
+        len = put_decimal(line, len, (unsigned long) call_id, 1);
+        len = put_char(line, len, '>');
+    }
+    return put_char(line, len, '(');
+}
+
+
+static size_t put_name(char *line, size_t len, const char *name, int first) {
+    if (!first) {
+        len = put_text(line, len, ", ");
+    }
+    len = put_text(line, len, name);
+    return put_char(line, len, '=');
+}
+
+
+static void put_end(char *line, size_t len) {
+    line[len++] = ')';
+    line[len++] = '\n';
+    out_record(line, len);
+}
+
+
+__attribute__((destructor))
+static void themis_fini(void) {
+    out_flush();
+}
+
+
+// hooks of the functions after which the destructor does not run, the buffer is written and the records
+// of the traced wrapper of the function, if any, are written at once, an exec that fails goes on buffered
+#define THEMIS_FLUSH_HOOK(name, returns) \
+    static themis_fn flush_real_##name; \
+    static long flush_##name(long a0, long a1, long a2, long a3, long a4, long a5) { \
+        out_unbuffered = 1; \
+        out_flush(); \
+        long ret = flush_real_##name(a0, a1, a2, a3, a4, a5); \
+        out_unbuffered = !returns || out_sync; \
+        return ret; \
+    }
+
+THEMIS_FLUSH_HOOK(_exit, 0)
+THEMIS_FLUSH_HOOK(_Exit, 0)
+THEMIS_FLUSH_HOOK(abort, 0)
+THEMIS_FLUSH_HOOK(execve, 1)
+THEMIS_FLUSH_HOOK(execv, 1)
+THEMIS_FLUSH_HOOK(execvp, 1)
+THEMIS_FLUSH_HOOK(execvpe, 1)
+THEMIS_FLUSH_HOOK(fexecve, 1)
+
+#define THEMIS_BIND_FLUSH_HOOK(name) \
+    if (strcmp(symname, #name) == 0) { \
+        flush_real_##name = (themis_fn) address; \
+        return (uintptr_t) flush_##name; \
+    }
+
+
+static uintptr_t flush_bind(const char *symname, uintptr_t address) {
+    // address is the traced wrapper, if the function is traced as well
+    THEMIS_BIND_FLUSH_HOOK(_exit)
+    THEMIS_BIND_FLUSH_HOOK(_Exit)
+    THEMIS_BIND_FLUSH_HOOK(abort)
+    THEMIS_BIND_FLUSH_HOOK(execve)
+    THEMIS_BIND_FLUSH_HOOK(execv)
+    THEMIS_BIND_FLUSH_HOOK(execvp)
+    THEMIS_BIND_FLUSH_HOOK(execvpe)
+    THEMIS_BIND_FLUSH_HOOK(fexecve)
+    return address;
+}
+
+
+static int out_open(const char *path) {
+    int fd = open(path, O_WRONLY | O_CREAT | O_EXCL | O_CLOEXEC, 0644);
+    if (fd < 0) {
+        return fd;
+    }
+    int moved = fcntl(fd, F_DUPFD_CLOEXEC, OUT_FD_MIN);
+    if (moved < 0) {
+        return fd;  // e.g. a low limit of open files, the fd stays where it is
+    }
+    close(fd);
+    return moved;
+}
+
+
+unsigned int la_version(unsigned int version) {
+    const char *path = getenv("THEMIS_AUDIT_OUTPUT");
+    if (path != NULL) {
+        out_fd = out_open(path);
+        out_pid = getpid();
+        out_sync = getenv("THEMIS_AUDIT_UNBUFFERED") != NULL;
+        out_unbuffered = out_sync;
+    }
+    clock_gettime(CLOCK_MONOTONIC, &start_time);
+    return version < LAV_CURRENT ? version : LAV_CURRENT;
+}
+
+
+unsigned int la_objopen(struct link_map *map, Lmid_t lmid, uintptr_t *cookie) {
+    return LA_FLG_BINDTO | LA_FLG_BINDFROM;
+}
+
+
+uintptr_t la_symbind64(Elf64_Sym *sym, unsigned int ndx, uintptr_t *refcook,
+                       uintptr_t *defcook, unsigned int *flags, const char *symname) {
+    return flush_bind(symname, themis_bind(symname, sym->st_value));
+}
+
+
+// generated wrappers follow
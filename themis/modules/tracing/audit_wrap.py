@@ -0,0 +1,165 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from themis.modules.common.tracefile import create_trace, remove_trace
+from themis.modules.tracing.capture import Capture, resolve_captures
+from themis.modules.tracing.frida_trace_wrap import Analyzer
+from themis.modules.tracing.handlers import build_catalog
+from themis.modules.tracing.signatures import Signature, STR, FD
+from themis.modules.transforming.bintrace import convert_text_trace
+
+AUDIT_RUNTIME = Path(__file__).with_name("audit.c")
+ARGS = ", ".join(f"a{i}" for i in range(6))  # wrappers forward the six integer argument registers
+
+
+def _put_value(
+    source: str,
+    kind: str,
+    limit: Optional[int] = None
+) -> str:
+    # c expression appending one value to line
+
+    if kind == STR:
+        return f"put_string(line, len, (const char *) {source}, {'STRING_SIZE' if limit is None else limit})"
+    if kind == FD:
+        return f"put_hex(line, len, (unsigned int) {source})"
+    return f"put_hex(line, len, (unsigned long) {source})"
+
+
+
+def _generate_wrapper(
+    func: str,
+    signature: Signature,
+    captures: Tuple[Capture, ...]
+) -> str:
+
+    put_args = "".join(
+        f"""    len = put_name(line, len, "{capture.name}", {int(i == 0)});
+    len = {_put_value(f"a{capture.index}", capture.kind, capture.limit)};
+"""
+        for i, capture in enumerate(captures)
+    )
+
+    if not signature.paired:
+        return f"""static themis_fn real_{func};
+
+static long wrap_{func}({", ".join(f"long a{i}" for i in range(6))}) {{
+    if (!tracing()) {{
+        return real_{func}({ARGS});
+    }}
+    char line[LINE_SIZE];
+    size_t len = put_begin(line, "{func}", NULL, 0);
+{put_args}    put_end(line, len);
+    depth++;
+    long ret = real_{func}({ARGS});
+    depth--;
+    return ret;
+}}
+"""
+
+    return f"""static themis_fn real_{func};
+
+static long wrap_{func}({", ".join(f"long a{i}" for i in range(6))}) {{
+    if (!tracing()) {{
+        return real_{func}({ARGS});
+    }}
+    char line[LINE_SIZE];
+    long call_id = atomic_fetch_add(&next_call_id, 1);
+    size_t len = put_begin(line, "{func}", "enter", call_id);
+{put_args}    put_end(line, len);
+    depth++;
+    long ret = real_{func}({ARGS});
+    depth--;
+    len = put_begin(line, "{func}", "exit", call_id);
+    len = put_name(line, len, "retval", 1);
+    len = {_put_value("ret", signature.ret)};
+    put_end(line, len);
+    return ret;
+}}
+"""
+
+
+
+def generate_audit_source(
+    functions: List[str],
+    policies: Optional[Dict[str, str]] = None
+) -> str:
+
+    catalog = build_catalog(functions)
+    wrapped = list()
+    for (func, signature), captures in zip(catalog, resolve_captures(catalog, policies or dict())):
+        if any(name == "format" for name, _ in signature.args):
+            # variadic, floating point arguments would not be forwarded by the generic wrapper
+            print(f"{func} is not traced by the audit backend, its arguments cannot be forwarded")
+            continue
+        wrapped.append((func, signature, captures))
+
+    wrappers = "\n\n".join(_generate_wrapper(func, signature, captures) for func, signature, captures in wrapped)
+    bind = "".join(
+        f"""    if (strcmp(symname, "{func}") == 0) {{
+        real_{func} = (themis_fn) address;
+        return (uintptr_t) wrap_{func};
+    }}
+"""
+        for func, _, _ in wrapped
+    )
+
+    return f"""{AUDIT_RUNTIME.read_text()}
+{wrappers}
+
+static uintptr_t themis_bind(const char *symname, uintptr_t address) {{
+{bind}    return address;
+}}
+"""
+
+
+
+
+class AuditAnalyzer(Analyzer):
+    # traces from process start through the rtld-audit interface of the dynamic linker,
+    # with a library generated from the signature catalog, no frida involved
+
+    def _compile(
+        self,
+        directory: str
+    ) -> str:
+
+        source = f"{directory}/themis_audit.c"
+        library = f"{directory}/themis_audit.so"
+        with open(source, "w") as file:
+            file.write(generate_audit_source(list(self._traced_functions), self.config.capture_policies))
+
+        cmd = [os.environ.get("CC", "cc"), "-shared", "-fPIC", "-O2", "-o", library, source, "-lpthread"]
+        print(' '.join(cmd))
+        subprocess.run(cmd, check=True)
+        return library
+
+
+
+    def extract_libcalls(
+        self,
+        binary: bool = False
+    ) -> None:
+        # the library writes the filtered text format, it is converted afterwards if needed
+
+        filtered = os.path.abspath(f"{self.config.trace_dir}/libcalls_{self.config.executable}_filtered.txt")
+        remove_trace(filtered)  # the library only writes a trace file it creates itself
+
+        with tempfile.TemporaryDirectory() as directory:
+            library = self._compile(directory)
+            proc = self._spawn_target({"LD_AUDIT": library, "THEMIS_AUDIT_OUTPUT": filtered})
+            self._wait_target(proc)
+
+        if binary:
+            convert_text_trace(filtered, f"{self.config.trace_dir}/libcalls_{self.config.executable}.bin")
+            os.remove(filtered)
+        elif self.config.trace_compression is not None:
+            with open(filtered, "rb") as file:
+                with create_trace(filtered, self.config.trace_compression, "wb") as ofile:
+                    shutil.copyfileobj(file, ofile)
+            os.remove(filtered)
@@ -0,0 +1,70 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from themis.modules.common.errors import InvalidUseException
+from themis.modules.tracing.signatures import Signature, STR, BUF
+
+# Config.capture_policies values, for a function ("open"), one argument ("open.pathname") or all ("*")
+NONE = "none"  # not captured at all
+SCALAR = "scalar"  # integers and fds only, no strings are read and no buffer addresses logged
+STRING = "string"  # "string:N", strings are read up to N bytes
+FULL = "full"  # everything, as without a policy
+
+
+class Capture(NamedTuple):
+    index: int  # position of the argument in the call
+    name: str
+    kind: str
+    limit: Optional[int] = None  # bytes read at most, for strings
+
+
+
+
+def parse_policy(
+    policy: str
+) -> Tuple[str, Optional[int]]:
+
+    mode, _, limit = policy.strip().partition(":")
+    if mode in (NONE, SCALAR, FULL) and not limit:
+        return mode, None
+    if mode == STRING and limit.isdigit():
+        return mode, int(limit)
+    raise InvalidUseException(f"unknown capture policy {policy}, use none, scalar, string:N or full")
+
+
+
+def _capture_arg(
+    index: int,
+    name: str,
+    kind: str,
+    policy: str
+) -> Optional[Capture]:
+
+    mode, limit = parse_policy(policy)
+    if mode == NONE or (mode == SCALAR and kind in (STR, BUF)):
+        return None
+    if mode == STRING and kind == STR:
+        return Capture(index, name, kind, limit)
+    return Capture(index, name, kind)
+
+
+
+def resolve_captures(
+    catalog: List[Tuple[str, Signature]],
+    policies: Dict[str, str]
+) -> List[Tuple[Capture, ...]]:
+    # the captured arguments of every function id, the most specific policy wins
+
+    for policy in policies.values():
+        parse_policy(policy)
+
+    default = policies.get("*", FULL)
+    captures = list()
+    for func, signature in catalog:
+        captured = list()
+        for index, (name, kind) in enumerate(signature.args):
+            policy = policies.get(f"{func}.{name}", policies.get(func, default))
+            capture = _capture_arg(index, name, kind, policy)
+            if capture is not None:
+                captured.append(capture)
+        captures.append(tuple(captured))
+    return captures
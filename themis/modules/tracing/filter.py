@@ -1,18 +1,129 @@
 import re
+import os
+import mmap
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Generator, Iterable, Any, Optional, BinaryIO, List, Tuple
+
+from themis.modules.common.tracefile import open_trace, create_trace, find_trace, detect_compression
+
+TIMESTAMP = re.compile(r"\s*(\d{1,10}\sms.+)\n")  # the timestamp is kept, the parser reads it
+TIMESTAMP_LINES = re.compile(rb"^[^\S\n]*(\d{1,10}[^\S\n]ms.+)\n", re.MULTILINE)  # TIMESTAMP for whole blocks
+
+BLOCK_SIZE = 1 << 22  # read at once from compressed traces
+CHUNK_SIZE = 1 << 25  # plain traces larger than this are split across processes
+
+def filter_lines(
+    lines: Iterable[str]
+) -> Generator[str, Any, Any]:
+
+    for line in lines:
+        mat = TIMESTAMP.match(line)
+        if mat is not None:
+            yield mat.group(1)
+
+
+
+def filter_block(
+    buffer,
+    start: int = 0,
+    end: Optional[int] = None
+) -> bytes:
+    # buffer[start:end] has to hold whole lines, it is not copied
+
+    lines = TIMESTAMP_LINES.findall(buffer, start, len(buffer) if end is None else end)
+    if not lines:
+        return b""
+    lines.append(b"")
+    return b"\n".join(lines)
+
+
+
+def _filter_chunk(
+    path: str,
+    start: int,
+    end: int
+) -> bytes:
+
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return filter_block(buffer, start, end)
+
+
+
+def _chunk_bounds(
+    buffer: mmap.mmap,
+    chunks: int
+) -> List[Tuple[int, int]]:
+    # chunks end after a newline, so no line is split
+
+    bounds = list()
+    start = 0
+    for i in range(1, chunks):
+        end = buffer.find(b"\n", max(start, len(buffer) * i // chunks)) + 1
+        if end == 0:
+            break
+        bounds.append((start, end))
+        start = end
+    bounds.append((start, len(buffer)))
+    return bounds
+
+
+
+def _filter_mapped(
+    path: str,
+    ofile: BinaryIO,
+    processes: Optional[int]
+) -> None:
+
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            if len(buffer) <= CHUNK_SIZE or processes == 1:
+                ofile.write(filter_block(buffer))
+                return
+            bounds = _chunk_bounds(buffer, -(-len(buffer) // CHUNK_SIZE))
+
+    # every worker maps the file itself, only the filtered output is sent back, in order
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        starts, ends = zip(*bounds)
+        for filtered in pool.map(_filter_chunk, repeat(path), starts, ends):
+            ofile.write(filtered)
+
+
+
+def _filter_stream(
+    file: BinaryIO,
+    ofile: BinaryIO
+) -> None:
+
+    rest = b""
+    while block := file.read(BLOCK_SIZE):
+        block = rest + block
+        end = block.rfind(b"\n") + 1
+        ofile.write(filter_block(block, 0, end))
+        rest = block[end:]
+    # like filter_lines, a last line without newline is dropped
+
 
-TIMESTAMP = re.compile(r"\s*\d{1,10}\sms(.+)\n")
 
 def filter_file(
     filename: str,
-    outfile: str
+    outfile: str,
+    compression: Optional[str] = None,
+    processes: Optional[int] = None
 ) -> None:
+    # plain traces are memory-mapped, compressed ones are decompressed in large blocks
 
-    with open(filename, "r") as file:
-        with open(outfile, "w") as ofile:
-            for line in file:
-                mat = TIMESTAMP.match(line)
-                if mat is not None:
-                    ofile.write(mat.group(1))
-                    ofile.write("\n")
+    path = find_trace(filename)
+    if path is None:
+        raise FileNotFoundError(f"no trace at {filename}")
 
+    with create_trace(outfile, compression, "wb") as ofile:
+        if detect_compression(path) is None:
+            if os.path.getsize(path) > 0:
+                _filter_mapped(path, ofile, processes)
+            return
 
+        with open_trace(filename, "rb") as file:
+            _filter_stream(file, ofile)
@@ -0,0 +1,261 @@
+import threading
+import queue
+import json
+import heapq
+import frida
+
+from pathlib import Path
+from psutil import Popen
+from typing import Any, Callable, Dict, Generator, List, Optional
+
+from themis.modules.common.config import Config
+from themis.modules.common.records import CallRecord, format_record
+from themis.modules.common.tracefile import create_trace
+from themis.modules.tracing.frida_trace_wrap import Analyzer
+from themis.modules.tracing.capture import resolve_captures
+from themis.modules.tracing.handlers import build_catalog, generate_handlers, decode_value, decode_native, CALLPOINTS, CALLPOINT_EXIT
+from themis.modules.transforming.bintrace import BinaryTraceWriter
+
+AGENT_SCRIPT = Path(__file__).with_name("agent.js")
+DETACH_TIMEOUT = 5.0  # seconds to wait for the last messages after the target exits
+EXIT_ARGS = ("retval",)
+
+
+class AgentAnalyzer(Analyzer):
+    # traces through the frida python bindings, receiving structured call records from our own agent,
+    # instead of letting frida-trace print them as text that has to be filtered and parsed again
+
+    def __init__(
+        self,
+        config: Config
+    ) -> None:
+
+        super().__init__(config)
+        self._catalog = build_catalog(list(self._traced_functions))
+        self._captures = resolve_captures(self._catalog, config.capture_policies)
+        self._arg_names = [tuple(capture.name for capture in captured) for captured in self._captures]
+        self._sink: Callable[[Optional[CallRecord]], None] = lambda record: None  # None marks the end of the trace
+        self._detached = threading.Event()
+        self._script: Optional[frida.core.Script] = None
+        self._records = 0
+        self._calls = 0  # differs from records, if runs of identical calls are collapsed
+        self._dropped: Dict[str, int] = dict()  # per function, cumulative counts reported by the agent
+        self._filtered: Dict[str, int] = dict()  # per agent_filters rule, cumulative as well
+        self._held: List[List[Any]] = list()  # heap of native and js records by seq, waiting for the frontier
+
+
+
+    def _build_options(
+        self
+    ) -> Dict[str, Any]:
+
+        return {
+            "batchSize": self.config.agent_batch_size,
+            "flushInterval": self.config.agent_flush_interval,
+            "capacity": self.config.agent_buffer_capacity,
+            "maxInFlight": self.config.agent_max_in_flight,
+            "nativeCapacity": self.config.agent_native_capacity,
+            "filters": len(self.config.agent_filters)
+        }
+
+
+
+    def _build_script(
+        self
+    ) -> str:
+
+        return f"const OPTIONS = {json.dumps(self._build_options())};\n" \
+            f"{AGENT_SCRIPT.read_text()}\n" \
+            f"{generate_handlers(self._catalog, self._captures, self.config.agent_collapse, self.config.agent_native_functions, self.config.agent_native_capacity, self.config.agent_filters)}"
+
+
+
+    def _on_message(
+        self,
+        message: Dict[str, Any],
+        data: Any
+    ) -> None:
+
+        if message["type"] == "error":
+            print(f"agent error: {message.get('description')}")
+            return
+
+        payload = message["payload"]
+        if payload["type"] == "batch":
+            self._deliver(self._merge(payload["records"], data, payload["frontier"]))
+            self._dropped = {self._catalog[int(fid)][0]: count for fid, count in payload["dropped"].items()}
+            self._filtered = {rule.name: count for rule, count in zip(self.config.agent_filters, payload["filtered"])}
+            # the agent holds back further batches until this one is consumed
+            self._script.post({"type": "ack"})
+        elif payload["type"] == "missing":
+            print(f"could not find {payload['func']} in the target")
+
+
+
+    def _deliver(
+        self,
+        records: List[List[Any]]
+    ) -> None:
+
+        for seq, time, depth, fid, callpoint, call_id, repeat, *values in records:
+            names = EXIT_ARGS if callpoint == CALLPOINT_EXIT else self._arg_names[fid]
+            self._sink(CallRecord(
+                offset=depth,
+                func=self._catalog[fid][0],
+                callpoint=CALLPOINTS[callpoint],
+                call_id=call_id,
+                args=dict(zip(names, map(decode_value, values))),
+                repeat=repeat,
+                time=time
+            ))
+            self._calls += repeat
+        self._records += len(records)
+
+
+
+    def _merge(
+        self,
+        records: List[List[Any]],
+        data: Optional[bytes],
+        frontier: Optional[int]
+    ) -> List[List[Any]]:
+        # js records in the order the agent sent them, unless native ones have to be sorted in by seq,
+        # those from seq frontier on are held back, as records with a lower seq may still follow
+
+        if data is None and not self._held and frontier is None:
+            return records
+
+        for record in records:
+            heapq.heappush(self._held, record)
+        if data is not None:
+            for record in decode_native(data, self._catalog, self._captures):
+                heapq.heappush(self._held, record)
+
+        ready = list()
+        while self._held and (frontier is None or self._held[0][0] < frontier):
+            ready.append(heapq.heappop(self._held))
+        return ready
+
+
+
+    def _report(
+        self
+    ) -> Dict[str, Any]:
+
+        dropped = sum(self._dropped.values())
+        if dropped:
+            print(f"the agent buffer overflowed, {dropped} calls were dropped: " +
+                ", ".join(f"{func} {count}" for func, count in sorted(self._dropped.items())))
+        return {
+            "records": self._records,
+            "calls": self._calls,
+            "dropped": dropped,
+            "dropped_per_function": self._dropped,
+            "filtered_per_rule": self._filtered
+        }
+
+
+
+    def _on_detached(
+        self
+    ) -> None:
+
+        self._deliver(self._merge(list(), None, None))
+        self._sink(None)
+        self._detached.set()
+
+
+
+    def _attach_agent(
+        self,
+        pid: int
+    ) -> frida.core.Session:
+
+        session = frida.attach(pid)
+        session.on("detached", lambda *_: self._on_detached())
+        self._script = session.create_script(self._build_script())
+        self._script.on("message", self._on_message)
+        self._script.load()
+        return session
+
+
+
+    def extract_libcalls(
+        self,
+        binary: bool = False
+    ) -> None:
+        # records are already structured, so they are written out in the filtered or binary format right away
+
+        proc = self._spawn_target()
+        if binary:
+            with open(f"{self.config.trace_dir}/libcalls_{self.config.executable}.bin", "wb") as outfile:
+                with BinaryTraceWriter(outfile) as writer:
+                    self._collect(proc, writer.write)
+        else:
+            filtered = f"{self.config.trace_dir}/libcalls_{self.config.executable}_filtered.txt"
+            with create_trace(filtered, self.config.trace_compression) as outfile:
+                self._collect(proc, lambda record: outfile.write(f"{format_record(record)}\n"))
+
+        self._write_meta()
+
+
+
+    def _write_meta(
+        self
+    ) -> None:
+
+        with open(f"{self.config.trace_dir}/libcalls_{self.config.executable}_meta.json", "w") as metafile:
+            json.dump(self._report(), metafile, indent=4)
+
+
+
+    def _collect(
+        self,
+        proc: Popen,
+        write: Callable[[CallRecord], Any]
+    ) -> None:
+
+        def sink(record: Optional[CallRecord]) -> None:
+            if record is not None:
+                write(record)
+
+        self._sink = sink
+        self._attach_agent(proc.pid)
+        try:
+            self._wait_target(proc)
+            self._detached.wait(timeout=DETACH_TIMEOUT)
+        finally:
+            self._sink = lambda record: None
+
+
+
+    def stream_libcalls(
+        self
+    ) -> Generator[CallRecord, Any, Any]:
+        # records are yielded while the target runs, the generator ends once the agent is detached,
+        # a consumer falling behind blocks the delivery of batches, so the agent holds back further ones
+
+        records = queue.Queue(maxsize=self.config.agent_batch_size * self.config.agent_max_in_flight)
+        self._sink = records.put
+        proc = self._spawn_target()
+        self._attach_agent(proc.pid)
+
+        try:
+            while True:
+                try:
+                    record = records.get(timeout=DETACH_TIMEOUT)
+                except queue.Empty:
+                    if proc.poll() is not None and not self._detached.wait(timeout=DETACH_TIMEOUT):
+                        break  # target is gone, but frida never reported it
+                    continue
+                if record is None:
+                    break
+                yield record
+        finally:
+            # a delivery blocked on the full queue goes on, also if the consumer stopped early
+            self._sink = lambda record: None
+            while not records.empty():
+                records.get_nowait()
+
+        self._wait_target(proc)
+        self._write_meta()
@@ -1,12 +1,17 @@
 import subprocess
 import os
+import threading
+import psutil
 
-from typing import List
+from typing import List, Generator, Any, Optional, Dict
 from deprecated import deprecated
 from psutil import Popen
 
 from themis.modules.common.config import Config
+from themis.modules.common.errors import TraceTimeoutException
+from themis.modules.common.tracefile import copy_to_trace
 
+TRACER_EXIT_TIMEOUT = 10  # s the tracer gets to flush its output after its target exited, or was killed
 
 class Analyzer:
     def __init__(
@@ -50,11 +55,13 @@ class Analyzer:
 
 
     def _spawn_target(
-        self
+        self,
+        env: Optional[Dict[str, str]] = None
     ) -> Popen:
     
         changed_env = os.environ.copy()
         changed_env["LD_LIBRARY_PATH"] = f"{self.config.lib_dir}"
+        changed_env.update(env or dict())
         proc = subprocess.Popen(
             [self._exec_path, *self.config.args],
             env=changed_env
@@ -63,11 +70,10 @@ class Analyzer:
 
 
 
-    def _attach_trace(
+    def _trace_command(
         self,
-        pid: int,
-        outname: str
-    ) -> Popen:
+        pid: int
+    ) -> List[str]:
         # simply via bash atm, as we dont want to reimplement frida-trace
 
         cmd = ["frida-trace"]
@@ -78,9 +84,19 @@ class Analyzer:
         cmd.append(f"{pid}")
 
         print(' '.join(cmd))
+        return cmd
+
+
+
+    def _attach_trace(
+        self,
+        pid: int,
+        outname: str
+    ) -> Popen:
+
         with open(outname, "w") as file:
             trace_process = subprocess.Popen(
-                cmd,
+                self._trace_command(pid),
                 stdout=file,
                 stdin=subprocess.DEVNULL
             )
@@ -93,15 +109,105 @@ class Analyzer:
     ) -> None:
 
         proc = self._spawn_target()
-        self._attach_trace(proc.pid, f"{self.config.trace_dir}/libcalls_{self.config.executable}.txt")
-        self._interact(proc)
+        outname = f"{self.config.trace_dir}/libcalls_{self.config.executable}.txt"
+        if self.config.trace_compression is None:
+            trace_process = self._attach_trace(proc.pid, outname)
+            try:
+                self._wait_target(proc)
+            finally:
+                # the trace is complete once the tracer quit
+                self._stop_tracer(trace_process)
+            return
+
+        # frida-trace only prints plain text, it is compressed on its way to the disk
+        trace_process = subprocess.Popen(
+            self._trace_command(proc.pid),
+            stdout=subprocess.PIPE,
+            stdin=subprocess.DEVNULL
+        )
+        writer = copy_to_trace(trace_process.stdout, outname, self.config.trace_compression)
+        try:
+            self._wait_target(proc)
+        finally:
+            # the writer stops at the end of the output of the tracer, once it quit
+            self._stop_tracer(trace_process)
+            writer.join(timeout=TRACER_EXIT_TIMEOUT)
+
+
+
+    def stream_libcalls(
+        self
+    ) -> Generator[str, Any, Any]:
+        # raw frida-trace output lines, as they are printed, frida-trace quits when the target exits,
+        # the target is watched while the lines are read, a timeout ends them and is raised after the last one
+
+        proc = self._spawn_target()
+        trace_process = subprocess.Popen(
+            self._trace_command(proc.pid),
+            stdout=subprocess.PIPE,
+            stdin=subprocess.DEVNULL,
+            text=True
+        )
+        errors: List[TraceTimeoutException] = list()
+
+        def watch() -> None:
+            try:
+                self._wait_target(proc)
+            except TraceTimeoutException as error:
+                errors.append(error)
+
+        watchdog = threading.Thread(target=watch, daemon=True)
+        watchdog.start()
+        try:
+            with trace_process.stdout:
+                yield from trace_process.stdout
+        finally:
+            self._stop_tracer(trace_process)
+            watchdog.join()
+        if errors:
+            raise errors[0]
 
 
 
     @deprecated("we are not writing to ssh, as it does not work")
     def _interact(self, process: subprocess.Popen):
         # process.communicate(b"ishtar\nuname -a\nexit", timeout=20)
-        process.wait()
+        self._wait_target(process)
+
+
+
+    def _wait_target(
+        self,
+        process: subprocess.Popen
+    ) -> None:
+        # the target is killed with its children once trace_timeout passed
+
+        try:
+            process.wait(timeout=self.config.trace_timeout)
+        except subprocess.TimeoutExpired:
+            # the tracer quits with its target, children of the target would outlive it otherwise
+            for child in psutil.Process(process.pid).children(recursive=True):
+                try:
+                    child.kill()
+                except psutil.NoSuchProcess:
+                    pass
+            process.kill()
+            process.wait()
+            raise TraceTimeoutException(f"{self.config.executable} did not exit within {self.config.trace_timeout}s")
+
+
+
+    @staticmethod
+    def _stop_tracer(
+        trace_process: subprocess.Popen
+    ) -> None:
+        # the tracer quits with its target, it is killed if it does not
+
+        try:
+            trace_process.wait(timeout=TRACER_EXIT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            trace_process.kill()
+            trace_process.wait()
 
 
 
@@ -0,0 +1,279 @@
+import json
+import struct
+import sys
+
+from pathlib import Path
+from typing import Any, Generator, List, Optional, Tuple
+
+from themis.modules.common.config import FilterRule
+from themis.modules.tracing.capture import Capture
+from themis.modules.tracing.signatures import SIGNATURES, Signature, STR, FD, BUF
+
+# callpoint field of the records sent by the agent
+CALLPOINT_NONE = 0
+CALLPOINT_ENTER = 1
+CALLPOINT_EXIT = 2
+CALLPOINTS = (None, "enter", "exit")
+VALUES = 7  # position of the first value in a record
+
+NATIVE_SOURCE = Path(__file__).with_name("native.c")
+NATIVE_RECORD = struct.Struct("<QQIIIIQ6Q")  # Record in native.c, the values are raw register contents
+NATIVE_VALUES = 6
+
+Catalog = List[Tuple[str, Signature]]  # traced functions, the index is the function id in the records
+Captures = List[Tuple[Capture, ...]]  # captured arguments by function id, from resolve_captures
+
+
+def build_catalog(
+    functions: List[str]
+) -> Catalog:
+
+    catalog = list()
+    for function in sorted(set(map(str.strip, functions))):
+        if not function:
+            continue
+        signature = SIGNATURES.get(function, None)
+        if signature is None:
+            print(f"no signature known for {function}, tracing it without arguments")
+            signature = Signature(args=())
+        catalog.append((function, signature))
+    return catalog
+
+
+
+def _read_value(
+    source: str,
+    kind: str,
+    limit: Optional[int] = None
+) -> str:
+    # js expression reading one argument or return value
+
+    if kind == STR and limit is not None:
+        return f"readString({source}, {limit})"
+    if kind == STR:
+        return f"readString({source})"
+    if kind == FD:
+        return f"{source}.toInt32()"
+    return f"{source}.toString()"
+
+
+
+def _filter_condition(
+    index: int,
+    rule: FilterRule,
+    fid: int,
+    func: str,
+    signature: Signature
+) -> Optional[str]:
+    # js condition for the calls of func dropped by the rule, None if it does not apply to func
+
+    if rule.functions and func not in rule.functions:
+        return None
+
+    conditions = list()
+    if rule.fds:
+        fds = [f"args[{i}].toInt32()" for i, (_, kind) in enumerate(signature.args) if kind == FD]
+        if not fds:
+            return None
+        conditions.append("(" + " || ".join(f"{json.dumps(rule.fds)}.includes({fd})" for fd in fds) + ")")
+    if rule.paths:
+        paths = [f"args[{i}]" for i, (_, kind) in enumerate(signature.args) if kind == STR]
+        if not paths:
+            return None
+        conditions.append("(" + " || ".join(f"hasPrefix({path}, {json.dumps(rule.paths)})" for path in paths) + ")")
+    if rule.rate is not None:
+        # last, only the calls matching the other conditions count towards the rate
+        conditions.append(f"overRate({index}, {fid}, {rule.rate})")
+    return " && ".join(conditions) or "true"
+
+
+
+def _filter_conditions(
+    rules: List[FilterRule],
+    fid: int,
+    func: str,
+    signature: Signature
+) -> List[Tuple[int, str]]:
+
+    conditions = [(index, _filter_condition(index, rule, fid, func, signature)) for index, rule in enumerate(rules)]
+    return [(index, condition) for index, condition in conditions if condition is not None]
+
+
+
+def _generate_filters(
+    conditions: List[Tuple[int, str]],
+    paired: bool
+) -> str:
+    # the first matching rule counts the call, the exit of a filtered paired call is skipped as well
+
+    skip = "this.filtered = true;\n            return;" if paired else "return;"
+    return "".join(
+        f"""        if ({condition}) {{
+            filtered[{index}]++;
+            {skip}
+        }}
+"""
+        for index, condition in conditions
+    )
+
+
+
+def _generate_handler(
+    fid: int,
+    func: str,
+    signature: Signature,
+    captures: Tuple[Capture, ...],
+    collapse: bool,
+    rules: List[FilterRule]
+) -> str:
+    # records are [seq, time, depth, function id, callpoint, call id, repeat, ...values], the captured values in signature order
+
+    filters = _generate_filters(_filter_conditions(rules, fid, func, signature), signature.paired)
+    values = "".join(f", {_read_value(f'args[{capture.index}]', capture.kind, capture.limit)}" for capture in captures)
+
+    if not signature.paired and collapse:
+        # identical to the pending record, apart from time and buffers, only increases its repeat count
+        same = "".join(
+            f" && held[{VALUES + i}] === record[{VALUES + i}]"
+            for i, capture in enumerate(captures) if capture.kind != BUF
+        )
+        return f"""attach('{func}', {{
+    onEnter(args) {{
+{filters}        const record = [nextSeq(), now(), this.depth, {fid}, {CALLPOINT_NONE}, null, 1{values}];
+        const held = pending.get(this.threadId);
+        if (held !== undefined && held[3] === {fid} && held[2] === record[2]{same}) {{
+            held[6]++;
+            return;
+        }}
+        release(this.threadId);
+        pending.set(this.threadId, record);
+    }}
+}});
+"""
+
+    if not signature.paired:
+        return f"""attach('{func}', {{
+    onEnter(args) {{
+{filters}        emit({fid}, [nextSeq(), now(), this.depth, {fid}, {CALLPOINT_NONE}, null, 1{values}], this.threadId);
+    }}
+}});
+"""
+
+    return f"""attach('{func}', {{
+    onEnter(args) {{
+{filters}        this.callId = nextSeq();
+        this.dropped = !emit({fid}, [this.callId, now(), this.depth, {fid}, {CALLPOINT_ENTER}, this.callId, 1{values}], this.threadId);
+    }},
+    onLeave(retval) {{
+        if (this.filtered) {{
+            return;
+        }}
+        if (this.dropped) {{
+            // without its enter record, the exit record could not be paired
+            drop({fid}, 1);
+            return;
+        }}
+        emit({fid}, [nextSeq(), now(), this.depth, {fid}, {CALLPOINT_EXIT}, this.callId, 1, {_read_value('retval', signature.ret)}], this.threadId);
+    }}
+}});
+"""
+
+
+
+def _native_fids(
+    catalog: Catalog,
+    captures: Captures,
+    functions: List[str],
+    rules: List[FilterRule]
+) -> List[int]:
+    # native records hold raw values only, captured strings still have to be read by js,
+    # filter rules are evaluated by js as well
+
+    fids = list()
+    for function in sorted(set(map(str.strip, functions))):
+        fid = next((fid for fid, (func, _) in enumerate(catalog) if func == function), None)
+        if fid is None:
+            print(f"{function} is not traced, it cannot be hooked natively")
+            continue
+        if any(capture.index >= NATIVE_VALUES or capture.kind == STR for capture in captures[fid]):
+            print(f"{function} has string or too many arguments, hooking it in js")
+            continue
+        if _filter_conditions(rules, fid, function, catalog[fid][1]):
+            print(f"{function} is filtered by agent_filters, hooking it in js")
+            continue
+        fids.append(fid)
+    return fids
+
+
+
+def _generate_native_setup(
+    catalog: Catalog,
+    captures: Captures,
+    fids: List[int],
+    capacity: int
+) -> str:
+
+    # arguments up to the last captured one are copied
+    argcs = ", ".join(str(max((capture.index + 1 for capture in captured), default=0)) for captured in captures)
+    source = f"#define FUNCTIONS {len(catalog)}\n" \
+        f"#define CAPACITY {capacity}\n" \
+        f"static const unsigned char argcs[] = {{ {argcs} }};\n" \
+        f"{NATIVE_SOURCE.read_text()}"
+
+    lines = [f"setupNative({json.dumps(source)}, {json.dumps(fids)}, {len(catalog)});"]
+    for fid in fids:
+        func, signature = catalog[fid]
+        lines.append(f"attachNative('{func}', {fid}, {json.dumps(signature.paired)});")
+    return "\n".join(lines) + "\n"
+
+
+
+def generate_handlers(
+    catalog: Catalog,
+    captures: Captures,
+    collapse: bool = False,
+    native: List[str] = (),
+    native_capacity: int = 1 << 16,
+    rules: List[FilterRule] = ()
+) -> str:
+    # one specialized handler per function, so no signature is interpreted in the target,
+    # with collapse, runs of identical calls that are not paired are sent as one record,
+    # the native functions are hooked by native.c and never collapsed, calls matching the rules are dropped
+
+    fids = _native_fids(catalog, captures, native, rules)
+    handlers = [
+        _generate_handler(fid, func, signature, captures[fid], collapse, rules)
+        for fid, (func, signature) in enumerate(catalog) if fid not in fids
+    ]
+    if fids:
+        handlers.insert(0, _generate_native_setup(catalog, captures, fids, native_capacity))
+    return "\n".join(handlers)
+
+
+
+def decode_value(
+    value
+) -> str:
+    # fds arrive as numbers, everything else already formatted like the text traces
+
+    # interned like the values of the text traces
+    if isinstance(value, str):
+        return sys.intern(value)
+    return sys.intern(hex(value & 0xffffffff))
+
+
+
+def decode_native(
+    data: bytes,
+    catalog: Catalog,
+    captures: Captures
+) -> Generator[List[Any], Any, Any]:
+    # native records in the layout of the js ones, with the captured values formatted like the text traces
+
+    for seq, time, fid, depth, callpoint, argc, call_id, *values in NATIVE_RECORD.iter_unpack(data):
+        if callpoint == CALLPOINT_EXIT:
+            captured = [(values[0], catalog[fid][1].ret)]
+        else:
+            captured = [(values[capture.index], capture.kind) for capture in captures[fid]]
+        values = [hex(value & 0xffffffff) if kind == FD else hex(value) for value, kind in captured]
+        yield [seq, time / 1000, depth, fid, callpoint, None if callpoint == CALLPOINT_NONE else call_id, 1, *values]
@@ -0,0 +1,122 @@
+// CModule hooks of the agent (agent.js) for the functions in agent_native_functions.
+// The host prepends FUNCTIONS, CAPACITY and argcs[] (arguments per function id),
+// the agent allocates state and records and drains the records in bulk, the host
+// decodes them with NATIVE_RECORD in handlers.py.
+//
+// Writers serialize through a ticket lock, as CModule offers atomic add but no
+// compare-and-swap. Sequence numbers come from next_seq, shared with the js
+// handlers, and order the native and js records on the host; inflight tells the
+// agent whether a record with an already taken sequence number is still missing.
+
+#include <gum/guminterceptor.h>
+
+#define VALUES 6
+#define DROPPED ((guint64) -1)
+
+enum { CALLPOINT_NONE, CALLPOINT_ENTER, CALLPOINT_EXIT };
+
+typedef struct {
+    guint64 seq;
+    guint64 time;  // µs since state.start
+    guint32 fid;
+    guint32 depth;
+    guint32 callpoint;
+    guint32 argc;
+    guint64 call_id;
+    guint64 values[VALUES];
+} Record;
+
+typedef struct {
+    volatile gsize next_seq;
+    volatile gsize next_ticket;
+    volatile gsize now_serving;
+    volatile gsize inflight;
+    volatile gsize write_pos;
+    volatile gsize read_pos;
+    gsize start;  // µs of the real time clock, when the agent started
+    volatile gsize dropped[FUNCTIONS];
+} State;
+
+typedef struct {
+    guint64 call_id;
+} CallState;
+
+extern State state;
+extern Record records[];
+
+
+static guint64 emit(GumInvocationContext *ic, guint callpoint, guint64 call_id) {
+    gsize fid = GUM_IC_GET_FUNC_DATA(ic, gsize);
+    gsize ticket = g_atomic_pointer_add(&state.next_ticket, 1);
+    gsize seq;
+    gsize pos;
+
+    while (state.now_serving != ticket) {
+        // spin, the holder only copies a few values
+    }
+
+    state.inflight = 1;
+    seq = g_atomic_pointer_add(&state.next_seq, 1);
+    pos = state.write_pos;
+    if (pos - state.read_pos >= CAPACITY) {
+        state.dropped[fid]++;
+        seq = DROPPED;
+    } else {
+        Record *record = &records[pos % CAPACITY];
+        record->seq = seq;
+        record->time = g_get_real_time() - state.start;
+        record->fid = fid;
+        record->depth = gum_invocation_context_get_depth(ic);
+        record->callpoint = callpoint;
+        record->call_id = callpoint == CALLPOINT_ENTER ? seq : call_id;
+        if (callpoint == CALLPOINT_EXIT) {
+            record->argc = 1;
+            record->values[0] = GPOINTER_TO_SIZE(gum_invocation_context_get_return_value(ic));
+        } else {
+            record->argc = argcs[fid];
+            for (guint i = 0; i < argcs[fid]; i++) {
+                record->values[i] = GPOINTER_TO_SIZE(gum_invocation_context_get_nth_argument(ic, i));
+            }
+        }
+        state.write_pos = pos + 1;
+    }
+    state.inflight = 0;
+    g_atomic_pointer_add(&state.now_serving, 1);
+
+    return seq;
+}
+
+
+void on_enter(GumInvocationContext *ic) {
+    emit(ic, CALLPOINT_NONE, 0);
+}
+
+
+void on_enter_paired(GumInvocationContext *ic) {
+    CallState *call = GUM_IC_GET_INVOCATION_DATA(ic, CallState);
+    call->call_id = emit(ic, CALLPOINT_ENTER, 0);
+}
+
+
+void on_leave_paired(GumInvocationContext *ic) {
+    CallState *call = GUM_IC_GET_INVOCATION_DATA(ic, CallState);
+    gsize fid = GUM_IC_GET_FUNC_DATA(ic, gsize);
+
+    if (call->call_id == DROPPED) {
+        // without its enter record, the exit record could not be paired
+        g_atomic_pointer_add(&state.dropped[fid], 1);
+    } else {
+        emit(ic, CALLPOINT_EXIT, call->call_id);
+    }
+}
+
+
+double next_seq(void) {
+    return (double) g_atomic_pointer_add(&state.next_seq, 1);
+}
+
+
+double now(void) {
+    // ms of the record times, for the js handlers, which only have Date.now()
+    return (g_get_real_time() - (gint64) state.start) / 1000.0;
+}
@@ -0,0 +1,194 @@
+from typing import NamedTuple, Optional, Tuple, Dict
+
+INT = "i"  # integers and pointers, logged as hex
+STR = "s"  # char *, logged as a quoted string
+FD = "fd"  # int file descriptor, logged as hex
+BUF = "b"  # buffer pointer, logged as hex, differs between otherwise identical calls
+
+
+class Signature(NamedTuple):
+    args: Tuple[Tuple[str, str], ...]  # (name, kind) in call order
+    paired: bool = False  # traced as ::enter/::exit, so that the return value is known
+    returns_fd: bool = False  # the return value is a new fd, or stream pointer
+    ret: str = INT  # kind of the return value
+
+
+
+
+def _sig(
+    *args: str,
+    paired: bool = False,
+    returns: Optional[str] = None
+) -> Signature:
+    # args are names, a trailing ':s' marks a string argument, ':fd' a file descriptor, ':b' a buffer,
+    # returns is the kind of a returned descriptor, FD or INT for stream pointers,
+    # it is only known at the exit of the call, so it implies pairing
+
+    parsed = []
+    for arg in args:
+        name, _, kind = arg.partition(":")
+        parsed.append((name, kind or INT))
+    return Signature(
+        args=tuple(parsed),
+        paired=paired or returns is not None,
+        returns_fd=returns is not None,
+        ret=returns or INT
+    )
+
+
+
+
+# argument names follow the man pages, like the handlers generated by frida-trace,
+# the agent handlers are generated from this catalog (handlers.py), new libcalls only need an entry here
+SIGNATURES: Dict[str, Signature] = {
+    # binary files
+    "open": _sig("pathname:s", "flags", returns=FD),
+    "openat": _sig("dirfd:fd", "pathname:s", "flags", returns=FD),
+    "creat": _sig("pathname:s", "mode", returns=FD),
+    "close": _sig("fd:fd"),
+    "close_range": _sig("first", "last", "flags"),
+    "closefrom": _sig("lowfd:fd"),
+    "read": _sig("fd:fd", "buf:b", "count"),
+    "write": _sig("fd:fd", "buf:b", "count"),
+    "pread": _sig("fd:fd", "buf:b", "count", "offset"),
+    "pwrite": _sig("fd:fd", "buf:b", "count", "offset"),
+    "readv": _sig("fd:fd", "iov:b", "iovcnt"),
+    "writev": _sig("fd:fd", "iov:b", "iovcnt"),
+    "preadv": _sig("fd:fd", "iov:b", "iovcnt", "offset"),
+    "pwritev": _sig("fd:fd", "iov:b", "iovcnt", "offset"),
+    "preadv2": _sig("fd:fd", "iov:b", "iovcnt", "offset", "flags"),
+    "pwritev2": _sig("fd:fd", "iov:b", "iovcnt", "offset", "flags"),
+    "copy_file_range": _sig("fd_in:fd", "off_in", "fd_out:fd", "off_out", "len", "flags"),
+    "remove": _sig("pathname:s"),
+    "rename": _sig("oldpath:s", "newpath:s"),
+    "unlink": _sig("pathname:s"),
+    "fcntl": _sig("fd:fd", "cmd", "arg"),
+    "dup": _sig("oldfd:fd", returns=FD),
+    "dup2": _sig("oldfd:fd", "newfd:fd"),
+    "dup3": _sig("oldfd:fd", "newfd:fd", "flags"),
+
+    # streams
+    "fopen": _sig("pathname:s", "mode:s", returns=INT),
+    "freopen": _sig("pathname:s", "mode:s", "stream", returns=INT),
+    "fdopen": _sig("fd:fd", "mode:s", returns=INT),
+    "fclose": _sig("stream"),
+    "fcloseall": _sig(),
+    "fputc": _sig("c", "stream"),
+    "fputwc": _sig("wc", "stream"),
+    "fputc_unlocked": _sig("c", "stream"),
+    "fputwc_unlocked": _sig("wc", "stream"),
+    "fputs": _sig("s:s", "stream"),
+    "fputws": _sig("ws", "stream"),
+    "fputs_unlocked": _sig("s:s", "stream"),
+    "fputws_unlocked": _sig("ws", "stream"),
+    "fgetc": _sig("stream"),
+    "fgetwc": _sig("stream"),
+    "fgetc_unlocked": _sig("stream"),
+    "fgetwc_unlocked": _sig("stream"),
+    "getline": _sig("lineptr:b", "n", "stream"),
+    "getdelim": _sig("lineptr:b", "n", "delim", "stream"),
+    "fgets": _sig("s:s", "n", "stream"),
+    "fgetws": _sig("ws", "n", "stream"),
+    "fgets_unlocked": _sig("s:s", "n", "stream"),
+    "fgetws_unlocked": _sig("ws", "n", "stream"),
+    "fread": _sig("ptr:b", "size", "nmemb", "stream"),
+    "fread_unlocked": _sig("ptr:b", "size", "nmemb", "stream"),
+    "fwrite": _sig("ptr:b", "size", "nmemb", "stream"),
+    "fwrite_unlocked": _sig("ptr:b", "size", "nmemb", "stream"),
+    "fprintf": _sig("stream", "format:s"),
+    "fwprintf": _sig("stream", "format"),
+    "fscanf": _sig("stream", "format:s"),
+    "fwscanf": _sig("stream", "format"),
+    "putc": _sig("c", "stream"),
+    "putwc": _sig("wc", "stream"),
+    "putc_unlocked": _sig("c", "stream"),
+    "putwc_unlocked": _sig("wc", "stream"),
+    "getc": _sig("stream"),
+    "getwc": _sig("stream"),
+    "getc_unlocked": _sig("stream"),
+    "getwc_unlocked": _sig("stream"),
+    "getw": _sig("stream"),
+    "putw": _sig("w", "stream"),
+
+    # standard streams
+    "putchar": _sig("c"),
+    "putwchar": _sig("wc"),
+    "putchar_unlocked": _sig("c"),
+    "putwchar_unlocked": _sig("wc"),
+    "puts": _sig("s:s"),
+    "getchar": _sig(),
+    "getwchar": _sig(),
+    "getchar_unlocked": _sig(),
+    "getwchar_unlocked": _sig(),
+    "gets": _sig("s"),
+    "printf": _sig("format:s"),
+    "wprintf": _sig("format"),
+    "scanf": _sig("format:s"),
+    "wscanf": _sig("format"),
+
+    # memory
+    "mmap": _sig("addr", "length", "prot", "flags", "fd:fd", "offset"),
+    "munmap": _sig("addr", "length"),
+    "msync": _sig("addr", "length", "flags"),
+    "mremap": _sig("old_address", "old_size", "new_size", "flags"),
+    "madvise": _sig("addr", "length", "advice"),
+    "sprintf": _sig("str:s", "format:s"),
+    "snprintf": _sig("str:s", "size", "format:s"),
+    "swprintf": _sig("wcs", "maxlen", "format"),
+    "sscanf": _sig("str:s", "format:s"),
+    "swscanf": _sig("ws", "format"),
+
+    # directories
+    "getcwd": _sig("buf:b", "size"),
+    "chdir": _sig("path:s"),
+    "fchdir": _sig("fd:fd"),
+    "opendir": _sig("name:s", returns=INT),
+    "fdopendir": _sig("fd:fd", returns=INT),
+    "dirfd": _sig("dirp"),
+    "readdir": _sig("dirp"),
+    "readdir_r": _sig("dirp", "entry", "result"),
+    "closedir": _sig("dirp"),
+    "scandir": _sig("dirp:s", "namelist", "filter", "compar"),
+    "rmdir": _sig("pathname:s"),
+    "mkdir": _sig("pathname:s", "mode", paired=True),
+
+    # links
+    "link": _sig("oldpath:s", "newpath:s"),
+    "linkat": _sig("olddirfd:fd", "oldpath:s", "newdirfd:fd", "newpath:s", "flags"),
+    "symlink": _sig("target:s", "linkpath:s"),
+    "readlink": _sig("pathname:s", "buf:b", "bufsiz"),
+    "realpath": _sig("path:s", "resolved_path"),
+
+    # temporary files
+    "tmpfile": _sig(returns=INT),
+    "tmpnam": _sig("s"),
+    "tmpnam_r": _sig("s"),
+    "tempnam": _sig("dir:s", "pfx:s"),
+    "mktemp": _sig("template:s"),
+    "mkstemp": _sig("template:s", returns=FD),
+    "mkdtemp": _sig("template:s"),
+
+    # sockets
+    "socket": _sig("domain", "type", "protocol", returns=FD),
+    "socketpair": _sig("domain", "type", "protocol", "sv"),
+    "shutdown": _sig("sockfd:fd", "how"),
+    "connect": _sig("sockfd:fd", "addr", "addrlen"),
+    "bind": _sig("sockfd:fd", "addr", "addrlen"),
+    "listen": _sig("sockfd:fd", "backlog"),
+    "accept": _sig("sockfd:fd", "addr", "addrlen", returns=FD),
+    "send": _sig("sockfd:fd", "buf:b", "len", "flags"),
+    "recv": _sig("sockfd:fd", "buf:b", "len", "flags"),
+    "sendto": _sig("sockfd:fd", "buf:b", "len", "flags", "dest_addr", "addrlen"),
+    "recvfrom": _sig("sockfd:fd", "buf:b", "len", "flags", "src_addr", "addrlen"),
+    "sendmsg": _sig("sockfd:fd", "msg:b", "flags"),
+    "recvmsg": _sig("sockfd:fd", "msg:b", "flags"),
+    "getsockopt": _sig("sockfd:fd", "level", "optname", "optval:b", "optlen"),
+    "setsockopt": _sig("sockfd:fd", "level", "optname", "optval:b", "optlen"),
+
+    # pipes and fifos
+    "pipe": _sig("pipefd"),
+    "popen": _sig("command:s", "type:s", returns=INT),
+    "pclose": _sig("stream"),
+    "mkfifo": _sig("pathname:s", "mode"),
+    "mkfifoat": _sig("dirfd:fd", "pathname:s", "mode"),
+}
@@ -1,21 +1,132 @@
-from os import system
+import os
+import fnmatch
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import replace
+from typing import Dict, List, Optional
 
 from themis.modules.common.config import Config
+from themis.modules.common.errors import InvalidUseException
+from themis.modules.common.tracefile import remove_trace
 from themis.modules.tracing.frida_trace_wrap import Analyzer
-from themis.modules.tracing.filter import filter_file
+from themis.modules.tracing.filter import filter_file, filter_lines
+from themis.modules.transforming.parser import CallParser
+from themis.modules.transforming.callgraph import CallGraph
+from themis.modules.transforming.diagnostics import Diagnostics
+from themis.modules.transforming.grapher import Grapher
 
 
 def trace(
-    config: Config
+    config: Config,
+    backend: str = "frida",
+    binary: bool = False
 ) -> None:
 
+    if backend != "frida" and config.agent_filters:
+        print(f"agent_filters are evaluated by the agent, the {backend} backend traces all calls")
+
+    if backend == "frida":
+        from themis.modules.tracing.frida_agent_wrap import AgentAnalyzer
+
+        # the agent hands over structured records, no raw trace to filter
+        AgentAnalyzer(
+            config
+        ).extract_libcalls(binary)
+        return
+
+    if backend == "audit":
+        from themis.modules.tracing.audit_wrap import AuditAnalyzer
+
+        # the audit library writes the filtered format itself
+        AuditAnalyzer(
+            config
+        ).extract_libcalls(binary)
+        return
+
+    if config.capture_policies:
+        print("capture policies are not applied by frida-trace, it captures with its own handlers")
+
     Analyzer(
         config
     ).extract_libcalls()
 
     filter_file(
         f"{config.trace_dir}/libcalls_{config.executable}.txt",
-        f"{config.trace_dir}/libcalls_{config.executable}_filtered.txt"
+        f"{config.trace_dir}/libcalls_{config.executable}_filtered.txt",
+        config.trace_compression
     )
 
-    system(f"rm {config.trace_dir}/libcalls_{config.executable}.txt")
\ No newline at end of file
+    remove_trace(f"{config.trace_dir}/libcalls_{config.executable}.txt")
+
+
+
+def stream_trace(
+    config: Config,
+    backend: str = "frida",
+    diagnostics: Optional[Diagnostics] = None
+) -> CallGraph:
+    # trace -> filter -> parse -> graph as one generator chain, nothing is written to trace_dir,
+    # the graph is built while the target runs and is complete when it exits
+
+    if backend == "audit":
+        raise InvalidUseException("the audit backend writes its trace when the target exits, it cannot stream")
+
+    if backend == "frida":
+        from themis.modules.tracing.frida_agent_wrap import AgentAnalyzer
+
+        parser = CallParser(
+            AgentAnalyzer(config).stream_libcalls(),
+            structured=True,
+            diagnostics=diagnostics,
+            max_pending=config.parse_max_pending
+        )
+    else:
+        parser = CallParser(
+            filter_lines(Analyzer(config).stream_libcalls()),
+            diagnostics=diagnostics,
+            max_pending=config.parse_max_pending
+        )
+
+    return Grapher(parser, config.coalesce_calls).into_graph()
+
+
+
+def find_executables(
+    config: Config,
+    patterns: List[str]
+) -> List[str]:
+    # names or globs of executables in bin_dir, a pattern matching none is reported, none matching at all is an error
+
+    names = [entry.name for entry in os.scandir(config.bin_dir) if entry.is_file()]
+    found = set()
+    for pattern in patterns:
+        matched = fnmatch.filter(names, pattern)
+        if not matched:
+            print(f"{pattern} matches no executable in {config.bin_dir}")
+        found.update(matched)
+    if not found:
+        raise InvalidUseException(f"no executable in {config.bin_dir} matches {' '.join(patterns)}")
+    return sorted(found)
+
+
+
+def trace_batch(
+    config: Config,
+    executables: List[str],
+    jobs: int,
+    backend: str = "frida",
+    binary: bool = False
+) -> Dict[str, Optional[Exception]]:
+    # each target is traced with its own copy of the config, so output files are named after it,
+    # the targets mostly wait on the tracer and its subprocesses, threads are enough
+
+    results = dict()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(trace, replace(config, executable=executable), backend, binary): executable
+            for executable in executables
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.exception()
+
+    return results
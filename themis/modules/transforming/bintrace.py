@@ -0,0 +1,359 @@
+"""
+    Compact binary trace format.
+
+    Layout: MAGIC, one version byte, then a sequence of entries, each starting with a tag byte.
+
+    TAG_STRING  varint length, utf-8 bytes
+                defines the next string id (0, 1, 2, ...), function names, argument names
+                and non-numeric values are stored once and referenced by id afterwards
+    TAG_SHAPE   varint function name id, byte callpoint, varint number of arguments, varint name id of each
+                defines the next shape id, calls with the same function, callpoint and argument names
+                share one shape
+    TAG_CALL    varint shape id
+                varint offset (nesting depth)
+                varint call id, only for enter/exit shapes
+                a value for every argument of the shape, one header byte and a little-endian payload,
+                the low nibble of the header is the payload length, VALUE_STRING marks a string id,
+                numbers are the hex values of the text trace
+    TAG_REPEATED_CALL
+                since version 2, varint shape id, varint repeat count, then the rest as in TAG_CALL
+    TAG_TIME    since version 3, varint µs since the start of the trace, the time of the next call entry
+
+    Varints are unsigned LEB128, argument values use the length-prefixed variant, so that
+    each is decoded by a single int.from_bytes call.
+"""
+import mmap
+import re
+import sys
+
+from functools import partial
+from typing import BinaryIO, Dict, Generator, Any, List, Optional, Tuple
+
+from themis.modules.common.errors import InvalidTraceFormatException
+from themis.modules.common.records import CallRecord
+from themis.modules.common.tracefile import open_trace
+from themis.modules.transforming.diagnostics import Diagnostics
+from themis.modules.transforming.parser import record_from_line
+
+MAGIC = b"THMT"
+VERSION = 3  # readers accept all versions up to this one
+HEADER = MAGIC + bytes([VERSION])
+
+TAG_STRING = 0
+TAG_SHAPE = 1
+TAG_CALL = 2
+TAG_REPEATED_CALL = 3
+TAG_TIME = 4
+
+CALLPOINT_NONE = 0
+CALLPOINT_ENTER = 1
+CALLPOINT_EXIT = 2
+CALLPOINTS = {None: CALLPOINT_NONE, "enter": CALLPOINT_ENTER, "exit": CALLPOINT_EXIT}
+CALLPOINT_NAMES = (None, "enter", "exit")
+
+VALUE_STRING = 0x10
+VALUE_LENGTH = 0x0f
+HEX_VALUE = re.compile(r"0x(?:0|[1-9a-f][0-9a-f]*)")  # only values that hex() reproduces exactly
+FLUSH_SIZE = 1 << 16
+HEX_CACHE_SIZE = 1 << 16  # hex strings of values kept by the reader
+
+
+def _write_varint(
+    buffer: bytearray,
+    value: int
+) -> None:
+
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+
+def _read_varint(
+    buffer: memoryview,
+    pos: int
+) -> Tuple[int, int]:
+
+    byte = buffer[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+
+def _write_value(
+    buffer: bytearray,
+    value: int,
+    flags: int
+) -> None:
+
+    payload = value.to_bytes((value.bit_length() + 7) // 8, "little")
+    buffer.append(flags | len(payload))
+    buffer += payload
+
+
+
+
+class BinaryTraceWriter:
+    def __init__(
+        self,
+        file: BinaryIO
+    ) -> None:
+
+        self._file = file
+        self._strings: Dict[str, int] = dict()
+        self._shapes: Dict[Tuple[str, Any, Tuple[str, ...]], int] = dict()
+        self._buffer = bytearray(HEADER)
+
+
+
+    def __enter__(
+        self
+    ) -> 'BinaryTraceWriter':
+
+        return self
+
+
+
+    def __exit__(
+        self,
+        *exc_info
+    ) -> None:
+
+        self.flush()
+
+
+
+    def _string_id(
+        self,
+        value: str
+    ) -> int:
+
+        sid = self._strings.get(value, None)
+        if sid is None:
+            sid = len(self._strings)
+            self._strings[value] = sid
+            data = value.encode("utf-8")
+            self._buffer.append(TAG_STRING)
+            _write_varint(self._buffer, len(data))
+            self._buffer += data
+        return sid
+
+
+
+    def _shape_id(
+        self,
+        record: CallRecord
+    ) -> int:
+
+        key = (record.func, record.callpoint, tuple(record.args.keys()))
+        shid = self._shapes.get(key, None)
+        if shid is None:
+            shid = len(self._shapes)
+            self._shapes[key] = shid
+            names = [self._string_id(name) for name in key[2]]
+            func = self._string_id(record.func)
+            self._buffer.append(TAG_SHAPE)
+            _write_varint(self._buffer, func)
+            self._buffer.append(CALLPOINTS[record.callpoint])
+            _write_varint(self._buffer, len(names))
+            for name in names:
+                _write_varint(self._buffer, name)
+        return shid
+
+
+
+    def write(
+        self,
+        record: CallRecord
+    ) -> None:
+
+        # strings and shapes are defined before the call entry that refers to them
+        shape = self._shape_id(record)
+        values = list()
+        for value in record.args.values():
+            if HEX_VALUE.fullmatch(value) and len(value) <= 2 + 2 * VALUE_LENGTH:
+                values.append((int(value, base=16), 0))
+            else:
+                values.append((self._string_id(value), VALUE_STRING))
+
+        buffer = self._buffer
+        if record.time is not None:
+            buffer.append(TAG_TIME)
+            _write_varint(buffer, round(record.time * 1000))
+        if record.repeat == 1:
+            buffer.append(TAG_CALL)
+            _write_varint(buffer, shape)
+        else:
+            buffer.append(TAG_REPEATED_CALL)
+            _write_varint(buffer, shape)
+            _write_varint(buffer, record.repeat)
+        _write_varint(buffer, record.offset)
+        if record.callpoint is not None:
+            _write_varint(buffer, record.call_id)
+        for value, flags in values:
+            _write_value(buffer, value, flags)
+
+        if len(buffer) >= FLUSH_SIZE:
+            self.flush()
+
+
+
+    def flush(
+        self
+    ) -> None:
+
+        self._file.write(self._buffer)
+        self._buffer.clear()
+
+
+
+
+class BinaryTraceReader:
+    def __init__(
+        self,
+        path: str
+    ) -> None:
+
+        self._file = open(path, "rb")
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._buffer)
+
+        if self._buffer[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise InvalidTraceFormatException(f"{path} is not a binary trace")
+        if self._buffer[len(MAGIC)] > VERSION:
+            self.close()
+            raise InvalidTraceFormatException(f"{path} has unsupported version {self._buffer[len(MAGIC)]}")
+
+
+
+    def __enter__(
+        self
+    ) -> 'BinaryTraceReader':
+
+        return self
+
+
+
+    def __exit__(
+        self,
+        *exc_info
+    ) -> None:
+
+        self.close()
+
+
+
+    def close(
+        self
+    ) -> None:
+
+        self._view.release()
+        self._buffer.close()
+        self._file.close()
+
+
+
+    def records(
+        self
+    ) -> Generator[CallRecord, Any, Any]:
+        # through a view of the mapping, slices of it are not copied, the hex strings of repeating values
+        # are built once, and varints below 0x80, most shape ids and offsets, are read inline
+
+        buffer = self._view
+        end = len(buffer)
+        pos = len(HEADER)
+        strings: List[str] = list()
+        shapes: List[Tuple[str, Any, Tuple[str, ...]]] = list()
+        hexes: Dict[int, str] = dict()
+        from_bytes = int.from_bytes
+        time = None
+
+        while pos < end:
+            tag = buffer[pos]
+            pos += 1
+
+            if tag == TAG_CALL or tag == TAG_REPEATED_CALL:
+                shape = buffer[pos]
+                if shape < 0x80:
+                    pos += 1
+                else:
+                    shape, pos = _read_varint(buffer, pos)
+                repeat = 1
+                if tag == TAG_REPEATED_CALL:
+                    repeat, pos = _read_varint(buffer, pos)
+                func, callpoint, names = shapes[shape]
+                offset = buffer[pos]
+                if offset < 0x80:
+                    pos += 1
+                else:
+                    offset, pos = _read_varint(buffer, pos)
+                call_id = None
+                if callpoint is not None:
+                    call_id, pos = _read_varint(buffer, pos)
+
+                args = dict()
+                for name in names:
+                    header = buffer[pos]
+                    length = header & VALUE_LENGTH
+                    value = buffer[pos + 1] if length == 1 else from_bytes(buffer[pos + 1:pos + 1 + length], "little")
+                    pos += 1 + length
+                    if header & VALUE_STRING:
+                        args[name] = strings[value]
+                        continue
+                    text = hexes.get(value)
+                    if text is None:
+                        if len(hexes) >= HEX_CACHE_SIZE:
+                            hexes.clear()
+                        text = hexes[value] = sys.intern(hex(value))
+                    args[name] = text
+
+                yield CallRecord(offset, func, callpoint, call_id, args, repeat, time)
+                time = None
+
+            elif tag == TAG_TIME:
+                time, pos = _read_varint(buffer, pos)
+                time /= 1000
+
+            elif tag == TAG_STRING:
+                length, pos = _read_varint(buffer, pos)
+                strings.append(sys.intern(str(buffer[pos:pos + length], "utf-8")))
+                pos += length
+
+            elif tag == TAG_SHAPE:
+                func, pos = _read_varint(buffer, pos)
+                callpoint = CALLPOINT_NAMES[buffer[pos]]
+                argc, pos = _read_varint(buffer, pos + 1)
+                names = list()
+                for _ in range(argc):
+                    name, pos = _read_varint(buffer, pos)
+                    names.append(strings[name])
+                shapes.append((strings[func], callpoint, tuple(names)))
+
+            else:
+                raise InvalidTraceFormatException(f"unknown entry tag {tag} at {pos - 1}")
+
+
+
+
+def convert_text_trace(
+    infile: str,
+    outfile: str,
+    diagnostics: Optional[Diagnostics] = None
+) -> None:
+
+    with open_trace(infile) as text, open(outfile, "wb") as binary:
+        with BinaryTraceWriter(binary) as writer:
+            for record in filter(None, map(partial(record_from_line, diagnostics=diagnostics), text)):
+                writer.write(record)
@@ -0,0 +1,225 @@
+import hashlib
+import io
+import json
+import os
+import secrets
+
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from themis.modules.common.tracefile import detect_compression
+from themis.modules.transforming.callgraph import CallGraph
+from themis.modules.transforming.checkpoint import decode_checkpoint, encode_checkpoint
+from themis.modules.transforming.diagnostics import Diagnostics
+from themis.modules.transforming.graphstore import read_graph, write_graph
+from themis.modules.transforming.grapher import Grapher
+
+CACHE_VERSION = 4  # of the parser and the grapher, entries of other versions are parsed again
+BLOCK_SIZE = 1 << 20
+
+
+class CacheEntry(NamedTuple):
+    version: int
+    trace: str  # path of the parsed trace
+    size: int  # bytes parsed
+    digest: str  # sha256 of them
+    settings: List  # of the config the graph depends on
+    graph: str  # name of the stored graph, next to the entry
+    diagnostics: Dict[str, Any]
+    checkpoint: Optional[Dict[str, Any]]  # of the Grapher, for plain text traces, as encode_checkpoint gives it
+    saved: List[str]  # graph files written from this graph
+
+
+
+
+def _hash_trace(
+    path: str,
+    prefix: int
+) -> Tuple[Optional[str], str]:
+    # the digests of the first prefix bytes and of the whole file, in one read
+
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        remaining = prefix
+        while remaining > 0:
+            block = file.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+        prefix_digest = hasher.hexdigest() if remaining == 0 else None
+        for block in iter(lambda: file.read(BLOCK_SIZE), b""):
+            hasher.update(block)
+    return prefix_digest, hasher.hexdigest()
+
+
+
+def _resumable(
+    path: str
+) -> bool:
+    # a plain text trace ending with a complete line, the lines appended later can be parsed on their own
+
+    if path.endswith(".bin") or detect_compression(path) is not None:
+        return False
+    with open(path, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        if file.tell() == 0:
+            return True
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) == b"\n"
+
+
+
+
+class TransformCache:
+    def __init__(
+        self,
+        path: str,
+        trace: str,
+        settings: Tuple = ()
+    ) -> None:
+        # path holds the entry of one executable as json, for the trace it was parsed from with the given settings,
+        # its graph is stored next to it
+
+        self._path = path
+        self._trace = trace
+        self._settings = list(settings)
+        self._entry = self._load()
+        self._size = os.path.getsize(trace)
+        prefix = self._entry.size if self._entry is not None else 0
+        self._prefix_digest, self._digest = _hash_trace(trace, prefix)
+
+
+
+    def _load(
+        self
+    ) -> Optional[CacheEntry]:
+
+        try:
+            with open(self._path, "r") as file:
+                entry = CacheEntry(**json.load(file))
+        except (OSError, ValueError, TypeError):
+            return None  # missing, or written by a version that is gone
+        if entry.version != CACHE_VERSION or entry.trace != self._trace or entry.settings != self._settings \
+                or not os.path.exists(self._graph_path(entry)):
+            return None
+        return entry
+
+
+
+    def _graph_path(
+        self,
+        entry: CacheEntry
+    ) -> str:
+
+        return os.path.join(os.path.dirname(self._path), entry.graph)
+
+
+
+    def unchanged(
+        self
+    ) -> bool:
+
+        return self._entry is not None and self._entry.size == self._size and self._entry.digest == self._digest
+
+
+
+    def appended(
+        self
+    ) -> bool:
+        # only lines were added to the trace since it was parsed
+
+        return self._entry is not None and self._entry.checkpoint is not None and self._size > self._entry.size \
+            and self._entry.digest == self._prefix_digest
+
+
+
+    def graph(
+        self,
+        diagnostics: Optional[Diagnostics] = None
+    ) -> CallGraph:
+
+        if diagnostics is not None:
+            diagnostics.merge(Diagnostics.from_dict(self._entry.diagnostics))
+        return read_graph(self._graph_path(self._entry))
+
+
+
+    def resume(
+        self,
+        diagnostics: Optional[Diagnostics] = None
+    ) -> Grapher:
+        # a grapher for the lines after the ones parsed, into_graph gives the graph of the whole trace
+
+        with open(self._trace, "rb") as file:
+            file.seek(self._entry.size)
+            appended = file.read()
+        return Grapher.resume(decode_checkpoint(self._entry.checkpoint), io.StringIO(appended.decode()), diagnostics)
+
+
+
+    def saved(
+        self,
+        paths: List[str]
+    ) -> bool:
+        # the graph files are still the ones written from the cached graph
+
+        return self._entry is not None and all(
+            path in self._entry.saved and os.path.exists(path) and os.path.getmtime(path) <= os.path.getmtime(self._path)
+            for path in paths
+        )
+
+
+
+    def store(
+        self,
+        grapher: Grapher,
+        graph: CallGraph,
+        diagnostics: Diagnostics,
+        saved: List[str]
+    ) -> None:
+        # the graph under a new name, the former one is only removed once the entry no longer refers to it
+
+        former = self._entry
+        name = f"{os.path.splitext(os.path.basename(self._path))[0]}.{secrets.token_hex(8)}.thmg"
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        self._entry = CacheEntry(
+            version=CACHE_VERSION,
+            trace=self._trace,
+            size=self._size,
+            digest=self._digest,
+            settings=self._settings,
+            graph=name,
+            diagnostics=diagnostics.to_dict(),
+            checkpoint=encode_checkpoint(grapher.checkpoint()) if _resumable(self._trace) else None,
+            saved=saved
+        )
+        write_graph(graph, self._graph_path(self._entry))
+        self._write()
+        if former is not None and former.graph != name:
+            try:
+                os.remove(self._graph_path(former))
+            except OSError:
+                pass
+
+
+
+    def mark_saved(
+        self,
+        paths: List[str]
+    ) -> None:
+
+        self._entry = self._entry._replace(saved=sorted(set(self._entry.saved).union(paths)))
+        self._write()
+
+
+
+    def _write(
+        self
+    ) -> None:
+        # replaced at once, an interrupted write leaves the former entry
+
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        temporary = f"{self._path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(self._entry._asdict(), file)
+        os.replace(temporary, self._path)
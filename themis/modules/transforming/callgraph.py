@@ -0,0 +1,259 @@
+import networkx as nx
+import numpy as np
+
+from enum import Enum, auto
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from themis.modules.common.calls import CallsNode, IOConstructType
+
+ENTRY = 0  # node of the entry, the calls follow in the order the parser yielded them
+COLUMNS = ("func", "index", "repeat", "time", "duration", "io_type")  # a value per node, filled from the calls
+
+
+class EdgeType(Enum):
+    FOLLOW = auto()
+    NEST = auto()
+    TIME = auto()
+
+
+
+
+EDGE_TYPES = dict((typ.value, typ) for typ in EdgeType)
+
+
+
+
+def guess_node_io_type(
+    call: CallsNode
+) -> IOConstructType:
+    # the most specific type of the fds of a call
+
+    type_hints = list()
+    if call.input_fd is not None:
+        type_hints.append(call.input_fd.typ)
+    if call.output_fd is not None:
+        for fd in call.output_fd:
+            type_hints.append(fd.typ)
+
+    return max(type_hints) if type_hints else IOConstructType.UNKNOWN
+
+
+
+
+class CallGraph:
+    def __init__(
+        self,
+        calls: Sequence[Optional[CallsNode]],
+        ids: Sequence[int],
+        sources: np.ndarray,
+        targets: np.ndarray,
+        types: np.ndarray
+    ) -> None:
+        # nodes are positions in calls, a call is None for a node only known from a nesting edge,
+        # an edge is listed once with the type it was added with last, as in the networkx graph
+
+        self.calls = calls
+        self.ids = np.asarray(ids, dtype=np.int64)
+
+        order = np.argsort(sources, kind="stable")
+        self.indptr = np.zeros(len(calls) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(calls)), out=self.indptr[1:])
+        self.indices = np.asarray(targets, dtype=np.int64)[order]
+        self.edge_types = np.asarray(types, dtype=np.int8)[order]
+
+        self._nodes: Optional[Dict[str, int]] = None
+        self._fill_columns()
+
+
+
+    def _fill_columns(
+        self
+    ) -> None:
+
+        count = len(self.calls)
+        self.functions: List[str] = list()  # names of the codes in func
+        self.func = np.full(count, -1, dtype=np.int32)
+        self.index = np.full(count, -1, dtype=np.int64)
+        self.repeat = np.ones(count, dtype=np.int32)
+        self.time = np.full(count, np.nan)  # ms, NaN without a timestamp
+        self.duration = np.full(count, np.nan)  # ms, NaN for unpaired calls
+        self.io_type = np.zeros(count, dtype=np.int8)
+
+        codes: Dict[str, int] = dict()
+        for node, call in enumerate(self.calls):
+            if call is None:
+                continue
+            funcname = call.func.funcname
+            code = codes.get(funcname)
+            if code is None:
+                code = codes[funcname] = len(self.functions)
+                self.functions.append(funcname)
+            self.func[node] = code
+            self.index[node] = call.index
+            self.repeat[node] = call.repeat
+            if call.time is not None:
+                self.time[node] = call.time
+            if call.duration is not None:
+                self.duration[node] = call.duration
+            self.io_type[node] = guess_node_io_type(call)
+
+
+
+    def __len__(
+        self
+    ) -> int:
+
+        return len(self.calls)
+
+
+
+    def key(
+        self,
+        node: int
+    ) -> str:
+        # the node in the networkx graph
+
+        return "entry" if node == ENTRY else str(self.ids[node])
+
+
+
+    def node(
+        self,
+        key: str
+    ) -> int:
+
+        if self._nodes is None:
+            self._nodes = dict((self.key(node), node) for node in range(len(self.calls)))
+        return self._nodes[key]
+
+
+
+    def successors(
+        self,
+        node: int,
+        typ: Optional[EdgeType] = None
+    ) -> np.ndarray:
+
+        start, end = self.indptr[node], self.indptr[node + 1]
+        if typ is None:
+            return self.indices[start:end]
+        return self.indices[start:end][self.edge_types[start:end] == typ.value]
+
+
+
+    def _expand(
+        self,
+        frontier: np.ndarray,
+        typ: Optional[EdgeType]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # the edges leaving all nodes of the frontier at once, as sources and targets
+
+        starts = self.indptr[frontier]
+        counts = self.indptr[frontier + 1] - starts
+        slots = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        sources = np.repeat(frontier, counts)
+        if typ is not None:
+            matching = self.edge_types[slots] == typ.value
+            slots, sources = slots[matching], sources[matching]
+        return sources, self.indices[slots]
+
+
+
+    def reachable(
+        self,
+        root: int,
+        typ: Optional[EdgeType] = None
+    ) -> np.ndarray:
+        # root and the nodes below it, level by level
+
+        visited = np.zeros(len(self.calls), dtype=bool)
+        visited[root] = True
+        levels = [np.array([root], dtype=np.int64)]
+        while len(levels[-1]):
+            _, successors = self._expand(levels[-1], typ)
+            successors = np.unique(successors[~visited[successors]])
+            visited[successors] = True
+            levels.append(successors)
+        return np.concatenate(levels)
+
+
+
+    def branches(
+        self
+    ) -> np.ndarray:
+        # for every node the child of the entry it follows on, -1 for the entry and the nodes only nested,
+        # a call has one FOLLOW edge leading to it at most
+
+        roots = np.full(len(self.calls), -1, dtype=np.int64)
+        frontier = self.successors(ENTRY, EdgeType.FOLLOW)
+        roots[frontier] = frontier
+        while len(frontier):
+            sources, targets = self._expand(frontier, EdgeType.FOLLOW)
+            unseen = roots[targets] < 0
+            frontier = targets[unseen]
+            roots[frontier] = roots[sources[unseen]]
+        return roots
+
+
+
+    def to_networkx(
+        self
+    ) -> nx.DiGraph:
+        # the graph the former Grapher built, for the code working on networkx
+
+        graph = nx.DiGraph()
+        keys = [self.key(node) for node in range(len(self.calls))]
+        graph.add_nodes_from(
+            (key, {"call": call}) if call is not None else (key, {}) for key, call in zip(keys, self.calls)
+        )
+        graph.add_edges_from(
+            (keys[source], keys[target], {"type": EDGE_TYPES[typ]})
+            for source, target, typ in zip(
+                np.repeat(np.arange(len(self.calls)), np.diff(self.indptr)).tolist(),
+                self.indices.tolist(),
+                self.edge_types.tolist()
+            )
+        )
+        return graph
+
+
+
+    @staticmethod
+    def from_networkx(
+        graph: nx.DiGraph
+    ) -> 'CallGraph':
+        # e.g. for the pickles of former versions
+
+        nodes = dict((key, node) for node, key in enumerate(graph.nodes))
+        calls = [call for _, call in graph.nodes(data="call")]
+        ids = [0 if key == "entry" else int(key) for key in nodes]
+        edges = [(nodes[source], nodes[target], typ.value) for source, target, typ in graph.edges(data="type")]
+        sources, targets, types = (np.array(column, dtype=np.int64) for column in zip(*edges)) if edges else \
+            (np.zeros(0, dtype=np.int64) for _ in range(3))
+        return CallGraph(calls, ids, sources, targets, types)
+
+
+
+    @staticmethod
+    def from_arrays(
+        calls: Sequence[Optional[CallsNode]],
+        ids: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        edge_types: np.ndarray,
+        functions: List[str],
+        columns: Dict[str, np.ndarray]
+    ) -> 'CallGraph':
+        # e.g. of a stored graph, the arrays are taken as they are, without going through the calls
+
+        graph = CallGraph.__new__(CallGraph)
+        graph.calls = calls
+        graph.ids = ids
+        graph.indptr = indptr
+        graph.indices = indices
+        graph.edge_types = edge_types
+        graph.functions = functions
+        for name in COLUMNS:
+            setattr(graph, name, columns[name])
+        graph._nodes = None
+        return graph
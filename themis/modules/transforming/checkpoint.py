@@ -0,0 +1,195 @@
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from themis.modules.common.calls import CallsNode, Function, IOCall, IOConstructType, IODesc, IODescAndState,\
+     IODescFunc, IODescState
+from themis.modules.transforming.diagnostics import Diagnostics
+
+Checkpoint = Tuple[Dict[str, Any], Dict[str, Any], int]  # of Grapher.checkpoint
+
+
+class _Encoder:
+    def __init__(
+        self
+    ) -> None:
+        # the calls and descriptors are stored once in tables, referred to by row, so they are shared again when decoded
+
+        self.descs: Dict[int, int] = dict()  # id of the IODesc : row
+        self.desc_rows: List[List] = list()
+        self.calls: Dict[int, int] = dict()  # id of the CallsNode : row
+        self.call_rows: List[List] = list()
+
+
+
+    def desc(
+        self,
+        iodesc: Optional[IODesc]
+    ) -> Optional[int]:
+
+        if iodesc is None:
+            return None
+        row = self.descs.get(id(iodesc))
+        if row is None:
+            row = self.descs[id(iodesc)] = len(self.desc_rows)
+            self.desc_rows.append(None)
+            self.desc_rows[row] = [int(iodesc.typ), iodesc.fd, iodesc.desc, self.desc(iodesc.internal)]
+        return row
+
+
+
+    def call(
+        self,
+        node: CallsNode
+    ) -> int:
+
+        row = self.calls.get(id(node))
+        if row is None:
+            call = node.call
+            row = self.calls[id(node)] = len(self.call_rows)
+            self.call_rows.append([
+                node.id,
+                call.index,
+                call.func.funcname,
+                call.func.effect.value,
+                self.desc(call.in_fd),
+                None if call.out_fd is None else [self.desc(iodesc) for iodesc in call.out_fd],
+                call.args,
+                call.repeat,
+                call.time,
+                call.duration,
+                call.unfinished,
+                call.bytes_total
+            ])
+        return row
+
+
+
+
+class _Decoder:
+    def __init__(
+        self,
+        data: Dict[str, Any]
+    ) -> None:
+
+        self.descs: List[Optional[IODesc]] = [None] * len(data["descs"])
+        for row, (typ, fd, desc, _) in enumerate(data["descs"]):
+            self.descs[row] = IODesc(typ=IOConstructType(typ), fd=fd, desc=desc)
+        for iodesc, (_, _, _, internal) in zip(self.descs, data["descs"]):
+            iodesc.internal = self.desc(internal)
+        self.calls = [self._call(row) for row in data["calls"]]
+
+
+
+    def desc(
+        self,
+        row: Optional[int]
+    ) -> Optional[IODesc]:
+
+        return None if row is None else self.descs[row]
+
+
+
+    def _call(
+        self,
+        row: List
+    ) -> CallsNode:
+
+        c_id, index, funcname, effect, in_row, out_rows, args, repeat, time, duration, unfinished, bytes_total = row
+        call = IOCall(
+            index=index,
+            func=Function.named(funcname, IODescFunc(effect)),
+            in_fd=self.desc(in_row),
+            out_fd=None if out_rows is None else [self.desc(out_row) for out_row in out_rows],
+            args=args,
+            repeat=repeat,
+            time=time,
+            duration=duration,
+            unfinished=unfinished,
+            bytes_total=bytes_total
+        )
+        # the stored id, not one of the NodeCounter
+        node = CallsNode.__new__(CallsNode)
+        object.__setattr__(node, "id", c_id)
+        object.__setattr__(node, "call", call)
+        return node
+
+
+
+
+def encode_checkpoint(
+    checkpoint: Checkpoint
+) -> Dict[str, Any]:
+    # into plain json data, dict keys become pairs as json keys are strings
+
+    state, parser_state, oid = checkpoint
+    encoder = _Encoder()
+    grapher = {
+        "coalesce": state["_coalesce"],
+        "calls": [encoder.call(node) for node in state["_calls"]],
+        "ids": state["_ids"],
+        "nodes": list(state["_nodes"].items()),
+        "runs": sorted(state["_runs"]),
+        "sources": state["_sources"].tolist(),
+        "targets": state["_targets"].tolist(),
+        "i_o_descriptors": list(state["_i_o_descriptors"].items())
+    }
+    parser = {
+        "diagnostics": parser_state["diagnostics"].to_dict(),
+        "call_index": parser_state["call_index"],
+        "edges": parser_state["_edges"],
+        "last_of_level": list(parser_state["_last_of_level"].items()),
+        "previous_offset": parser_state["_previous_offset"],
+        "open_iocall": [(c_id, encoder.call(node)) for c_id, node in parser_state["_open_iocall"].items()],
+        "max_pending": parser_state["_max_pending"],
+        "unfinished": [encoder.call(node) for node in parser_state["_unfinished"]],
+        "available_internal_fds": [
+            (c_id, encoder.desc(iodesc)) for c_id, iodesc in parser_state["_available_internal_fds"].items()
+        ],
+        "iodesc": [(fd, encoder.desc(entry.iodesc), entry.state.name) for fd, entry in parser_state["_iodesc"].items()]
+    }
+    return {
+        "descs": encoder.desc_rows,
+        "calls": encoder.call_rows,
+        "grapher": grapher,
+        "parser": parser,
+        "oid": oid
+    }
+
+
+
+def decode_checkpoint(
+    data: Dict[str, Any]
+) -> Checkpoint:
+
+    decoder = _Decoder(data)
+    grapher = data["grapher"]
+    state = {
+        "_coalesce": grapher["coalesce"],
+        "_calls": [decoder.calls[row] for row in grapher["calls"]],
+        "_ids": grapher["ids"],
+        "_nodes": dict(grapher["nodes"]),
+        "_runs": set(grapher["runs"]),
+        "_sources": array("q", grapher["sources"]),
+        "_targets": array("q", grapher["targets"]),
+        "_i_o_descriptors": dict(grapher["i_o_descriptors"])
+    }
+    parser = data["parser"]
+    parser_state = {
+        "diagnostics": Diagnostics.from_dict(parser["diagnostics"]),
+        "call_index": parser["call_index"],
+        "_edges": [tuple(edge) for edge in parser["edges"]],
+        "_last_of_level": dict(parser["last_of_level"]),
+        "_previous_offset": parser["previous_offset"],
+        "_record": None,  # set again for each record parsed
+        "_open_iocall": dict((c_id, decoder.calls[row]) for c_id, row in parser["open_iocall"]),
+        "_max_pending": parser["max_pending"],
+        "_unfinished": [decoder.calls[row] for row in parser["unfinished"]],
+        "_available_internal_fds": dict(
+            (c_id, decoder.desc(row)) for c_id, row in parser["available_internal_fds"]
+        ),
+        "_iodesc": dict(
+            (fd, IODescAndState(iodesc=decoder.desc(row), state=IODescState[state]))
+            for fd, row, state in parser["iodesc"]
+        )
+    }
+    return state, parser_state, data["oid"]
@@ -0,0 +1,126 @@
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
+
+SAMPLES = 10  # messages kept per anomaly, the others are only counted
+
+
+class Anomaly(Enum):
+    # the message of each, printed as found in verbose mode
+    UNMATCHED_LINE = "could not match line {detail}"
+    NO_INPUT_FD = "Function {func} takes no file descriptor"
+    NO_OUTPUT_FD = "Function {func} gives no file descriptor"
+    UNKNOWN_FD = "input fd {detail} was never created"
+    CLOSED_FD = "{func} using closed fd {detail}"
+    FORGOTTEN_FD = "{func} using forgotten fd {detail}"
+    NULL_STREAM = "{func} returned null"
+    REOPENED_FD = "function {func} returned already open fd {detail}"
+    RETURNED_FORGOTTEN_FD = "function {func} returned forgotten fd {detail}"
+    UNFINISHED_CALL = "{func} was entered but never exited"
+    UNMATCHED_EXIT = "exit of {func} without an enter, call id {detail}"
+
+
+
+
+class Diagnostics:
+    def __init__(
+        self,
+        verbose: bool = False,
+        samples: int = SAMPLES
+    ) -> None:
+        # the anomalies of a trace, counted per function instead of printed one by one
+
+        self.verbose = verbose
+        self._samples = samples
+        self.counts: Dict[Tuple[Anomaly, str], int] = dict()
+        self.samples: Dict[Anomaly, List[str]] = dict()
+
+
+
+    def report(
+        self,
+        anomaly: Anomaly,
+        func: str = "",
+        detail: str = ""
+    ) -> None:
+
+        key = (anomaly, func)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if not self.verbose and len(self.samples.get(anomaly, ())) >= self._samples:
+            return
+
+        message = anomaly.value.format(func=func, detail=detail.rstrip("\n"))
+        samples = self.samples.setdefault(anomaly, list())
+        if len(samples) < self._samples:
+            samples.append(message)
+        if self.verbose:
+            print(message)
+
+
+
+    def merge(
+        self,
+        other: 'Diagnostics'
+    ) -> None:
+        # other comes after self, e.g. the next chunk of a trace
+
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        for anomaly, messages in other.samples.items():
+            samples = self.samples.setdefault(anomaly, list())
+            samples.extend(messages[:max(0, self._samples - len(samples))])
+
+
+
+    @property
+    def total(
+        self
+    ) -> int:
+
+        return sum(self.counts.values())
+
+
+
+    def summary(
+        self,
+        title: Optional[str] = None
+    ) -> str:
+
+        lines = [f"{self.total} anomalies{'' if title is None else ' ' + title}"]
+        # ties by name, for the same summary from a cached to_dict
+        for (anomaly, func), count in sorted(self.counts.items(), key=lambda item: (-item[1], item[0][0].name, item[0][1])):
+            lines.append(f"{count:>8}  {anomaly.name.lower():<24} {func}")
+        for anomaly, messages in self.samples.items():
+            lines.append(f"e.g. {messages[0]}")
+        return "\n".join(lines)
+
+
+
+    def to_dict(
+        self
+    ) -> Dict[str, Any]:
+
+        counts: Dict[str, Dict[str, int]] = dict()
+        for (anomaly, func), count in self.counts.items():
+            counts.setdefault(anomaly.name.lower(), dict())[func] = count
+        return {
+            "total": self.total,
+            "counts": counts,
+            "samples": dict((anomaly.name.lower(), messages) for anomaly, messages in self.samples.items())
+        }
+
+
+
+    @staticmethod
+    def from_dict(
+        data: Dict[str, Any],
+        verbose: bool = False
+    ) -> 'Diagnostics':
+        # the inverse of to_dict
+
+        diagnostics = Diagnostics(verbose)
+        for name, functions in data["counts"].items():
+            for func, count in functions.items():
+                diagnostics.counts[(Anomaly[name.upper()], func)] = count
+        for name, messages in data["samples"].items():
+            diagnostics.samples[Anomaly[name.upper()]] = list(messages)
+        return diagnostics
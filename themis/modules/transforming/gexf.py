@@ -24,8 +24,10 @@ GEXF is an XML format.  See https://gephi.org/gexf/format/schema.html for the
 specification and https://gephi.org/gexf/format/basic.html for examples.
 """
 import itertools
+import re
 import time
 from typing import Dict
+from xml.sax.saxutils import escape
 
 import networkx as nx
 
@@ -37,10 +39,10 @@ from xml.etree.ElementTree import (
     register_namespace,
 )
 
-from themis.modules.common.calls import CallsNode, IOConstructType
+from themis.modules.common.calls import CATALOG, CallsNode, FunctionComparator, IOConstructType
 
 
-def write_gexf(G, path, encoding="utf-8", prettyprint=True, version="1.2draft"):
+def write_gexf(G, path, encoding="utf-8", prettyprint=False, version="1.2draft"):
     """Write G in GEXF format to path.
 
     "GEXF (Graph Exchange XML Format) is a language for describing
@@ -59,7 +61,7 @@ def write_gexf(G, path, encoding="utf-8", prettyprint=True, version="1.2draft"):
        File names ending in .gz or .bz2 will be compressed.
     encoding : string (optional, default: 'utf-8')
        Encoding for text data.
-    prettyprint : bool (optional, default: True)
+    prettyprint : bool (optional, default: False)
        If True use line breaks and indenting in output XML.
     version: string (optional, default: '1.2draft')
        The version of GEXF to be used for nodes attributes checking
@@ -84,14 +86,25 @@ def write_gexf(G, path, encoding="utf-8", prettyprint=True, version="1.2draft"):
     If you want to specify an id use set it as node data, e.g.
     node['a']['id']=1 to set the id of node 'a' to 1.
 
+    Graphs with only static attributes are written node by node by
+    GEXFStreamWriter, the others are built as a whole by GEXFWriter.
+
     References
     ----------
     .. [1] GEXF File Format, https://gephi.org/gexf/format/
     .. [2] GEXF schema, https://gephi.org/gexf/format/schema.html
     """
-    writer = GEXFWriter(encoding=encoding, prettyprint=prettyprint, version=version)
-    writer.add_graph(G)
-    writer.write(path)
+    if not GEXFStreamWriter.supports(G):
+        writer = GEXFWriter(encoding=encoding, prettyprint=prettyprint, version=version)
+        writer.add_graph(G)
+        writer.write(path)
+        return
+    writer = GEXFStreamWriter(encoding=encoding, prettyprint=prettyprint, version=version)
+    if isinstance(path, str):
+        with open(path, "wb") as fh:
+            writer.write(G, fh)
+    else:
+        writer.write(G, path)
 
 
 def generate_gexf(G, encoding="utf-8", prettyprint=True, version="1.2draft"):
@@ -139,6 +152,64 @@ def generate_gexf(G, encoding="utf-8", prettyprint=True, version="1.2draft"):
     yield from str(writer).splitlines()
 
 
+def extract_node_data(data: Dict):
+    call: CallsNode = data.pop("call", None)
+    if call is None:
+        return data
+    retval = data
+
+    func = call.func.funcname
+    in_fd_present = call.input_fd is not None
+    out_fds_len = 0 if call.output_fd is None else len(call.output_fd)
+
+    type_hints = []
+    if call.input_fd is not None:
+        type_hints.append(call.input_fd.typ)
+    if call.output_fd is not None:
+        for fd in call.output_fd:
+            type_hints.append(fd.typ)
+
+    io_type = sorted(type_hints, reverse=True)[0] if len(type_hints) > 0 else IOConstructType.UNKNOWN
+
+    retval["func"] = func
+    retval["in_fd_present"] = in_fd_present
+    retval["out_fds_num"] = out_fds_len
+    retval["io_type"] = str(io_type)
+    if call.repeat > 1:
+        retval["repeat"] = call.repeat
+    if call.time is not None:
+        retval["time"] = call.time
+    if call.duration is not None:
+        retval["duration"] = call.duration
+    if call.unfinished:
+        retval["unfinished"] = True
+    if call.bytes_total is not None:
+        retval["bytes_total"] = call.bytes_total
+    libcall = CATALOG.get(func)
+    if libcall is not None and libcall.equivalence >= 0:
+        # named by the first function of its class, e.g. read for readv
+        retval["func_class"] = FunctionComparator.equivalence_classes[libcall.equivalence][0]
+
+    return retval
+
+
+# attributes of the calls, with their GEXF types, declared with these ids up front
+CALL_ATTRIBUTES = {
+    "func": "string",
+    "in_fd_present": "boolean",
+    "out_fds_num": "long",
+    "io_type": "string",
+    "repeat": "long",
+    "time": "double",
+    "duration": "double",
+    "unfinished": "boolean",
+    "bytes_total": "long",
+    "func_class": "string",
+}
+# node and edge data the stream writer does not handle
+DYNAMIC_KEYS = ("start", "end", "spells", "slices", "viz", "parents")
+
+
 class GEXF:
     versions = {}
     d = {
@@ -306,30 +377,7 @@ class GEXFWriter(GEXF):
 
 
     def extract_node_data(self, data: Dict):
-        call: CallsNode = data.pop("call", None)
-        if call is None:
-            return data
-        retval = data
-
-        func = call.func.funcname
-        in_fd_present = call.input_fd is not None
-        out_fds_len = 0 if call.output_fd is None else len(call.output_fd)
-
-        type_hints = []
-        if call.input_fd is not None:
-            type_hints.append(call.input_fd.typ)
-        if call.output_fd is not None:
-            for fd in call.output_fd:
-                type_hints.append(fd.typ)
-
-        io_type = sorted(type_hints, reverse=True)[0] if len(type_hints) > 0 else IOConstructType.UNKNOWN
-
-        retval["func"] = func
-        retval["in_fd_present"] = in_fd_present
-        retval["out_fds_num"] = out_fds_len
-        retval["io_type"] = str(io_type)
-
-        return retval
+        return extract_node_data(data)
 
 
     def add_nodes(self, G, graph_element):
@@ -666,4 +714,161 @@ class GEXFWriter(GEXF):
                 elem.tail = i
         else:
             if level and (not elem.tail or not elem.tail.strip()):
-                elem.tail = i
\ No newline at end of file
+                elem.tail = i
+
+class GEXFStreamWriter(GEXF):
+    # writes the document while going through the graph, without an ElementTree,
+    # for graphs with static attributes only, see supports()
+    FLUSH_SIZE = 1 << 16  # characters of the elements kept before they are encoded and written
+
+    def __init__(self, encoding="utf-8", prettyprint=False, version="1.2draft"):
+        self.construct_types()
+        self.prettyprint = prettyprint
+        self.encoding = encoding
+        self.set_version(version)
+        self.attr = {"node": {}, "edge": {}}  # title : (id, type), known before the first node is written
+        self.attr_id = itertools.count()
+
+    @staticmethod
+    def supports(G):
+        if G.is_multigraph() or G.graph.get("mode") == "dynamic":
+            return False
+        for _, data in itertools.chain(G.nodes(data=True), ((None, data) for _, _, data in G.edges(data=True))):
+            for k, v in data.items():
+                if k in DYNAMIC_KEYS or isinstance(v, list):
+                    return False
+        return True
+
+    def _declare(self, node_or_edge, title, value):
+        if title not in self.attr[node_or_edge]:
+            val_type = type(value)
+            if val_type not in self.xml_type:
+                raise TypeError(f"attribute value type is not allowed: {val_type}")
+            self.attr[node_or_edge][title] = (str(next(self.attr_id)), self.xml_type[val_type])
+
+    def _collect_attributes(self, G):
+        # the calls have the attributes of CALL_ATTRIBUTES, any other data is declared with the type of its first value
+        for title, attr_type in CALL_ATTRIBUTES.items():
+            self.attr["node"][title] = (str(next(self.attr_id)), attr_type)
+        for _, data in G.nodes(data=True):
+            for k, v in data.items():
+                if k not in ("call", "id", "label"):
+                    self._declare("node", "networkx_key" if k == "key" else str(k), v)
+        for _, _, data in G.edges(data=True):
+            for k, v in data.items():
+                if k not in ("id", "label", "weight", "type"):
+                    self._declare("edge", "networkx_key" if k == "key" else str(k), v)
+
+    def _format(self, value):
+        if isinstance(value, bool):
+            return str(value).lower()
+        text = str(value)
+        if type(value) == float:
+            text = {"inf": "INF", "nan": "NaN", "-inf": "-INF"}.get(text, text)
+        return text
+
+    def _line(self, level, text):
+        # an element or tag, on its own line when pretty printing
+        self._write(f"{'  ' * level}{text}\n" if self.prettyprint else text)
+
+    def _write(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.FLUSH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self._fh.write("".join(self._parts).encode(self.encoding))
+        self._parts.clear()
+        self._size = 0
+
+    def _element(self, level, node_or_edge, head, data):
+        # a node or an edge with its attvalues, written in one piece
+        if not data:
+            self._line(level, f"{head} />")
+            return
+        attributes = self.attr[node_or_edge]
+        lines = [(level, f"{head}>"), (level + 1, "<attvalues>")]
+        for k, v in data.items():
+            attr_id, _ = attributes["networkx_key" if k == "key" else str(k)]
+            value = v if type(v) == str else self._format(v)
+            lines.append((level + 2, f'<attvalue for="{attr_id}" value={_quote(value)} />'))
+        lines.append((level + 1, "</attvalues>"))
+        lines.append((level, f"</{node_or_edge}>"))
+        if self.prettyprint:
+            self._write("".join(f"{'  ' * depth}{line}\n" for depth, line in lines))
+        else:
+            self._write("".join(line for _, line in lines))
+
+    def write(self, G, fh):
+        self._fh = fh
+        self._parts = []
+        self._size = 0
+        self._collect_attributes(G)
+        default = "directed" if G.is_directed() else "undirected"
+        name = G.graph.get("name", "")
+
+        self._parts.append(f"<?xml version='1.0' encoding='{self.encoding}'?>\n")
+        self._line(
+            0,
+            f'<gexf xmlns={_quote(self.NS_GEXF)} xmlns:xsi={_quote(self.NS_XSI)} '
+            f'xsi:schemaLocation={_quote(self.SCHEMALOCATION)} version={_quote(self.VERSION)}>'
+        )
+        self._line(1, f'<meta lastmodifieddate="{time.strftime("%Y-%m-%d")}">')
+        self._line(2, f"<creator>{escape(f'NetworkX {nx.__version__}')}</creator>")
+        self._line(1, "</meta>")
+        self._line(1, f'<graph defaultedgetype="{default}" mode="static" name={_quote(name)}>')
+        for node_or_edge in ("node", "edge"):
+            if not self.attr[node_or_edge]:
+                continue
+            self._line(2, f'<attributes mode="static" class="{node_or_edge}">')
+            for title, (attr_id, attr_type) in self.attr[node_or_edge].items():
+                self._line(3, f'<attribute id="{attr_id}" title={_quote(title)} type="{attr_type}" />')
+            self._line(2, "</attributes>")
+
+        self._line(2, "<nodes>")
+        for node, data in G.nodes(data=True):
+            node_data = extract_node_data(data.copy())
+            node_id = str(node_data.pop("id", node))
+            label = str(node_data.pop("label", node))
+            self._element(3, "node", f"<node id={_quote(node_id)} label={_quote(label)}", node_data)
+        self._line(2, "</nodes>")
+
+        # edge ids given as data are kept, the others are numbered around them
+        edge_ids = set(str(data["id"]) for _, _, data in G.edges(data=True) if data.get("id") is not None)
+        counter = itertools.count()
+        self._line(2, "<edges>")
+        for u, v, data in G.edges(data=True):
+            edge_data = data.copy()
+            edge_id = edge_data.pop("id", None)
+            if edge_id is None:
+                edge_id = next(counter)
+                while str(edge_id) in edge_ids:
+                    edge_id = next(counter)
+                edge_ids.add(str(edge_id))
+            source_id = str(G.nodes[u].get("id", u))
+            target_id = str(G.nodes[v].get("id", v))
+            element = f"<edge source={_quote(source_id)} target={_quote(target_id)} id={_quote(str(edge_id))}"
+            for key in ("label", "weight", "type"):
+                if key in edge_data:
+                    element += f" {key}={_quote(str(edge_data.pop(key)))}"
+            self._element(3, "edge", element, edge_data)
+        self._line(2, "</edges>")
+        self._line(1, "</graph>")
+        self._line(0, "</gexf>")
+        self._flush()
+
+
+# as ElementTree escapes attribute values
+ATTRIBUTE_ESCAPES = str.maketrans({
+    "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#09;"
+})
+
+
+ATTRIBUTE_SPECIAL = re.compile('[&<>"\n\r\t]')
+
+
+def _quote(value):
+    if ATTRIBUTE_SPECIAL.search(value) is None:
+        return f'"{value}"'
+    return '"' + value.translate(ATTRIBUTE_ESCAPES) + '"'
@@ -1,29 +1,32 @@
-import networkx as nx
+import numpy as np
 
-from enum import Enum, auto
-from typing import Tuple, List
+from array import array
+from typing import Any, Dict, List, Optional, Set, Tuple
 
-from themis.modules.common.calls import CallsNode, Function, GraphFunc, IOCall, IODescFunc
+from themis.modules.common.calls import ArgsComparator, CallsNode, Function, FunctionComparator,\
+     FunctionComparisonResult, GraphFunc, IOCall, NodeCounter
+from themis.modules.transforming.callgraph import CallGraph, EdgeType, ENTRY
+from themis.modules.transforming.diagnostics import Diagnostics
 from themis.modules.transforming.parser import CallParser
 
 
-class EdgeType(Enum):
-    FOLLOW = auto()
-    NEST = auto()
-    TIME = auto()
-
-
-
-
 class Grapher:
     def __init__(
         self,
-        parser: CallParser
+        parser: CallParser,
+        coalesce: bool = False
     ) -> None:
+        # with coalesce, a call following an equivalent one on the same fd is merged into its node
     
         self._parser = parser
-        self._graph = nx.DiGraph()
-        self._i_o_descriptors = dict()  # fd_int : (IODesc, node_id) - node_id points to last event for particular fd
+        self._coalesce = coalesce
+        self._calls = list()
+        self._ids = list()
+        self._nodes: Dict[int, int] = dict()  # call id : node
+        self._runs: Set[int] = set()  # nodes calls were merged into
+        self._sources = array("q")  # of the FOLLOW edges, the NEST edges are added when the graph is built
+        self._targets = array("q")
+        self._i_o_descriptors = dict()  # fd_int : node - node is the last event for particular fd
         self._init_graph()
 
 
@@ -32,55 +35,189 @@ class Grapher:
         self    
     ) -> None:
         
-        self._graph.add_node("entry", call=CallsNode(call=IOCall(func=Function("entry", IODescFunc.NONE))))
+        entry = CallsNode(call=IOCall(func=Function.named("entry")))
+        self._calls.append(entry)
+        self._ids.append(entry.id)
 
 
 
     def _create_tree(
         self
     ) -> None:
-        # NOTE: uncomment the lines if you want the time-structure to be seen as edges (without that it is encoded into node id-s) 
 
-        #last_node = "entry"
         for call, action in self._parser.parse():
 
-            self._graph.add_node(str(call.id), call=call)
-            #self._graph.add_edge(last_node, str(call.id), type=EdgeType.TIME)
-            #last_node = str(call.id)
-            parent = "entry" if call.input_fd is None else self._i_o_descriptors.get(call.input_fd.fd, "entry")
-            self._graph.add_edge(parent, str(call.id), type=EdgeType.FOLLOW)
+            parent = ENTRY if call.input_fd is None else self._i_o_descriptors.get(call.input_fd.fd, ENTRY)
+            if self._coalesce and parent != ENTRY and action in (None, GraphFunc.NONE) \
+                    and self._continues_run(self._calls[parent], call):
+                self._merge_into(parent, call)
+                continue
+
+            node = self._nodes[call.id] = len(self._calls)
+            self._calls.append(call)
+            self._ids.append(call.id)
+            self._sources.append(parent)
+            self._targets.append(node)
             if call.input_fd is not None:
-                self._i_o_descriptors[call.input_fd.fd] = str(call.id)
+                self._i_o_descriptors[call.input_fd.fd] = node
             if call.output_fd is not None:
                 for fd in call.output_fd:
-                    self._i_o_descriptors[fd.fd] = str(call.id)
+                    self._i_o_descriptors[fd.fd] = node
 
             if action == GraphFunc.NONE:
                 continue
             if action == GraphFunc.RESET_FD:
-                self._i_o_descriptors[call.input_fd.fd] = "entry"
+                self._i_o_descriptors[call.input_fd.fd] = ENTRY
                 if call.input_fd.internal is not None:
-                    self._i_o_descriptors[call.input_fd.internal.fd] = "entry"
+                    self._i_o_descriptors[call.input_fd.internal.fd] = ENTRY
             if action == GraphFunc.RESET_STREAMS:
                 pass  # TODO
 
 
 
-    def _add_nesting_edges(
-        self
+    @staticmethod
+    def _continues_run(
+        run: CallsNode,
+        call: CallsNode
+    ) -> bool:
+        # the same function or one of its class on the same fd, with the same arguments apart from the sizes
+
+        return run.input_fd is not None and run.input_fd.fd == call.input_fd.fd \
+            and run.output_fd is None and call.output_fd is None \
+            and not run.unfinished and not call.unfinished \
+            and FunctionComparator.compare(run.func.funcname, call.func.funcname) != FunctionComparisonResult.DIFFERENT \
+            and ArgsComparator.equivalent(run.args, call.args)
+
+
+
+    def _merge_into(
+        self,
+        node: int,
+        call: CallsNode
     ) -> None:
-    
-        for start, end in self._parser.nesting_edges():
-            self._graph.add_edge(start, end, type=EdgeType.NEST)
+
+        run = self._calls[node].call
+        total = run.bytes_total if node in self._runs else run.byte_count()
+        more = call.call.byte_count()
+        run.bytes_total = more if total is None else total if more is None else total + more
+        run.repeat += call.repeat
+        if run.duration is not None and call.duration is not None:
+            run.duration += call.duration
+        self._runs.add(node)
+        self._nodes[call.id] = node  # for the nesting edges
+
+
+
+    def _unfinished_calls(
+        self,
+        calls: List[Optional[CallsNode]],
+        ids: List[int]
+    ) -> Tuple[Dict[int, int], List[Tuple[int, int]]]:
+        # the calls left open at the end of the trace, after the others, as if the parser had yielded them last,
+        # they are added to calls and ids
+
+        nodes: Dict[int, int] = dict()  # call id : node
+        edges = list()
+        descriptors = dict(self._i_o_descriptors)
+        for call in self._parser.unfinished_calls():
+            node = nodes[call.id] = len(calls)
+            calls.append(call)
+            ids.append(call.id)
+            edges.append((ENTRY if call.input_fd is None else descriptors.get(call.input_fd.fd, ENTRY), node))
+            if call.input_fd is not None:
+                descriptors[call.input_fd.fd] = node
+            for fd in call.output_fd or ():
+                descriptors[fd.fd] = node
+        return nodes, edges
+
+
+
+    def _nesting_edges(
+        self,
+        calls: List[Optional[CallsNode]],
+        ids: List[int],
+        unfinished: Dict[int, int]
+    ) -> List[Tuple[int, int]]:
+        # a nesting edge to a call the parser never yielded adds a bare node to calls and ids, as in former versions
+
+        bare: Dict[int, int] = dict(unfinished)
+
+        def node(c_id: int) -> int:
+            found = self._nodes.get(c_id, bare.get(c_id))
+            if found is None:
+                found = bare[c_id] = len(calls)
+                calls.append(None)
+                ids.append(c_id)
+            return found
+
+        edges = ((node(start), node(end)) for start, end in self._parser.nesting_edges())
+        return [(start, end) for start, end in edges if start != end]  # within a coalesced node
+
+
+
+    def _build(
+        self
+    ) -> CallGraph:
+        # from copies, the parse may go on after a checkpoint
+
+        calls = list(self._calls)
+        ids = list(self._ids)
+        unfinished, follow = self._unfinished_calls(calls, ids)
+        follow = np.array(follow, dtype=np.int64).reshape(-1, 2)
+        nesting = np.array(self._nesting_edges(calls, ids, unfinished), dtype=np.int64).reshape(-1, 2)
+        sources = np.concatenate((np.array(self._sources, dtype=np.int64), follow[:, 0], nesting[:, 0]))
+        targets = np.concatenate((np.array(self._targets, dtype=np.int64), follow[:, 1], nesting[:, 1]))
+        types = np.repeat(
+            np.array([EdgeType.FOLLOW.value, EdgeType.NEST.value], dtype=np.int8),
+            [len(self._sources) + len(follow), len(nesting)]
+        )
+
+        # an edge added twice keeps its first place and its last type
+        edges = sources * len(calls) + targets
+        _, first = np.unique(edges, return_index=True)
+        _, last = np.unique(edges[::-1], return_index=True)
+        order = np.argsort(first)
+        return CallGraph(
+            calls,
+            ids,
+            sources[first[order]],
+            targets[first[order]],
+            types[len(edges) - 1 - last[order]]
+        )
 
 
 
     def into_graph(
         self
-    ) -> Tuple[nx.DiGraph, List]:
+    ) -> CallGraph:
         
         self._create_tree()
-        self._add_nesting_edges()
+        return self._build()
+
+
+
+    def checkpoint(
+        self
+    ) -> Tuple[Dict[str, Any], Dict[str, Any], int]:
+        # after into_graph, for resume
+
+        state = dict(vars(self))
+        del state["_parser"]
+        return state, self._parser.checkpoint(), NodeCounter.oid
+
+
 
-        return self._graph
+    @staticmethod
+    def resume(
+        checkpoint: Tuple[Dict[str, Any], Dict[str, Any], int],
+        infile,
+        diagnostics: Optional[Diagnostics] = None
+    ) -> 'Grapher':
+        # a grapher going on with the lines of infile, as if they had followed the ones of the checkpoint
 
+        state, parser_state, oid = checkpoint
+        grapher = Grapher.__new__(Grapher)
+        grapher.__dict__.update(state)
+        grapher._parser = CallParser.resume(parser_state, infile, diagnostics=diagnostics)
+        NodeCounter.oid = oid
+        return grapher
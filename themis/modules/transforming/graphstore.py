@@ -0,0 +1,481 @@
+"""
+    Columnar graph storage.
+
+    Layout: MAGIC, one version byte, three zero bytes, the length of the header as a little-endian uint32,
+    the header as utf-8 json, then the arrays it lists, each starting at a multiple of ALIGNMENT.
+
+    The header maps the name of every array to its dtype, its length and its offset in the file.
+    The arrays are the CSR edges and the columns of the CallGraph, one row per node, and the tables
+    the calls are rebuilt from:
+
+    descriptors     a row per IODesc, shared by the calls referring to the same one,
+                    desc_internal is the row of the internal fd of a stream
+    out_indptr      with out_fd, the rows of the descriptors returned by each call, CSR
+    args_indptr     with arg_names and arg_values, the arguments of each call, CSR
+    strings         function names, argument names and values and descriptions, stored once,
+                    utf-8 in string_data, the string i from string_offsets[i] to string_offsets[i + 1]
+
+    Arrays are memory-mapped when the graph is read, the calls are only rebuilt when they are accessed,
+    so no code runs for the stored data, unlike for a pickle.
+"""
+import json
+import math
+import mmap
+import os
+import pickle
+
+import numpy as np
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from themis.modules.common.calls import CallsNode, Function, IOCall, IOConstructType, IODesc, IODescFunc
+from themis.modules.common.errors import InvalidGraphFormatException
+from themis.modules.transforming.callgraph import COLUMNS, CallGraph
+
+MAGIC = b"THMG"
+VERSION = 1  # readers accept all versions up to this one
+ALIGNMENT = 64
+PREAMBLE = 12  # magic, version, padding and the header length
+NONE = -1  # in the code columns, for an absent value
+
+DTYPES = {
+    "ids": "<i8",
+    "indptr": "<i8",
+    "indices": "<i8",
+    "edge_types": "<i1",
+    "functions": "<i4",  # string codes of the names of the codes in func
+    "func": "<i4",
+    "index": "<i8",
+    "repeat": "<i4",
+    "time": "<f8",
+    "duration": "<f8",
+    "io_type": "<i1",
+    "present": "|b1",  # False for a node only known from a nesting edge
+    "effect": "<i1",
+    "unfinished": "|b1",
+    "bytes_total": "<i8",  # NONE if unknown
+    "in_fd": "<i4",  # descriptor rows
+    "has_out": "|b1",  # out_fd is a list, possibly empty, and not None
+    "out_indptr": "<i8",
+    "out_fd": "<i4",
+    "args_indptr": "<i8",
+    "arg_names": "<i4",
+    "arg_values": "<i4",
+    "desc_typ": "<i1",
+    "desc_fd": "<u8",  # pointers of streams and dirs too
+    "desc_has_fd": "|b1",
+    "desc_text": "<i4",
+    "desc_internal": "<i4",
+    "string_data": "|u1",
+    "string_offsets": "<i8"
+}
+
+
+class _Encoder:
+    def __init__(
+        self
+    ) -> None:
+
+        self.strings: Dict[str, int] = dict()
+        self.descs: Dict[int, int] = dict()  # id of the IODesc : row
+        self.desc_rows: List[Tuple[int, int, bool, int, int]] = list()
+
+
+
+    def string(
+        self,
+        value: Optional[str]
+    ) -> int:
+
+        if value is None:
+            return NONE
+        if not isinstance(value, str):
+            raise InvalidGraphFormatException(f"cannot store {type(value).__name__} value {value!r}")
+        code = self.strings.get(value)
+        if code is None:
+            code = self.strings[value] = len(self.strings)
+        return code
+
+
+
+    def desc(
+        self,
+        iodesc: Optional[IODesc]
+    ) -> int:
+
+        if iodesc is None:
+            return NONE
+        row = self.descs.get(id(iodesc))
+        if row is None:
+            row = self.descs[id(iodesc)] = len(self.desc_rows)
+            self.desc_rows.append(None)
+            self.desc_rows[row] = (
+                int(iodesc.typ),
+                0 if iodesc.fd is None else iodesc.fd,
+                iodesc.fd is not None,
+                self.string(iodesc.desc),
+                self.desc(iodesc.internal)
+            )
+        return row
+
+
+
+    def string_arrays(
+        self
+    ) -> Tuple[np.ndarray, np.ndarray]:
+
+        encoded = [value.encode("utf-8") for value in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+
+
+def _encode(
+    graph: CallGraph
+) -> Dict[str, np.ndarray]:
+
+    encoder = _Encoder()
+    count = len(graph)
+    present = np.zeros(count, dtype=bool)
+    effect = np.zeros(count, dtype=np.int8)
+    unfinished = np.zeros(count, dtype=bool)
+    bytes_total = np.full(count, NONE, dtype=np.int64)
+    in_fd = np.full(count, NONE, dtype=np.int32)
+    has_out = np.zeros(count, dtype=bool)
+    out_counts = np.zeros(count, dtype=np.int64)
+    out_fd = list()
+    args_counts = np.zeros(count, dtype=np.int64)
+    arg_names = list()
+    arg_values = list()
+
+    for node, call in enumerate(graph.calls):
+        if call is None:
+            continue
+        present[node] = True
+        effect[node] = call.func.effect.value
+        unfinished[node] = call.unfinished
+        if call.bytes_total is not None:
+            bytes_total[node] = call.bytes_total
+        in_fd[node] = encoder.desc(call.input_fd)
+        if call.output_fd is not None:
+            has_out[node] = True
+            out_counts[node] = len(call.output_fd)
+            out_fd.extend(encoder.desc(iodesc) for iodesc in call.output_fd)
+        args_counts[node] = len(call.args)
+        for name, value in call.args.items():
+            arg_names.append(encoder.string(name))
+            arg_values.append(encoder.string(value))
+
+    arrays = {
+        "ids": graph.ids,
+        "indptr": graph.indptr,
+        "indices": graph.indices,
+        "edge_types": graph.edge_types,
+        "functions": np.array([encoder.string(name) for name in graph.functions], dtype=np.int32),
+        "present": present,
+        "effect": effect,
+        "unfinished": unfinished,
+        "bytes_total": bytes_total,
+        "in_fd": in_fd,
+        "has_out": has_out,
+        "out_indptr": np.concatenate(([0], np.cumsum(out_counts))),
+        "out_fd": np.array(out_fd, dtype=np.int32),
+        "args_indptr": np.concatenate(([0], np.cumsum(args_counts))),
+        "arg_names": np.array(arg_names, dtype=np.int32),
+        "arg_values": np.array(arg_values, dtype=np.int32)
+    }
+    for name in COLUMNS:
+        arrays[name] = getattr(graph, name)
+    desc_columns = list(zip(*encoder.desc_rows)) or [()] * 5
+    for name, column in zip(("desc_typ", "desc_fd", "desc_has_fd", "desc_text", "desc_internal"), desc_columns):
+        arrays[name] = np.array(column, dtype=DTYPES[name])
+    arrays["string_data"], arrays["string_offsets"] = encoder.string_arrays()
+    return dict((name, np.ascontiguousarray(array, dtype=DTYPES[name])) for name, array in arrays.items())
+
+
+
+def write_graph(
+    graph: CallGraph,
+    path: str
+) -> None:
+    # replaced at once, an interrupted write leaves the former graph
+
+    arrays = _encode(graph)
+    layout = dict()
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = [array.dtype.str, len(array), offset]
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps({"arrays": layout}).encode("utf-8")
+    start = -(-(PREAMBLE + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(MAGIC + bytes([VERSION, 0, 0, 0]) + len(header).to_bytes(4, "little") + header)
+        for name, array in arrays.items():
+            file.seek(start + layout[name][2])
+            file.write(array.tobytes())
+        file.truncate(start + offset)
+    os.replace(temporary, path)
+
+
+
+
+class StoredCalls(Sequence):
+    def __init__(
+        self,
+        arrays: Dict[str, np.ndarray]
+    ) -> None:
+        # the calls of a read graph, each built on its first access, the descriptors are shared as in the graph written
+
+        self._arrays = arrays
+        self._calls: List[Optional[CallsNode]] = [None] * len(arrays["ids"])
+        self._built = bytearray(len(arrays["ids"]))
+        self._strings: Dict[int, str] = dict()
+        self._descs: Dict[int, IODesc] = dict()
+
+
+
+    def __len__(
+        self
+    ) -> int:
+
+        return len(self._calls)
+
+
+
+    def __getitem__(
+        self,
+        node: int
+    ) -> Optional[CallsNode]:
+
+        if isinstance(node, slice):
+            return [self[i] for i in range(*node.indices(len(self)))]
+        if node < 0:
+            node += len(self)
+        if not self._built[node]:
+            self._calls[node] = self._build(node)
+            self._built[node] = True
+        return self._calls[node]
+
+
+
+    def __iter__(
+        self
+    ):
+
+        if not all(self._built):
+            self._build_all()
+        return iter(self._calls)
+
+
+
+    def string(
+        self,
+        code: int
+    ) -> Optional[str]:
+
+        if code == NONE:
+            return None
+        value = self._strings.get(code)
+        if value is None:
+            offsets = self._arrays["string_offsets"]
+            data = self._arrays["string_data"][offsets[code]:offsets[code + 1]]
+            value = self._strings[code] = data.tobytes().decode("utf-8")
+        return value
+
+
+
+    def _desc(
+        self,
+        row: int
+    ) -> Optional[IODesc]:
+
+        if row == NONE:
+            return None
+        iodesc = self._descs.get(row)
+        if iodesc is None:
+            arrays = self._arrays
+            iodesc = self._descs[row] = IODesc(
+                typ=IOConstructType(int(arrays["desc_typ"][row])),
+                fd=int(arrays["desc_fd"][row]) if arrays["desc_has_fd"][row] else None,
+                desc=self.string(int(arrays["desc_text"][row])),
+                internal=self._desc(int(arrays["desc_internal"][row]))
+            )
+        return iodesc
+
+
+
+    def _build(
+        self,
+        node: int
+    ) -> Optional[CallsNode]:
+
+        arrays = self._arrays
+        if not arrays["present"][node]:
+            return None
+
+        out_fd = None
+        if arrays["has_out"][node]:
+            start, end = arrays["out_indptr"][node], arrays["out_indptr"][node + 1]
+            out_fd = [self._desc(int(row)) for row in arrays["out_fd"][start:end]]
+        start, end = arrays["args_indptr"][node], arrays["args_indptr"][node + 1]
+        args = dict(
+            (self.string(int(name)), self.string(int(value)))
+            for name, value in zip(arrays["arg_names"][start:end], arrays["arg_values"][start:end])
+        )
+        time = float(arrays["time"][node])
+        duration = float(arrays["duration"][node])
+        bytes_total = int(arrays["bytes_total"][node])
+        funcname = self.string(int(arrays["functions"][arrays["func"][node]]))
+
+        call = IOCall(
+            index=int(arrays["index"][node]),
+            func=Function.named(funcname, IODescFunc(int(arrays["effect"][node]))),
+            in_fd=self._desc(int(arrays["in_fd"][node])),
+            out_fd=out_fd,
+            args=args,
+            repeat=int(arrays["repeat"][node]),
+            time=None if math.isnan(time) else time,
+            duration=None if math.isnan(duration) else duration,
+            unfinished=bool(arrays["unfinished"][node]),
+            bytes_total=None if bytes_total == NONE else bytes_total
+        )
+        # the stored id, not one of the NodeCounter
+        calls_node = CallsNode.__new__(CallsNode)
+        object.__setattr__(calls_node, "id", int(arrays["ids"][node]))
+        object.__setattr__(calls_node, "call", call)
+        return calls_node
+
+
+
+    def _build_all(
+        self
+    ) -> None:
+        # from plain lists and all strings decoded at once, indexing the arrays one value at a time is much slower
+
+        arrays = self._arrays
+        data = arrays["string_data"].tobytes()
+        offsets = arrays["string_offsets"].tolist()
+        strings = [data[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+        strings.append(None)  # for NONE
+        descs = [self._desc(row) for row in range(len(arrays["desc_typ"]))]
+        descs.append(None)
+        functions = [strings[code] for code in arrays["functions"].tolist()]
+        named: Dict[Tuple[int, int], Function] = dict()
+
+        out_indptr = arrays["out_indptr"].tolist()
+        out_fd = arrays["out_fd"].tolist()
+        args_indptr = arrays["args_indptr"].tolist()
+        arg_names = arrays["arg_names"].tolist()
+        arg_values = arrays["arg_values"].tolist()
+        rows = zip(
+            range(len(self._calls)),
+            arrays["present"].tolist(),
+            arrays["ids"].tolist(),
+            arrays["func"].tolist(),
+            arrays["effect"].tolist(),
+            arrays["index"].tolist(),
+            arrays["in_fd"].tolist(),
+            arrays["has_out"].tolist(),
+            arrays["repeat"].tolist(),
+            arrays["time"].tolist(),
+            arrays["duration"].tolist(),
+            arrays["unfinished"].tolist(),
+            arrays["bytes_total"].tolist()
+        )
+        for node, present, c_id, func, effect, index, in_fd, has_out, repeat, time, duration, unfinished, bytes_total in rows:
+            if not present or self._built[node]:
+                continue
+            function = named.get((func, effect))
+            if function is None:
+                function = named[(func, effect)] = Function.named(functions[func], IODescFunc(effect))
+            start, end = args_indptr[node], args_indptr[node + 1]
+            # positional, in the order of the fields, it is called for every node
+            call = IOCall(
+                index,
+                function,
+                descs[in_fd],
+                [descs[row] for row in out_fd[out_indptr[node]:out_indptr[node + 1]]] if has_out else None,
+                dict(zip([strings[name] for name in arg_names[start:end]], [strings[value] for value in arg_values[start:end]])),
+                repeat,
+                None if math.isnan(time) else time,
+                None if math.isnan(duration) else duration,
+                unfinished,
+                None if bytes_total == NONE else bytes_total
+            )
+            calls_node = CallsNode.__new__(CallsNode)
+            object.__setattr__(calls_node, "id", c_id)
+            object.__setattr__(calls_node, "call", call)
+            self._calls[node] = calls_node
+        self._built[:] = bytes([1]) * len(self._calls)
+
+
+
+
+def read_graph(
+    path: str
+) -> CallGraph:
+    # the arrays are views of the mapped file, which stays mapped as long as one of them is alive
+
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size < PREAMBLE:
+            raise InvalidGraphFormatException(f"{path} is not a stored graph")
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer[:len(MAGIC)] != MAGIC:
+        buffer.close()
+        raise InvalidGraphFormatException(f"{path} is not a stored graph")
+    if buffer[len(MAGIC)] > VERSION:
+        buffer.close()
+        raise InvalidGraphFormatException(f"{path} has unsupported version {buffer[len(MAGIC)]}")
+
+    # a truncated file misses part of the header or of the arrays it lists
+    try:
+        length = int.from_bytes(buffer[PREAMBLE - 4:PREAMBLE], "little")
+        layout = json.loads(buffer[PREAMBLE:PREAMBLE + length].decode("utf-8"))["arrays"]
+        start = -(-(PREAMBLE + length) // ALIGNMENT) * ALIGNMENT
+        arrays = dict(
+            (name, np.frombuffer(buffer, dtype=dtype, count=count, offset=start + offset))
+            for name, (dtype, count, offset) in layout.items()
+        )
+    except (ValueError, KeyError, TypeError) as error:
+        raise InvalidGraphFormatException(f"{path} is truncated or damaged: {error}") from error
+
+    calls = StoredCalls(arrays)
+    functions = [calls.string(code) for code in arrays["functions"].tolist()]
+    return CallGraph.from_arrays(
+        calls,
+        arrays["ids"],
+        arrays["indptr"],
+        arrays["indices"],
+        arrays["edge_types"],
+        functions,
+        dict((name, arrays[name]) for name in COLUMNS)
+    )
+
+
+
+def migrate_pickle(
+    path: str,
+    target: Optional[str] = None
+) -> str:
+    # the networkx pickle of former versions into the stored graph next to it, only for pickles that are trusted,
+    # loading one runs any code it holds
+
+    if target is None:
+        target = f"{path[:-len('.pickle')] if path.endswith('.pickle') else path}.thmg"
+    with open(path, "rb") as file:
+        graph = CallGraph.from_networkx(pickle.load(file))
+    write_graph(graph, target)
+
+    stored = read_graph(target)
+    same = len(stored) == len(graph) and np.array_equal(stored.indptr, graph.indptr) \
+        and np.array_equal(stored.indices, graph.indices) and np.array_equal(stored.edge_types, graph.edge_types) \
+        and stored.functions == graph.functions \
+        and all(np.array_equal(getattr(stored, name), getattr(graph, name), equal_nan=True) for name in COLUMNS)
+    if not same:
+        raise InvalidGraphFormatException(f"{target} does not hold the graph of {path}")
+    return target
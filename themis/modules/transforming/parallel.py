@@ -0,0 +1,435 @@
+import gc
+import io
+import mmap
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
+from typing import Any, Dict, Generator, List, NamedTuple, Optional, Tuple, Union
+
+from themis.modules.common.calls import CallsNode, CallsNodeAndFunc, Function, IOCall, IODesc,\
+     IODescAndState, IODescState, IOConstructType, NodeCounter
+from themis.modules.transforming.diagnostics import Anomaly, Diagnostics
+from themis.modules.transforming.parser import MAX_PENDING, ORPHAN, CallParser, complete_call, record_from_line,\
+     tokenize_line
+
+CHUNK_SIZE = 1 << 22  # filtered traces larger than this are parsed in chunks, in a process pool
+
+# rows of a parsed chunk, in the order the sequential parser would have come across them
+NODE = 0  # a call the chunk yields
+EXIT = 1  # the exit of a call entered in an earlier chunk
+IMPORT = 2  # an input fd the chunk did not create, it may come from an earlier chunk
+STATE = 3  # a state change of such an fd
+INTERNAL = 4  # an fd opened under a call entered in an earlier chunk
+RETURNED = 5  # an fd returned before the chunk created it, it may be open since an earlier chunk
+
+
+class ParsedChunk(NamedTuple):
+    records: int
+    nodes: int  # ids 0 to nodes - 1 were given, the merge offsets them
+    descs: List[Tuple[IOConstructType, Optional[int], Optional[str], Optional[int]]]  # IODescs, internal as index
+    rows: List[Tuple]  # descs and nodes referred to by index
+    pending: List[Tuple[int, Tuple]]  # calls entered but not exited, by frida call id, in the order entered
+    internal_fds: List[Tuple[int, int]]  # of the pending calls
+    table: List[Tuple[int, int, IODescState]]  # the fds the chunk created, as left at its end
+    edges: List[Tuple[int, int]]  # negative for the n-th EXIT row
+    diagnostics: Diagnostics  # of what the chunk could check on its own
+    levels: List[Tuple[int, int]]  # the last node of each offset, as in edges
+    previous_offset: int
+
+
+
+
+class _ChunkParser(CallParser):
+    # starts without any fd, whatever refers to an earlier chunk is left to the merge in rows
+
+    def __init__(
+        self,
+        infile,
+        verbose: bool = False,
+        max_pending: int = MAX_PENDING
+    ) -> None:
+
+        super().__init__(infile, diagnostics=Diagnostics(verbose), max_pending=max_pending)
+        self._iodesc.clear()
+        self._exits = 0
+        self.rows: List[Tuple] = list()
+
+
+
+    def _exit_node(
+        self,
+        c_id: int,
+        func: str,
+        index: int,
+        out_fd: Optional[List[IODesc]],
+        time: Optional[float]
+    ) -> Union[CallsNode, int, None]:
+
+        if c_id in self._open_iocall:
+            return super()._exit_node(c_id, func, index, out_fd, time)
+
+        self.rows.append((EXIT, c_id, func, index, out_fd, time))
+        # the types are guessed now, later calls of the chunk may copy them
+        self._unpaired_exit(out_fd)
+        self._exits += 1
+        return -self._exits  # stands in for the id in the nesting edges
+
+
+
+    def _register_internal_fd(
+        self,
+        iodesc: IODesc
+    ) -> None:
+
+        if self._open_iocall:
+            super()._register_internal_fd(iodesc)
+        else:
+            self.rows.append((INTERNAL, iodesc))
+
+
+
+    def _unknown_fd(
+        self,
+        fd: int,
+        func: str
+    ) -> IODesc:
+
+        iodesc = IODesc(typ=IOConstructType.UNKNOWN, fd=fd)
+        self.rows.append((IMPORT, iodesc, func))
+        return iodesc
+
+
+
+    def _check_returned_fd(
+        self,
+        fd: int,
+        func: str,
+        value: str
+    ) -> None:
+
+        if fd in self._iodesc:
+            super()._check_returned_fd(fd, func, value)
+        else:
+            self.rows.append((RETURNED, fd, func, value))
+
+
+
+    def _set_fd_state(
+        self,
+        fd: int,
+        state: IODescState
+    ) -> None:
+
+        if fd in self._iodesc:
+            super()._set_fd_state(fd, state)
+        else:
+            self.rows.append((STATE, fd, state))
+
+
+
+    def encode(
+        self
+    ) -> ParsedChunk:
+        # plain tuples instead of the objects, they are pickled much faster
+
+        refs: Dict[int, int] = dict()
+        descs = list()
+
+        def ref(iodesc: Optional[IODesc]) -> Optional[int]:
+            if iodesc is None:
+                return None
+            index = refs.get(id(iodesc))
+            if index is None:
+                index = refs[id(iodesc)] = len(descs)
+                descs.append(None)
+                descs[index] = (iodesc.typ, iodesc.fd, iodesc.desc, ref(iodesc.internal))
+            return index
+
+        def node_row(node: CallsNode) -> Tuple:
+            out_refs = None if node.output_fd is None else tuple(map(ref, node.output_fd))
+            return (
+                node.id, node.index, node.func.funcname, ref(node.input_fd), out_refs,
+                node.args, node.repeat, node.time, node.duration, node.unfinished
+            )
+
+        rows = list()
+        for row in self.rows:
+            if row[0] == NODE:
+                rows.append((NODE, *node_row(row[1]), row[2]))
+            elif row[0] == EXIT:
+                _, c_id, func, index, out_fd, time = row
+                rows.append((EXIT, c_id, func, index, None if out_fd is None else tuple(map(ref, out_fd)), time))
+            elif row[0] in (IMPORT, INTERNAL):
+                rows.append((row[0], ref(row[1]), *row[2:]))
+            else:
+                rows.append(row)
+
+        return ParsedChunk(
+            records=self.call_index,
+            nodes=NodeCounter.oid,
+            descs=descs,
+            rows=rows,
+            pending=[(c_id, node_row(node)) for c_id, node in self._open_iocall.items()],
+            internal_fds=[(i, ref(iodesc)) for i, iodesc in self._available_internal_fds.items()],
+            table=[(fd, ref(handle.iodesc), handle.state) for fd, handle in self._iodesc.items()],
+            edges=self._edges,
+            diagnostics=self.diagnostics,
+            levels=list(self._last_of_level.items()),
+            previous_offset=self._previous_offset
+        )
+
+
+
+
+class ParallelCallParser(CallParser):
+    def __init__(
+        self,
+        path: str,
+        processes: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE,
+        diagnostics: Optional[Diagnostics] = None,
+        max_pending: int = MAX_PENDING
+    ) -> None:
+        # path is a plain filtered trace, it is split at top-level calls
+
+        super().__init__((), structured=True, diagnostics=diagnostics, max_pending=max_pending)
+        self._path = path
+        self._processes = processes
+        self._chunk_size = chunk_size
+
+
+
+    def parse(
+        self
+    ) -> Generator[CallsNodeAndFunc, Any, Any]:
+
+        if os.path.getsize(self._path) == 0:
+            return
+        starts, ends = zip(*_chunk_bounds(self._path, self._chunk_size))
+        if self._processes == 1 or len(starts) == 1:
+            with open(self._path, "r") as file:
+                self._records = filter(None, map(partial(record_from_line, diagnostics=self.diagnostics), file))
+                yield from super().parse()
+            return
+
+        with ProcessPoolExecutor(max_workers=self._processes) as pool:
+            verbose = repeat(self.diagnostics.verbose)
+            max_pending = repeat(self._max_pending)
+            for chunk in pool.map(_parse_chunk, repeat(self._path), starts, ends, verbose, max_pending):
+                yield from self._merge(chunk)
+
+
+
+    def _merge(
+        self,
+        chunk: ParsedChunk
+    ) -> Generator[CallsNodeAndFunc, Any, Any]:
+        # chunks are merged in order, with the state the sequential parser would have had at their start
+
+        base_index = self.call_index
+        base_id = NodeCounter.oid
+        self.diagnostics.merge(chunk.diagnostics)
+        self.call_index += chunk.records
+        NodeCounter.oid += chunk.nodes
+
+        descs = [IODesc(typ=typ, fd=fd, desc=desc) for typ, fd, desc, _ in chunk.descs]
+        for iodesc, (_, _, _, internal) in zip(descs, chunk.descs):
+            if internal is not None:
+                iodesc.internal = descs[internal]
+
+        imported: Dict[int, IODesc] = dict()  # the stand-ins of imported fds
+        exit_ids = list()
+        for row in chunk.rows:
+            kind = row[0]
+            if kind == NODE:
+                node = _decode_node(row[1:11], descs, base_index, base_id)
+                if row[4] in imported:
+                    self._apply_import(node, imported.pop(row[4]))
+                yield CallsNodeAndFunc(call=node, func=row[11])
+
+            elif kind == EXIT:
+                _, c_id, func, index, out_refs, time = row
+                call = self._open_iocall.pop(c_id, None)
+                if call is None:
+                    # evicted, or never entered, the chunk may have registered its fd as internal regardless
+                    self.diagnostics.report(Anomaly.UNMATCHED_EXIT, func, str(c_id))
+                    exit_ids.append(ORPHAN)
+                    continue
+                out_fd = None if out_refs is None else [descs[ref] for ref in out_refs]
+                complete_call(call, base_index + index, out_fd, time, self._available_internal_fds)
+                exit_ids.append(call.id)
+                yield CallsNodeAndFunc(call=call, func=self._postprocess_node(call))
+
+            elif kind == IMPORT:
+                _, ref, func = row
+                known = self._resolve_fd(descs[ref].fd, func)
+                if known is not None:
+                    imported[ref] = descs[ref]
+                    descs[ref] = known
+
+            elif kind == STATE:
+                self._set_fd_state(row[1], row[2])
+
+            elif kind == RETURNED:
+                self._check_returned_fd(*row[1:])
+
+            elif kind == INTERNAL:
+                self._register_internal_fd(descs[row[1]])
+
+        # the pending calls of the chunk are dropped at its end, the sequential parser drops them
+        # when the limit is reached, in between
+        for i, ref in chunk.internal_fds:
+            self._available_internal_fds[base_id + i] = descs[ref]
+        for c_id, row in chunk.pending:
+            if c_id in self._open_iocall:
+                self._drop_pending(c_id)
+            self._open_iocall[c_id] = _decode_node(row, descs, base_index, base_id)
+            if len(self._open_iocall) > self._max_pending:
+                self._drop_pending(next(iter(self._open_iocall)))
+        yield from self._yield_unfinished()
+        for fd, ref, state in chunk.table:
+            self._iodesc[fd] = IODescAndState(iodesc=descs[ref], state=state)
+
+        def edge_id(i: int) -> Optional[int]:
+            return base_id + i if i >= 0 else exit_ids[-i - 1]
+
+        edges = ((edge_id(start), edge_id(end)) for start, end in chunk.edges)
+        self._edges.extend(edge for edge in edges if ORPHAN not in edge)
+        self._last_of_level.update((offset, edge_id(i)) for offset, i in chunk.levels)
+        self._previous_offset = chunk.previous_offset
+
+
+
+    def _resolve_fd(
+        self,
+        fd: int,
+        func: str
+    ) -> Optional[IODesc]:
+
+        same_fd = self._iodesc.get(fd, None)
+        if same_fd is None:
+            self.diagnostics.report(Anomaly.UNKNOWN_FD, func, hex(fd))
+            return None
+        if same_fd.state == IODescState.CLOSED:
+            self.diagnostics.report(Anomaly.CLOSED_FD, func, hex(fd))
+        if same_fd.state == IODescState.FORGOTTEN:
+            self.diagnostics.report(Anomaly.FORGOTTEN_FD, func, hex(fd))
+        return same_fd.iodesc
+
+
+
+    def _apply_import(
+        self,
+        node: CallsNode,
+        stand_in: IODesc
+    ) -> None:
+        # what the chunk did to the stand-in, now for the known fd
+
+        if stand_in.typ > node.input_fd.typ:
+            node.input_fd.typ = stand_in.typ
+        if node.func.funcname == "fclose" and node.input_fd.internal is not None:
+            self._set_fd_state(node.input_fd.internal.fd, IODescState.FORGOTTEN)
+        elif node.func.funcname in ("dup", "dup2") and node.output_fd is not None:
+            for fd in node.output_fd:
+                if node.input_fd.typ > fd.typ:
+                    fd.typ = node.input_fd.typ
+
+
+
+
+def _decode_node(
+    row: Tuple,
+    descs: List[IODesc],
+    base_index: int,
+    base_id: int
+) -> CallsNode:
+
+    node_id, index, func, in_ref, out_refs, args, repeat, time, duration, unfinished = row
+    call = IOCall(
+        base_index + index,
+        Function.named(func),
+        None if in_ref is None else descs[in_ref],
+        None if out_refs is None else [descs[ref] for ref in out_refs],
+        args,
+        repeat,
+        time,
+        duration,
+        unfinished
+    )
+    # without drawing an id from NodeCounter, the merge reserved the ids of the chunk
+    node = CallsNode.__new__(CallsNode)
+    node.id = base_id + node_id
+    node.call = call
+    return node
+
+
+
+def _parse_chunk(
+    path: str,
+    start: int,
+    end: int,
+    verbose: bool,
+    max_pending: int = MAX_PENDING
+) -> ParsedChunk:
+
+    with open(path, "rb") as file:
+        file.seek(start)
+        data = file.read(end - start)
+
+    # the nodes of a chunk hold no cycles, but the collector would walk all of them over and over
+    collecting = gc.isenabled()
+    gc.disable()
+    oid = NodeCounter.oid
+    NodeCounter.oid = 0
+    try:
+        parser = _ChunkParser(io.TextIOWrapper(io.BytesIO(data)), verbose, max_pending)
+        for node, func in parser.parse():
+            parser.rows.append((NODE, node, func))
+        return parser.encode()
+    finally:
+        NodeCounter.oid = oid
+        if collecting:
+            gc.enable()
+
+
+
+def _next_top_level(
+    buffer: mmap.mmap,
+    position: int
+) -> int:
+    # the start of the first top-level call after position, nesting edges never cross it
+
+    start = buffer.find(b"\n", position) + 1
+    while 0 < start < len(buffer):
+        end = buffer.find(b"\n", start) + 1
+        record = tokenize_line(buffer[start:end or len(buffer)].decode(errors="replace"))
+        if record is not None and record.offset == 0:
+            return start
+        if end == 0:
+            break
+        start = end
+    return len(buffer)
+
+
+
+def _chunk_bounds(
+    path: str,
+    chunk_size: int
+) -> List[Tuple[int, int]]:
+
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            chunks = -(-len(buffer) // chunk_size)
+            bounds = list()
+            start = 0
+            for i in range(1, chunks):
+                end = _next_top_level(buffer, max(start, len(buffer) * i // chunks))
+                if end >= len(buffer):
+                    break
+                if end > start:
+                    bounds.append((start, end))
+                    start = end
+            bounds.append((start, len(buffer)))
+            return bounds
@@ -1,32 +1,44 @@
-import re
+import copy
+import sys
 
+from functools import partial
 from typing import Generator, Optional, List, Any, Tuple, Union, Dict
 from dataclasses import dataclass, field
 from uuid import uuid4, UUID
 
-from themis.modules.common.calls import STDSTREAM_MANIPULATORS, CallsNode, IODescAndState, IOConstructType,\
+from themis.modules.common.calls import CATALOG, CallsNode, IODescAndState, IOConstructType,\
      IODesc, IODescFunc, IODescState, CallsNodeAndFunc, IOCall, GraphFunc, Function
-from themis.modules.common.calls import CLOSERS, BINFILE_MANIPULATORS, MEMORY_MANIPULATORS,\
-     STREAM_MANIPULATORS, SOCKET_MANIPULATORS, PIPE_MANIPULATORS, FIFIO_MANIPULATORS,\
-          TMP_MANIPULATORS, LINK_MANIPULATORS, DIRECTORY_MANIPULATORS
+from themis.modules.common.records import CallRecord
+from themis.modules.transforming.diagnostics import Anomaly, Diagnostics
 
-CALL_REGEX = re.compile(r"(?P<offset>[\|\s]+)(?P<func>\w+)(?P<callpoint>::exit<\d{1,6}>|::enter<\d{1,6}>)?\((?P<args>[\w\s,+\d=/\"\.\%\:\_]*)\)")
-CALLPOINT_REGEX = re.compile(r"::(?P<type>\w+)<(?P<id>\d+)>")
+CALLPOINTS = ("enter", "exit")
+IN_FD_ARGS = ("fd", "sockfd", "stream", "oldfd")
+OUT_FD_ARGS = ("newfd", "retval")
+MAX_PENDING = 1 << 16  # calls entered but not exited, the oldest is dropped as unfinished beyond it
+ORPHAN = None  # stands in for the exit of a call that was never entered, nesting edges to it are dropped
 
 
 class CallParser:
     def __init__(
         self,
-        infile
+        infile,
+        structured: bool = False,
+        diagnostics: Optional[Diagnostics] = None,
+        max_pending: int = MAX_PENDING
     ) -> None:
+        # infile yields either lines of a filtered trace, or CallRecords if structured is set
     
-        self._lines = infile
+        self.diagnostics = Diagnostics() if diagnostics is None else diagnostics
+        self._read(infile, structured)
         self.call_index = 0
-        self._edges: List[Tuple[str, str]] = list()
-        self._last_of_level: Dict[int, str] = dict()  # int is offset
-        self._open_iocall: Dict[int, CallsNode] = dict()  # int is identifier from frida
-        self._open_iocall_stack = list()
-        self._available_internal_fds = dict()
+        self._edges: List[Tuple[int, int]] = list()
+        self._last_of_level: Dict[int, int] = dict()  # offset : node id
+        self._previous_offset = 2
+        self._record: Optional[CallRecord] = None  # the one being parsed
+        self._open_iocall: Dict[int, CallsNode] = dict()  # int is identifier from frida, in the order entered
+        self._max_pending = max_pending
+        self._unfinished: List[CallsNode] = list()  # dropped from _open_iocall, yielded after the current record
+        self._available_internal_fds: Dict[int, IODesc] = dict()  # node id of a pending call : fd opened under it
         self._iodesc: Dict[int, IODescAndState] = dict()
 
 
@@ -45,59 +57,146 @@ class CallParser:
 
 
 
+    def _read(
+        self,
+        infile,
+        structured: bool
+    ) -> None:
+
+        if structured:
+            self._records = iter(infile)
+        else:
+            self._records = filter(None, map(partial(record_from_line, diagnostics=self.diagnostics), infile))
+
+
+
+    def checkpoint(
+        self
+    ) -> Dict[str, Any]:
+        # the state after the records read so far, resume goes on from it with the rest of the trace
+
+        state = dict(vars(self))
+        del state["_records"]
+        # without the calls unfinished_calls reported, they may still exit in the rest of the trace
+        state["diagnostics"] = state.pop("_settled", self.diagnostics)
+        return state
+
+
+
+    @classmethod
+    def resume(
+        cls,
+        state: Dict[str, Any],
+        infile,
+        structured: bool = False,
+        diagnostics: Optional[Diagnostics] = None
+    ) -> 'CallParser':
+        # the anomalies found before the checkpoint are added to diagnostics
+
+        parser = cls.__new__(cls)
+        parser.__dict__.update(state)
+        if diagnostics is not None:
+            diagnostics.merge(parser.diagnostics)
+            parser.diagnostics = diagnostics
+        parser._read(infile, structured)
+        return parser
+
+
+
     def parse(
         self
     ) -> Generator[CallsNodeAndFunc, Any, Any]:
     
-        previous_offset = 2
+        previous_offset = self._previous_offset
 
         while True:
-            line = self._next()
-            if line is not None:
-                offset, node = self._node_from_line(line)
+            record = self._next()
+            if record is not None:
+                offset, node = self._node_from_record(record)
+                node_id = extract_id(node)
                 if offset > previous_offset:
-                    self._edges.append((self._last_of_level[previous_offset], extract_uuid(node)))
+                    parent = self._last_of_level[previous_offset]
+                    if parent is not ORPHAN and node_id is not ORPHAN:
+                        self._edges.append((parent, node_id))
                 if isinstance(node, CallsNode) and  offset > 2 and node.func.funcname == "open":
-                    self._available_internal_fds[self._open_iocall_stack[-1]] = node.output_fd[0]         
+                    self._register_internal_fd(node.output_fd[0])
 
                 previous_offset = offset
-                self._last_of_level[offset] = extract_uuid(node)
+                self._last_of_level[offset] = node_id
 
+                if self._unfinished:
+                    yield from self._yield_unfinished()
                 if isinstance(node, CallsNode):
                     func = self._postprocess_node(node)
                     yield CallsNodeAndFunc(call=node, func=func)
             else:
+                self._previous_offset = previous_offset
                 return
 
 
 
     def nesting_edges(
         self
-    ) -> List[Tuple[str, str]]:
+    ) -> List[Tuple[int, int]]:
     
         return self._edges
 
 
 
-    def _node_from_line(
+    def unfinished_calls(
+        self
+    ) -> List[CallsNode]:
+        # the calls still open at the end of the trace, as copies, a resumed parse may see them exit
+
+        self._settled = copy.deepcopy(self.diagnostics)
+        calls = list()
+        for call in self._open_iocall.values():
+            node = CallsNode.__new__(CallsNode)
+            node.id = call.id
+            node.call = copy.copy(call.call)
+            node.call.unfinished = True
+            self.diagnostics.report(Anomaly.UNFINISHED_CALL, call.func.funcname)
+            calls.append(node)
+        return calls
+
+
+
+    def _yield_unfinished(
+        self
+    ) -> Generator[CallsNodeAndFunc, Any, Any]:
+
+        for call in self._unfinished:
+            yield CallsNodeAndFunc(call=call, func=None)
+        self._unfinished.clear()
+
+
+
+    def _drop_pending(
         self,
-        line: str
-    ) -> Optional[Tuple[int, Union[CallsNode, UUID]]]:  # int is offset
+        c_id: int
+    ) -> None:
+        # the call is yielded as unfinished, e.g. its thread was cut off before the exit
+
+        call = self._open_iocall.pop(c_id)
+        self._available_internal_fds.pop(call.id, None)
+        call.call.unfinished = True
+        self.diagnostics.report(Anomaly.UNFINISHED_CALL, call.func.funcname)
+        self._unfinished.append(call)
 
-        mat = CALL_REGEX.match(line)
 
-        if mat is None:
-            print(f"could not match line {line}")
-            return None
 
-        func = mat.group("func")
+    def _node_from_record(
+        self,
+        record: CallRecord
+    ) -> Tuple[int, Union[CallsNode, int, None]]:  # int is offset
+
         index = self.call_index
         self.call_index += 1
-        args = mat.group("args")
-        callpoint = mat.group("callpoint")
-        offset = mat.group("offset")
+        self._record = record
 
-        return offset.count('|'), self._create_node(func, index, args, callpoint)
+        return record.offset, self._create_node(
+            record.func, index, record.args, record.callpoint, record.call_id, record.repeat, record.time
+        )
 
 
 
@@ -105,53 +204,78 @@ class CallParser:
         self,
         func: str,
         index: int,
-        args: str,
-        callpoint: Optional[str]
-    ) -> Union[CallsNode, UUID]:
+        arg_dict: Dict[str, Any],
+        c_type: Optional[str],
+        c_id: Optional[int],
+        repeat: int = 1,
+        time: Optional[float] = None
+    ) -> Union[CallsNode, int, None]:
 
-        arg_dict = self._parse_args(args)
         in_fd = self._get_in_fd(arg_dict, func)
         out_fd = self._get_out_fd(arg_dict, func)
 
         func_obj = self._create_function(func)
 
-        if callpoint is None:
-            return CallsNode(call=IOCall(index, func_obj, in_fd, out_fd, arg_dict))
-
-        mat = CALLPOINT_REGEX.match(callpoint)
-        c_type = mat.group("type")
-        c_id = mat.group("id")
+        if c_type is None:
+            return CallsNode(call=IOCall(index, func_obj, in_fd, out_fd, arg_dict, repeat, time))
 
         if c_type == "enter":
-            call = CallsNode(call=IOCall(index, func_obj, in_fd, out_fd, arg_dict))
-            self._open_iocall[int(c_id)] = call
-            self._open_iocall_stack.append(call.id)
+            call = CallsNode(call=IOCall(index, func_obj, in_fd, out_fd, arg_dict, time=time))
+            if c_id in self._open_iocall:
+                self._drop_pending(c_id)  # entered again before its exit
+            self._open_iocall[c_id] = call
+            if len(self._open_iocall) > self._max_pending:
+                self._drop_pending(next(iter(self._open_iocall)))
             return call.id
         if c_type == "exit":
-            call = self._open_iocall.pop(int(c_id))
-            self._open_iocall_stack.remove(call.id)
-            call.call.out_fd = out_fd
-            call.index = index
+            return self._exit_node(c_id, func, index, out_fd, time)
+
+
 
-            if call.func.funcname == "fopen" and call.output_fd is not None:
-                call.output_fd[0].internal = self._available_internal_fds.get(call.id, None)
+    def _exit_node(
+        self,
+        c_id: int,
+        func: str,
+        index: int,
+        out_fd: Optional[List[IODesc]],
+        time: Optional[float]
+    ) -> Union[CallsNode, int, None]:
 
-            return call
+        call = self._open_iocall.pop(c_id, None)
+        if call is None:
+            self.diagnostics.report(Anomaly.UNMATCHED_EXIT, func, str(c_id))
+            self._unpaired_exit(out_fd)
+            return ORPHAN
+        complete_call(call, index, out_fd, time, self._available_internal_fds)
+        return call
 
 
 
-    def _parse_args(
+    def _unpaired_exit(
         self,
-        args: str
-    ) -> Dict[str, Any]:
-    
-        arg_dict = dict()
-        try:
-            for name, value in map(lambda x: tuple(x.split("=")), args.split(", ")):
-                arg_dict[name] = value
-        except ValueError:
-            pass
-        return arg_dict
+        out_fd: Optional[List[IODesc]]
+    ) -> None:
+        # the fds returned by an exit without its call, typed and registered as parse would for the call
+
+        if out_fd is None:
+            return
+        if self._record.func not in ("fclose", "fcloseall", "dup", "dup2"):
+            function = self._create_function(self._record.func)
+            for iodesc in out_fd:
+                iodesc.typ = guess_io_type(iodesc.typ, function)
+        if self._record.offset > 2 and self._record.func == "open":
+            self._register_internal_fd(out_fd[0])
+
+
+
+    def _register_internal_fd(
+        self,
+        iodesc: IODesc
+    ) -> None:
+        # the fd opened by a call nested in a stream opener, e.g. fopen, under the last call entered
+
+        if self._open_iocall:
+            self._available_internal_fds[next(reversed(self._open_iocall.values())).id] = iodesc
 
 
 
@@ -161,22 +285,20 @@ class CallParser:
         func: str
     ) -> Optional[IODesc]:
     
-        key = None
-        value = None
         for key, value in args.items():
-            if key in ["fd", "sockfd", "stream", "oldfd"]:
+            if key in IN_FD_ARGS:
 
                 if value is None:
-                    print(f"Function {func} takes no file descriptor")
+                    self.diagnostics.report(Anomaly.NO_INPUT_FD, func)
                     return None
-                same_fd = self._iodesc.get(int(value, base=16), None)
+                fd = int(value, base=16)
+                same_fd = self._iodesc.get(fd, None)
                 if same_fd is None:
-                    print(f"input fd {value} was never created")
-                    return IODesc(typ=IOConstructType.UNKNOWN, fd=int(value, base=16))
+                    return self._unknown_fd(fd, func)
                 if same_fd.state == IODescState.CLOSED:
-                    print(f"{func} using closed fd {value}")
+                    self.diagnostics.report(Anomaly.CLOSED_FD, func, value)
                 if same_fd.state == IODescState.FORGOTTEN:
-                    print(f"{func} using forgotten fd {value}")
+                    self.diagnostics.report(Anomaly.FORGOTTEN_FD, func, value)
 
                 return same_fd.iodesc
         return None
@@ -189,40 +311,76 @@ class CallParser:
         func: str
     ) -> Optional[List[IODesc]]:
     
-        key = None
-        value = None
         new_iodesc = []
         for key, value in args.items():
-            if key in ["newfd", "retval"]:
+            if key in OUT_FD_ARGS:
                 if value is None:
-                    print(f"Function {func} gives no file descriptor")
+                    self.diagnostics.report(Anomaly.NO_OUTPUT_FD, func)
                     continue
-                if func == "fopen" and int(value, base=16) == 0x00:
-                    print(f"fopen returned null")
+                fd = int(value, base=16)
+                if func == "fopen" and fd == 0x00:
+                    self.diagnostics.report(Anomaly.NULL_STREAM, func)
                     continue
-                same_fd = self._iodesc.get(int(value, base=16), None)
-                if same_fd is not None and same_fd.state == IODescState.OPEN:
-                    print(f"function {func} returned already open fd {value}")
-                if same_fd is not None and same_fd.state == IODescState.FORGOTTEN:
-                    print(f"function {func} returned forgotten fd {value}")
+                self._check_returned_fd(fd, func, value)
 
-                new_iodesc.append(IODesc(typ=IOConstructType.UNKNOWN, fd=int(value, base=16)))
+                new_iodesc.append(IODesc(typ=IOConstructType.UNKNOWN, fd=fd))
 
-        for iodesc in new_iodesc:
-            self._iodesc[int(value, base=16)] = IODescAndState(iodesc=iodesc, state=IODescState.OPEN)
+        if new_iodesc:
+            # registered under the last fd, as for retval, the only one of most calls
+            last_fd = new_iodesc[-1].fd
+            for iodesc in new_iodesc:
+                self._iodesc[last_fd] = IODescAndState(iodesc=iodesc, state=IODescState.OPEN)
 
         return new_iodesc if len(new_iodesc) > 0 else None
 
 
 
+    def _check_returned_fd(
+        self,
+        fd: int,
+        func: str,
+        value: str
+    ) -> None:
+
+        same_fd = self._iodesc.get(fd, None)
+        if same_fd is not None and same_fd.state == IODescState.OPEN:
+            self.diagnostics.report(Anomaly.REOPENED_FD, func, value)
+        if same_fd is not None and same_fd.state == IODescState.FORGOTTEN:
+            self.diagnostics.report(Anomaly.RETURNED_FORGOTTEN_FD, func, value)
+
+
+
+    def _unknown_fd(
+        self,
+        fd: int,
+        func: str
+    ) -> IODesc:
+
+        self.diagnostics.report(Anomaly.UNKNOWN_FD, func, hex(fd))
+        return IODesc(typ=IOConstructType.UNKNOWN, fd=fd)
+
+
+
+    def _set_fd_state(
+        self,
+        fd: int,
+        state: IODescState
+    ) -> None:
+
+        handle = self._iodesc.get(fd)
+        if handle is not None:
+            handle.state = state
+
+
+
     def _next(
         self
-    ) -> Optional[str]:
+    ) -> Optional[CallRecord]:
     
         try:
-            return next(self._lines)
+            return next(self._records)
         except StopIteration:
-            None
+            return None
 
 
 
@@ -232,17 +390,16 @@ class CallParser:
     ) -> GraphFunc:
     
         ret_func = None
-        if node.func.funcname in CLOSERS:
+        libcall = CATALOG.get(node.func.funcname)
+        if libcall is not None and libcall.closer:
             if node.input_fd.fd is not None:
-                handle = self._iodesc.get(node.input_fd.fd)
-                if handle is not None:
-                    handle.state = IODescState.CLOSED
+                self._set_fd_state(node.input_fd.fd, IODescState.CLOSED)
                 ret_func = GraphFunc.RESET_FD
 
 
         if node.func.funcname == "fclose":
             if node.input_fd.internal is not None:
-                self._iodesc[node.input_fd.internal.fd].state = IODescState.FORGOTTEN
+                self._set_fd_state(node.input_fd.internal.fd, IODescState.FORGOTTEN)
             
         elif node.func.funcname == "fcloseall":
             ret_func = GraphFunc.RESET_STREAMS
@@ -278,18 +435,143 @@ class CallParser:
         func: str
     ) -> Function:
         
-        return Function(funcname=func, effect=IODescFunc.NONE) # TODO: proper effect
+        return Function.named(func) # TODO: proper effect
+
+
 
 
+def complete_call(
+    call: CallsNode,
+    index: int,
+    out_fd: Optional[List[IODesc]],
+    time: Optional[float],
+    internal_fds: Dict[int, IODesc]
+) -> None:
+    # the exit of a paired call, the node was created by its enter
+
+    call.call.out_fd = out_fd
+    call.index = index
+    if time is not None and call.call.time is not None:
+        call.call.duration = time - call.call.time
+
+    internal = internal_fds.pop(call.id, None)
+    if call.func.funcname == "fopen" and call.output_fd is not None:
+        call.output_fd[0].internal = internal
+
+
+
+def record_from_line(
+    line: str,
+    diagnostics: Optional[Diagnostics] = None
+) -> Optional[CallRecord]:
+
+    record = tokenize_line(line)
+    if record is None and diagnostics is not None:
+        diagnostics.report(Anomaly.UNMATCHED_LINE, detail=line)
+    return record
+
+
+
+def tokenize_line(
+    line: str
+) -> Optional[CallRecord]:
+    # a single pass with str methods, for lines of the form
+    # [<time> ms]  [   | ...]<func>[::<enter|exit><<call id>>](<name>=<value>, ...)[ [x<repeat>]]
+
+    start = line.find("(")
+    end = line.rfind(")")
+    if start < 0 or end < start:
+        return None
+
+    head = line[:start]
+    time = None
+    if " ms" in head:
+        ms = head.find(" ms")
+        stamp = head[:ms].strip()
+        if stamp.replace(".", "", 1).isdigit():
+            time = float(stamp)
+            head = head[ms + 3:]
+
+    func = head.lstrip(" |")
+    indent = head[:len(head) - len(func)]
+    if not indent or not func or " " in func or "|" in func:
+        return None
+
+    c_type = None
+    c_id = None
+    if "::" in func:
+        func, _, callpoint = func.partition("::")
+        c_type, _, c_id = callpoint.partition("<")
+        if c_type not in CALLPOINTS or not c_id.endswith(">") or not c_id[:-1].isdigit():
+            return None
+        c_id = int(c_id[:-1])
+
+    repeat = 1
+    if line.startswith(" [x", end + 1):
+        count = line[end + 4:line.find("]", end)]
+        if count.isdigit():
+            repeat = int(count)
+
+    return CallRecord(indent.count("|"), sys.intern(func), c_type, c_id, parse_args(line[start + 1:end]), repeat, time)
+
+
+
+def parse_args(
+    args: str
+) -> Dict[str, Any]:
+    # values are kept as they are logged, names and values are interned, most of them repeat on many lines
+
+    arg_dict = dict()
+    if not args:
+        return arg_dict
+    try:
+        for arg in args.split(", ") if '"' not in args else split_quoted(args):
+            name, value = arg.split("=", 1)
+            arg_dict[sys.intern(name)] = sys.intern(value)
+    except ValueError:
+        pass  # the arguments before the malformed one are kept
+    return arg_dict
+
+
+
+def split_quoted(
+    args: str
+) -> List[str]:
+    # at the ", " outside of the quoted strings, in which a quote is escaped with a backslash
+
+    parts = list()
+    start = at = 0
+    while True:
+        comma = args.find(", ", at)
+        if comma < 0:
+            break
+        quote = args.find('"', at)
+        if quote < 0 or comma < quote:
+            parts.append(args[start:comma])
+            start = at = comma + 2
+            continue
+        at = quote + 1
+        while True:
+            close = args.find('"', at)
+            if close < 0:
+                at = len(args)  # unterminated, to the end of the arguments
+                break
+            at = close + 1
+            escapes = close - len(args[:close].rstrip("\\"))
+            if escapes % 2 == 0:
+                break
+    parts.append(args[start:])
+    return parts
+
 
 
-def extract_uuid(
-    node: Union[UUID, CallsNode]
-) -> str:
+def extract_id(
+    node: Union[int, CallsNode, None]
+) -> Optional[int]:
 
     if isinstance(node, CallsNode):
-        return str(node.id)
-    return str(node)
+        return node.id
+    return node
 
 
 
@@ -298,27 +580,7 @@ def guess_io_type(
     func: Function
 ) -> IOConstructType:
 
-    new_guess = IOConstructType.UNKNOWN
-
-    if func.funcname in SOCKET_MANIPULATORS:
-        new_guess =  IOConstructType.SOCKET
-    elif func.funcname in MEMORY_MANIPULATORS:
-        new_guess = IOConstructType.MEMORY
-    elif func.funcname in DIRECTORY_MANIPULATORS:
-        new_guess = IOConstructType.DIRECTORY
-    elif func.funcname in LINK_MANIPULATORS:
-        new_guess = IOConstructType.LINK
-    elif func.funcname in TMP_MANIPULATORS:
-        new_guess = IOConstructType.TMP
-    elif func.funcname in PIPE_MANIPULATORS:
-        new_guess = IOConstructType.PIPE
-    elif func.funcname in FIFIO_MANIPULATORS:
-        new_guess = IOConstructType.FIFO
-    elif func.funcname in STREAM_MANIPULATORS:
-        new_guess = IOConstructType.STREAM
-    elif func.funcname in STDSTREAM_MANIPULATORS:
-        new_guess = IOConstructType.STDSTREAM
-    elif func.funcname in BINFILE_MANIPULATORS:
-        new_guess = IOConstructType.BINFILE
+    libcall = CATALOG.get(func.funcname)
+    new_guess = IOConstructType.UNKNOWN if libcall is None else libcall.category
 
     return new_guess if new_guess > old_guess else old_guess
@@ -1,29 +1,122 @@
 import networkx as nx
 import matplotlib.pyplot as plt
 import os 
+import pickle
 
-from typing import Generator, Any
+from typing import Generator, Any, List, Optional
 
 from themis.modules.transforming.parser import CallParser
-from themis.modules.transforming.grapher import Grapher, EdgeType
+from themis.modules.transforming.parallel import ParallelCallParser, CHUNK_SIZE
+from themis.modules.transforming.callgraph import CallGraph, EdgeType
+from themis.modules.transforming.grapher import Grapher
+from themis.modules.transforming.bintrace import BinaryTraceReader
+from themis.modules.transforming.cache import TransformCache
+from themis.modules.transforming.graphstore import read_graph, write_graph
+from themis.modules.transforming.diagnostics import Diagnostics
 from themis.modules.common.config import Config
+from themis.modules.common.tracefile import open_trace, find_trace, detect_compression
 
 
 def transform(
     config: Config,
+    save: bool,
+    diagnostics: Optional[Diagnostics] = None
+) -> CallGraph:
+    # the newest of the binary and the text trace, a binary one left from an earlier trace
+    # does not hide a text trace written since, the anomalies of the trace are counted in diagnostics
+
+    diagnostics = Diagnostics() if diagnostics is None else diagnostics
+    binary_path = f"{config.trace_dir}/libcalls_{config.executable}.bin"
+    filtered_path = f"{config.trace_dir}/libcalls_{config.executable}_filtered.txt"
+    existing = [path for path in (binary_path, find_trace(filtered_path)) if path is not None and os.path.exists(path)]
+    path = max(existing, key=os.path.getmtime) if existing else None
+    if path is None or not config.transform_cache:
+        return _transform(config, path, None, diagnostics, save)
+
+    cache = TransformCache(f"{config.result_dir}/cache/{config.executable}.json", path, (config.parse_max_pending, config.coalesce_calls))
+    # in verbose mode every anomaly is printed again, the cache only keeps samples of them
+    if cache.unchanged() and not diagnostics.verbose:
+        graph = cache.graph(diagnostics)
+        if save and not cache.saved(graph_paths(config)):
+            save_graph(config, graph)
+            cache.mark_saved(graph_paths(config))
+        return graph
+
+    return _transform(config, path, cache, diagnostics, save)
+
+
+
+def _transform(
+    config: Config,
+    path: Optional[str],
+    cache: Optional[TransformCache],
+    diagnostics: Diagnostics,
     save: bool
-) -> nx.Graph:
-    
-    with open(f"{config.trace_dir}/libcalls_{config.executable}_filtered.txt", "r") as callfile:
-        
-        parser = CallParser(callfile)
-        grapher = Grapher(parser)
+) -> CallGraph:
+
+    if cache is not None and cache.appended() and not diagnostics.verbose:
+        # only the lines after the checkpoint are parsed
+        grapher = cache.resume(diagnostics)
         graph = grapher.into_graph()
-        if save:
-            persist(config, graph)
-            to_gexf(config, graph)
+    elif path is not None and path.endswith(".bin"):
+        with BinaryTraceReader(path) as reader:
+            parser = CallParser(
+                reader.records(), structured=True, diagnostics=diagnostics, max_pending=config.parse_max_pending
+            )
+            grapher = Grapher(parser, config.coalesce_calls)
+            graph = grapher.into_graph()
+    elif path is not None and config.parse_processes != 1 and detect_compression(path) is None \
+            and os.path.getsize(path) > CHUNK_SIZE:
+        # large plain traces are split and parsed in a process pool
+        parser = ParallelCallParser(
+            path, config.parse_processes, diagnostics=diagnostics, max_pending=config.parse_max_pending
+        )
+        grapher = Grapher(parser, config.coalesce_calls)
+        graph = grapher.into_graph()
+    else:
+        with open_trace(f"{config.trace_dir}/libcalls_{config.executable}_filtered.txt") as callfile:
+            parser = CallParser(callfile, diagnostics=diagnostics, max_pending=config.parse_max_pending)
+            grapher = Grapher(parser, config.coalesce_calls)
+            graph = grapher.into_graph()
 
-        return graph
+    if save:
+        save_graph(config, graph)
+    if cache is not None:
+        cache.store(grapher, graph, diagnostics, graph_paths(config) if save else list())
+
+    return graph
+
+
+
+def save_graph(
+    config: Config,
+    graph: CallGraph
+) -> None:
+
+    persist(config, graph)
+    to_gexf(config, graph.to_networkx())
+
+
+
+def graph_paths(
+    config: Config
+) -> List[str]:
+    # the stored graph and the gexf of the executable
+
+    graph_dir = config.trusted_graph_dir if config.trust else config.dirty_graph_dir
+    return [f"{graph_dir}/{config.executable}_graph.thmg", f"{graph_dir}/{config.executable}.gexf"]
+
+
+
+def reconstruct_one_graph(
+    path: str
+) -> CallGraph:
+    # path of the stored graph, the pickle of former versions next to it is read if it was not migrated yet
+
+    pickle_path = f"{path[:-len('.thmg')]}.pickle"
+    if not os.path.exists(path) and os.path.exists(pickle_path):
+        return CallGraph.from_networkx(reconstruct_one_pickle(pickle_path))
+    return read_graph(path)
 
 
 
@@ -39,7 +132,9 @@ def reconstruct_one_pickle(
     path: str
 ) -> nx.DiGraph:
 
-    graph = nx.read_gpickle(path=path)
+    # as nx.read_gpickle did, which networkx 3 removed
+    with open(path, "rb") as file:
+        graph = pickle.load(file)
     return graph
 
 
@@ -83,9 +178,10 @@ def reconstruct_from_conf_gexf(
 
 def to_img(
     config: Config,
-    graph: nx.Graph
+    call_graph: CallGraph
 ) -> None:
 
+    graph = call_graph.to_networkx()
     labels = dict()
     for node in graph.nodes(data="call"):
         labels[node[0]] = node[1].call.func.funcname
@@ -101,10 +197,10 @@ def to_img(
 
 def persist(
     config: Config,
-    graph: nx.Graph
+    graph: CallGraph
 ) -> None:
 
-    nx.write_gpickle(graph, path=f"{config.trusted_graph_dir if config.trust else config.dirty_graph_dir}/{config.executable}_graph.pickle")
+    write_graph(graph, graph_paths(config)[0])
 
 
 
@@ -115,4 +211,4 @@ def to_gexf(
 
     from themis.modules.transforming.gexf import write_gexf
 
-    write_gexf(graph, path=f"{config.trusted_graph_dir if config.trust else config.dirty_graph_dir}/{config.executable}.gexf")
+    write_gexf(graph, path=graph_paths(config)[1])